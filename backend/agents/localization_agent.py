@@ -6,6 +6,18 @@ from google.genai import types
 from agents.json_utils import repair_json
 
 
+def _carry_diagram_params(content_agent_output: dict, result: dict) -> dict:
+    """diagram_params feed the SVG templates (utils/svg_diagrams.py) and must
+    keep their exact numbers — copy them over by id wherever the model dropped them."""
+    params_by_id = {
+        p.get("id"): p["diagram_params"]
+        for p in content_agent_output.get("problems", [])
+        if isinstance(p, dict) and isinstance(p.get("diagram_params"), dict)
+    }
+    for p in result.get("localized_problems", []):
+        if isinstance(p, dict) and not isinstance(p.get("diagram_params"), dict) and p.get("id") in params_by_id:
+            p["diagram_params"] = params_by_id[p["id"]]
+    return result
 
 
 def run_localization_agent(content_agent_output: dict, style_description: str = "",language: str = "english") -> dict:
@@ -35,19 +47,21 @@ def run_localization_agent(content_agent_output: dict, style_description: str =
 
     raw = repair_json(response.text)
     try:
-        result = json.loads(raw)
+        result = _carry_diagram_params(content_agent_output, json.loads(raw))
         print(f"[Localization Agent] Localized {len(result['localized_problems'])} problems")
         return result
     except json.JSONDecodeError as e:
         print(f"[Localization Agent] JSON parse error: {e} — retrying once")
         try:
+            # cache="refresh": the cached answer is the one that failed to parse
             response = generate_with_backoff(
                 model=SMART_MODEL,
                 contents=prompt,
-                config=config
+                config=config,
+                cache="refresh"
             )
             raw = repair_json(response.text)
-            result = json.loads(raw)
+            result = _carry_diagram_params(content_agent_output, json.loads(raw))
             print(f"[Localization Agent] Localized {len(result['localized_problems'])} problems (retry)")
             return result
         except json.JSONDecodeError as e2:
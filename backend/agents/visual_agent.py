@@ -1,9 +1,33 @@
 # visual_agent.py
+#
+# VISUAL_AGENT_MODE picks how diagrams are requested:
+#   "fanout" (default) one small request per diagram plus one for the mascot,
+#            at most VISUAL_FANOUT_CONCURRENCY in flight. Each SVG is validated
+#            on its own and only the failed ones are retried, so one malformed
+#            diagram no longer costs a retry of the whole batch, and latency
+#            follows the slowest diagram instead of the sum of all of them.
+#   "batch"  the original single request returning every diagram at once.
+#
+# Either way, problems whose diagram_params fit one of the SVG templates in
+# utils/svg_diagrams.py (number line, fraction bar, bar chart, area model, pie
+# chart) are drawn locally first; only the rest are sent to the model.
+import os
+import re
 import json
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
 from agents.content_agent import load_prompt_template
 from core.config import SMART_MODEL, generate_with_backoff
 from google.genai import types
 from agents.json_utils import repair_json
+from utils.svg_diagrams import render_diagram
+
+
+VISUAL_AGENT_MODE = os.getenv("VISUAL_AGENT_MODE", "fanout").strip().lower()
+VISUAL_FANOUT_CONCURRENCY = int(os.getenv("VISUAL_FANOUT_CONCURRENCY", "4"))
+VISUAL_FANOUT_MAX_ATTEMPTS = int(os.getenv("VISUAL_FANOUT_MAX_ATTEMPTS", "2"))
+
+DEFAULT_STYLE = "Clean, colorful, child-friendly math worksheet style."
 
 
 def _normalize_visual_result(parsed) -> dict:
@@ -22,6 +46,126 @@ def _normalize_visual_result(parsed) -> dict:
     return {"robot_mascot": "", "problem_visuals": []}
 
 
+# ── SVG VALIDATION ────────────────────────────────────────────────────────────
+
+# '&' not starting one of XML's own entities (HTML ones like &nbsp; included)
+_BARE_AMPERSAND = re.compile(r"&(?!(?:amp|lt|gt|quot|apos|#\d+|#x[0-9a-fA-F]+);)")
+
+
+def svg_problem(svg: str):
+    """Why an SVG string is unusable, or None when it is fine: it must be one
+    well-formed <svg> element with a viewBox (stray '&' are tolerated, the
+    HTML renderer accepts them)."""
+    if not isinstance(svg, str) or not svg.strip():
+        return "empty"
+    svg = svg.strip()
+    if not svg.startswith("<svg") or not svg.endswith("</svg>"):
+        return "not a single <svg> element"
+    try:
+        root = ET.fromstring(_BARE_AMPERSAND.sub("&amp;", svg))
+    except ET.ParseError as e:
+        return f"malformed XML ({e})"
+    if root.tag.split("}")[-1] != "svg":
+        return "root element is not <svg>"
+    if "viewBox" not in root.attrib:
+        return "missing viewBox"
+    return None
+
+
+# ── TEMPLATES ─────────────────────────────────────────────────────────────────
+
+def _render_templated(problems: list) -> tuple:
+    """(visuals drawn from SVG templates, problems still needing the model)."""
+    visuals, remaining = [], []
+    for problem in problems:
+        svg = render_diagram(problem.get("diagram_type"), problem.get("diagram_params"))
+        if svg is None or svg_problem(svg) is not None:
+            remaining.append(problem)
+            continue
+        visuals.append({
+            "problem_id": problem["id"],
+            "svg_code": svg,
+            "description": problem.get("diagram_description", ""),
+        })
+    if visuals:
+        print(f"[Visual Agent] Drew {len(visuals)} diagram(s) from templates, "
+              f"{len(remaining)} left for the model")
+    return visuals, remaining
+
+
+# ── FAN-OUT MODE ──────────────────────────────────────────────────────────────
+
+def _generate_svg_json(prompt: str, key: str, label: str) -> dict:
+    """One small request; retried (bypassing the LLM cache, which holds the
+    bad answer) until the SVG under `key` validates. A failed request counts
+    as a failed attempt, so one diagram's API error never sinks the others.
+    Returns {} on failure."""
+    config = types.GenerateContentConfig(temperature=0.0, response_mime_type="application/json")
+    for attempt in range(1, VISUAL_FANOUT_MAX_ATTEMPTS + 1):
+        try:
+            response = generate_with_backoff(
+                model=SMART_MODEL,
+                contents=prompt,
+                config=config,
+                cache=None if attempt == 1 else "refresh",
+            )
+            parsed = json.loads(repair_json(response.text or ""))
+        except json.JSONDecodeError as e:
+            problem = f"JSON parse error ({e})"
+        except Exception as e:
+            problem = f"request failed ({e})"
+        else:
+            problem = svg_problem(parsed.get(key)) if isinstance(parsed, dict) else "not a JSON object"
+            if problem is None:
+                return parsed
+        print(f"[Visual Agent] {label}: {problem} — attempt {attempt}/{VISUAL_FANOUT_MAX_ATTEMPTS}")
+    return {}
+
+
+def _run_visual_agent_fanout(problems: list, style_description: str) -> dict:
+    rules = load_prompt_template("visual_svg_rules.txt")
+    diagram_template = load_prompt_template("visual_diagram_prompt.txt")
+    mascot_prompt = load_prompt_template("visual_mascot_prompt.txt").format(
+        style_description=style_description, svg_rules=rules
+    )
+
+    def _diagram(problem: dict) -> dict:
+        prompt = diagram_template.format(
+            problem_json=json.dumps(problem, indent=2),
+            problem_id=json.dumps(problem["id"]),
+            style_description=style_description,
+            svg_rules=rules,
+        )
+        result = _generate_svg_json(prompt, "svg_code", f"Diagram for problem {problem['id']}")
+        if not result:
+            return {}
+        return {
+            "problem_id": problem["id"],       # trust our id, not the model's echo
+            "svg_code": result["svg_code"],
+            "description": result.get("description", ""),
+        }
+
+    with ThreadPoolExecutor(max_workers=max(1, VISUAL_FANOUT_CONCURRENCY)) as executor:
+        mascot_future = executor.submit(_generate_svg_json, mascot_prompt, "robot_mascot", "Mascot")
+        visuals = list(executor.map(_diagram, problems))
+        try:
+            mascot = mascot_future.result().get("robot_mascot", "")
+        except Exception as e:
+            print(f"[Visual Agent] Mascot failed — {e}")
+            mascot = ""
+
+    result = {
+        "robot_mascot": mascot,
+        "problem_visuals": [v for v in visuals if v],
+    }
+    failed = [p["id"] for p, v in zip(problems, visuals) if not v]
+    if failed:
+        result["failed_problem_ids"] = failed
+    print(f"[Visual Agent] Created {len(result['problem_visuals'])}/{len(problems)} diagrams "
+          f"in {len(problems) + 1} parallel request(s), mascot: {'Yes' if mascot else 'No'}")
+    return result
+
+
 def run_visual_agent(localization_output: dict, style_description: str = "", language: str = "english") -> dict:
     """
     Agent 3: Creates SVG diagrams for problems that need visuals
@@ -38,11 +182,28 @@ def run_visual_agent(localization_output: dict, style_description: str = "", lan
         print("[Visual Agent] No visuals needed, skipping.")
         return {"robot_mascot": "", "problem_visuals": []}
 
+    order = {p["id"]: i for i, p in enumerate(problems_needing_visuals)}
+    templated, remaining = _render_templated(problems_needing_visuals)
+    result = _run_visual_agent_model(remaining, style_description, language)
+    if templated:
+        templated_ids = {v["problem_id"] for v in templated}
+        visuals = [v for v in result.get("problem_visuals", []) if v.get("problem_id") not in templated_ids]
+        result["problem_visuals"] = sorted(visuals + templated,
+                                           key=lambda v: order.get(v.get("problem_id"), len(order)))
+    return result
+
+
+def _run_visual_agent_model(problems_needing_visuals: list, style_description: str, language: str) -> dict:
+    # Nothing left but the mascot: its small prompt beats the whole batch prompt
+    if VISUAL_AGENT_MODE == "fanout" or not problems_needing_visuals:
+        return _run_visual_agent_fanout(problems_needing_visuals, style_description or DEFAULT_STYLE)
+
     template = load_prompt_template("visual_prompt.txt")
 
     prompt = template.format(
         problems_json=json.dumps(problems_needing_visuals, indent=2),
-        style_description=style_description or "Clean, colorful, child-friendly math worksheet style.",
+        style_description=style_description or DEFAULT_STYLE,
+        svg_rules=load_prompt_template("visual_svg_rules.txt"),
         language=language  # new: output language chosen at generation time
     )
 
@@ -67,10 +228,12 @@ def run_visual_agent(localization_output: dict, style_description: str = "", lan
     except json.JSONDecodeError as e:
         print(f"[Visual Agent] JSON parse error: {e} — retrying once")
         try:
+            # cache="refresh": the cached answer is the one that failed to parse
             response = generate_with_backoff(
                 model=SMART_MODEL,
                 contents=prompt,
-                config=config
+                config=config,
+                cache="refresh"
             )
             raw = repair_json(response.text)
             result = _normalize_visual_result(json.loads(raw))
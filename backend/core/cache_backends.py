@@ -0,0 +1,200 @@
+# cache_backends.py - Small key/value stores with TTL and size-bounded eviction.
+#
+# Shared by the caches that sit in front of slow calls (LLM responses, OCR
+# output, ...). Every backend stores str values under str keys and exposes the
+# same three methods, so a cache can switch storage with one setting:
+#   get(key) -> Optional[str]      set(key, value, ttl)      stats() -> dict
+#
+#   memory  — in-process OrderedDict LRU. Fastest; lost on restart; per process.
+#   sqlite  — local file shared by every process on the pod (web + worker).
+#   redis   — a local/sidecar Redis; needs the optional `redis` package.
+#
+# This module deliberately imports nothing from core.config, so utils/ and
+# agents/ can use it without pulling in the Gemini/Qdrant/DB clients.
+
+import os
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+
+class MemoryCacheBackend:
+    """In-process LRU with per-entry expiry."""
+
+    name = "memory"
+
+    def __init__(self, max_entries: int = 1000):
+        self.max_entries = max_entries
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at is not None and expires_at < time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: str, ttl: Optional[float] = None) -> None:
+        expires_at = time.time() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def stats(self) -> dict:
+        return {"backend": self.name, "entries": len(self._data),
+                "max_entries": self.max_entries, "evictions": self.evictions}
+
+
+class SQLiteCacheBackend:
+    """Local-file store. Expired rows are ignored on read and purged during
+    pruning; over max_entries, the least-recently-used rows are evicted."""
+
+    name = "sqlite"
+
+    def __init__(self, path: str, table: str, max_entries: int = 10000):
+        self.path = path
+        self.table = table
+        self.max_entries = max_entries
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._writes_since_prune = 0
+        self.evictions = 0
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.table} ("
+                " key TEXT PRIMARY KEY,"
+                " value TEXT NOT NULL,"
+                " expires_at REAL,"
+                " last_used REAL NOT NULL)"
+            )
+            conn.execute(
+                f"CREATE INDEX IF NOT EXISTS idx_{self.table}_last_used ON {self.table} (last_used)"
+            )
+            self._conn = conn
+        return self._conn
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            conn = self._db()
+            row = conn.execute(
+                f"SELECT value, expires_at FROM {self.table} WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, expires_at = row
+            if expires_at is not None and expires_at < now:
+                conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+                conn.commit()
+                return None
+            conn.execute(f"UPDATE {self.table} SET last_used = ? WHERE key = ?", (now, key))
+            conn.commit()
+            return value
+
+    def set(self, key: str, value: str, ttl: Optional[float] = None) -> None:
+        now = time.time()
+        expires_at = now + ttl if ttl else None
+        with self._lock:
+            conn = self._db()
+            conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at, last_used) "
+                "VALUES (?, ?, ?, ?)",
+                (key, value, expires_at, now)
+            )
+            conn.commit()
+            self._writes_since_prune += 1
+            # Small caches prune more often so they never grow far past max_entries
+            if self._writes_since_prune >= min(100, self.max_entries):
+                self._writes_since_prune = 0
+                self._prune(conn, now)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            conn = self._db()
+            conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+            conn.commit()
+
+    def _prune(self, conn: sqlite3.Connection, now: float) -> None:
+        conn.execute(
+            f"DELETE FROM {self.table} WHERE expires_at IS NOT NULL AND expires_at < ?", (now,)
+        )
+        (count,) = conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()
+        if count > self.max_entries:
+            excess = count - int(self.max_entries * 0.9)
+            conn.execute(
+                f"DELETE FROM {self.table} WHERE key IN ("
+                f" SELECT key FROM {self.table} ORDER BY last_used ASC LIMIT ?)",
+                (excess,)
+            )
+            self.evictions += excess
+        conn.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            (count,) = self._db().execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()
+        return {"backend": self.name, "path": self.path, "entries": count,
+                "max_entries": self.max_entries, "evictions": self.evictions}
+
+
+class RedisCacheBackend:
+    """Redis store. TTL is native; size is bounded by the server's own
+    maxmemory/allkeys-lru policy, so no client-side eviction is needed."""
+
+    name = "redis"
+
+    def __init__(self, url: str, prefix: str):
+        try:
+            import redis
+        except ImportError as e:
+            raise ImportError(
+                "The redis cache backend needs the 'redis' package — pip install redis"
+            ) from e
+        self.prefix = prefix
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+
+    def get(self, key: str) -> Optional[str]:
+        return self.client.get(self.prefix + key)
+
+    def set(self, key: str, value: str, ttl: Optional[float] = None) -> None:
+        self.client.set(self.prefix + key, value, ex=int(ttl) if ttl else None)
+
+    def delete(self, key: str) -> None:
+        self.client.delete(self.prefix + key)
+
+    def stats(self) -> dict:
+        return {"backend": self.name, "prefix": self.prefix}
+
+
+def make_cache_backend(kind: str, *, sqlite_path: str, table: str,
+                       max_entries: int, redis_url: str = None):
+    """Builds a backend from a setting value: 'memory', 'sqlite' or 'redis'."""
+    kind = (kind or "memory").strip().lower()
+    if kind == "sqlite":
+        return SQLiteCacheBackend(sqlite_path, table=table, max_entries=max_entries)
+    if kind == "redis":
+        return RedisCacheBackend(redis_url or "redis://localhost:6379/0", prefix=f"{table}:")
+    if kind == "memory":
+        return MemoryCacheBackend(max_entries=max_entries)
+    raise ValueError(f"Unknown cache backend '{kind}' — use memory, sqlite or redis")
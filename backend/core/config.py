@@ -1,7 +1,6 @@
 # settings.py
 import os
-import time
-import random
+import json
 from dotenv import load_dotenv
 
 # NEW: use the modern google-genai package instead of google-generativeai
@@ -9,6 +8,10 @@ from google import genai
 from google.genai import types
 from google.genai import errors as genai_errors
 
+from core.llm_gateway import LLMGateway, PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND
+from core.llm_cache import LLMResponseCache
+from core.cache_backends import make_cache_backend
+
 from qdrant_client import QdrantClient
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
@@ -53,27 +56,56 @@ else:
     # Fallback: AI Studio via API key (original behavior)
     gemini_client = genai.Client(api_key=GOOGLE_API_KEY)
 
-def generate_with_backoff(model, contents, config=None, max_attempts=4):
+# Process-wide Gemini scheduler: per-model token buckets (requests/min and
+# tokens/min), interactive-before-background priority lanes, and a shared
+# cooldown on 429. Limits default to GEMINI_RPM / GEMINI_TPM; individual models
+# can be overridden with GEMINI_MODEL_LIMITS='{"gemini-3.6-flash": {"rpm": 150, "tpm": 2000000}}'.
+GEMINI_RPM = int(os.getenv("GEMINI_RPM", "60"))
+GEMINI_TPM = int(os.getenv("GEMINI_TPM", "1000000"))
+GEMINI_MODEL_LIMITS = json.loads(os.getenv("GEMINI_MODEL_LIMITS", "{}"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+
+llm_gateway = LLMGateway(
+    gemini_client,
+    default_rpm=GEMINI_RPM,
+    default_tpm=GEMINI_TPM,
+    max_concurrency=LLM_MAX_CONCURRENCY,
+    model_limits=GEMINI_MODEL_LIMITS,
+)
+
+
+def generate_with_backoff(model, contents, config=None, max_attempts=4,
+                          priority=PRIORITY_INTERACTIVE, cache=None):
     """
-    gemini_client.models.generate_content with exponential backoff on
-    429 RESOURCE_EXHAUSTED. The pipeline fires several Gemini calls
-    back-to-back per request, so per-minute quota can run out mid-pipeline;
-    waiting out the quota window (~15s/30s/60s + jitter) saves the request
-    instead of throwing away all the work done by earlier agents.
-    Any other error, and a 429 on the final attempt, is re-raised.
+    gemini_client.models.generate_content routed through the shared LLM gateway.
+    The pipeline fires several Gemini calls back-to-back per request, so
+    per-minute quota can run out mid-pipeline. Instead of every caller sleeping
+    its own thread on a 429, the gateway paces all calls against one token
+    bucket per model and pauses the whole bucket (~15s/30s/60s + jitter) when
+    the quota is hit, then retries in priority order.
+    Pass priority=PRIORITY_BACKGROUND for ingestion work so it yields to
+    teacher-facing generation. Any other error, and a 429 on the final
+    attempt, is re-raised.
+
+    Responses go through the LLM response cache when the call is deterministic
+    (temperature 0) or the caller opts in with cache=True. cache=False skips it;
+    cache="refresh" skips the read but stores the new answer (use it when
+    retrying after the cached answer turned out to be unusable).
     """
-    for attempt in range(1, max_attempts + 1):
-        try:
-            return gemini_client.models.generate_content(
-                model=model, contents=contents, config=config
-            )
-        except genai_errors.ClientError as e:
-            if e.code != 429 or attempt == max_attempts:
-                raise
-            delay = 15 * (2 ** (attempt - 1)) + random.uniform(0, 3)
-            print(f"[Gemini] 429 quota hit — retrying in {delay:.0f}s "
-                  f"(attempt {attempt}/{max_attempts})")
-            time.sleep(delay)
+    use_cache = llm_response_cache is not None and llm_response_cache.should_use(config, cache)
+    if use_cache and cache != "refresh":
+        cached = llm_response_cache.lookup(model, contents, config)
+        if cached is not None:
+            return cached
+    elif llm_response_cache is not None and not use_cache:
+        llm_response_cache.note_bypass()
+
+    response = llm_gateway.generate_sync(
+        model, contents, config=config, max_attempts=max_attempts, priority=priority
+    )
+    if use_cache:
+        llm_response_cache.store(model, contents, config, response)
+    return response
 
 
 # Qdrant setup — uses cloud if URL is provided, otherwise falls back to local memory
@@ -92,6 +124,31 @@ EMBEDDING_MODEL = "gemini-embedding-001"
 # The new collection is versioned as "pdf_collection_v2" to set the dimension to 3072 for the new embedding model. The old collection can be deleted after migration.........................................................
 COLLECTION_NAME = "pdf_collection_v2"
 
+# Local on-disk caches (embeddings, LLM responses, OCR output) are written under
+# this folder. Relative paths resolve against the working directory (/app in the container).
+CACHE_DIR = os.getenv("CACHE_DIR", ".cache")
+
+# LLM response cache used by generate_with_backoff (temperature-0 / opt-in calls only).
+# LLM_CACHE_BACKEND: "memory" (default), "sqlite", "redis", or "none" to disable.
+LLM_CACHE_BACKEND = os.getenv("LLM_CACHE_BACKEND", "memory").strip().lower()
+LLM_CACHE_TTL_SECONDS = float(os.getenv("LLM_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "5000"))
+LLM_CACHE_REDIS_URL = os.getenv("LLM_CACHE_REDIS_URL", "redis://localhost:6379/0")
+
+if LLM_CACHE_BACKEND == "none":
+    llm_response_cache = None
+else:
+    llm_response_cache = LLMResponseCache(
+        make_cache_backend(
+            LLM_CACHE_BACKEND,
+            sqlite_path=os.path.join(CACHE_DIR, "llm_responses.sqlite3"),
+            table="llm_response_cache",
+            max_entries=LLM_CACHE_MAX_ENTRIES,
+            redis_url=LLM_CACHE_REDIS_URL,
+        ),
+        ttl_seconds=LLM_CACHE_TTL_SECONDS,
+    )
+
 # PostgreSQL database setup via SQLAlchemy
 DATABASE_URL = os.getenv("DATABASE_URL")
 
@@ -0,0 +1,127 @@
+# llm_cache.py - Deterministic response cache for Gemini generate_content calls.
+#
+# Many prompts are sent verbatim more than once: the visual prompt for
+# unchanged problems during /generate/refine, the math-verifier extraction
+# prompt, the topic-extraction prompt when a chapter is re-ingested. For a
+# temperature-0 call the answer to an identical request is (for our purposes)
+# identical too, so we key the response text by
+#   sha256(model + contents + config)
+# and serve repeats from a cache backend (memory / sqlite / redis — see
+# core/cache_backends.py).
+#
+# Only DETERMINISTIC calls are cached automatically (config.temperature == 0).
+# Creative calls (temperature > 0) are only cached when the caller opts in with
+# cache=True, because teachers expect fresh problems on each request.
+
+import json
+import hashlib
+import threading
+from typing import Optional
+
+
+class CachedResponse:
+    """Stand-in for a GenerateContentResponse served from the cache. Every
+    caller only reads .text, so that is all we store."""
+
+    def __init__(self, text: str):
+        self.text = text
+        self.usage_metadata = None
+        self.from_cache = True
+
+
+def _config_to_dict(config) -> dict:
+    if config is None:
+        return {}
+    if isinstance(config, dict):
+        return config
+    if hasattr(config, "model_dump"):
+        return config.model_dump(mode="json", exclude_none=True)
+    return {"repr": repr(config)}
+
+
+def is_deterministic(config) -> bool:
+    temperature = _config_to_dict(config).get("temperature")
+    return temperature is not None and float(temperature) == 0.0
+
+
+def make_request_key(model: str, contents, config) -> str:
+    payload = json.dumps(
+        {"model": model, "contents": contents, "config": _config_to_dict(config)},
+        sort_keys=True, ensure_ascii=False, default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMResponseCache:
+    """Wraps a cache backend with the caching policy and hit/miss metrics."""
+
+    def __init__(self, backend, ttl_seconds: Optional[float]):
+        self.backend = backend
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.bypassed = 0
+        self.errors = 0
+
+    def should_use(self, config, cache) -> bool:
+        """cache=None → automatic (temperature-0 only); True → opt in;
+        False → never; "refresh" → skip the read but store the new answer."""
+        if cache is False:
+            return False
+        if cache in (True, "refresh"):
+            return True
+        return is_deterministic(config)
+
+    def lookup(self, model: str, contents, config) -> Optional[CachedResponse]:
+        key = make_request_key(model, contents, config)
+        try:
+            text = self.backend.get(key)
+        except Exception as e:
+            with self._lock:
+                self.errors += 1
+            print(f"[LLM Cache] Read failed, calling the model instead — {e}")
+            return None
+        with self._lock:
+            if text is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return CachedResponse(text)
+
+    def store(self, model: str, contents, config, response) -> None:
+        text = getattr(response, "text", None)
+        if not text:
+            return   # never cache an empty/blocked response
+        key = make_request_key(model, contents, config)
+        try:
+            self.backend.set(key, text, ttl=self.ttl_seconds)
+            with self._lock:
+                self.stores += 1
+        except Exception as e:
+            with self._lock:
+                self.errors += 1
+            print(f"[LLM Cache] Write failed, continuing without cache — {e}")
+
+    def note_bypass(self) -> None:
+        with self._lock:
+            self.bypassed += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            metrics = {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "stores": self.stores,
+                "bypassed_non_deterministic": self.bypassed,
+                "errors": self.errors,
+                "ttl_seconds": self.ttl_seconds,
+            }
+        try:
+            metrics.update(self.backend.stats())
+        except Exception as e:
+            metrics["backend_error"] = str(e)
+        return metrics
@@ -0,0 +1,247 @@
+# llm_gateway.py - Process-wide asyncio scheduler for every Gemini generate_content call.
+#
+# Before this, each agent called generate_content directly and, on a 429,
+# slept its own thread for 15-60s. Under load every in-flight request hit the
+# quota at once and they all stalled independently. The gateway fixes that by
+# putting ONE scheduler in front of the model:
+#   - a token bucket per model (requests/min AND tokens/min), so we pace calls
+#     to stay at the quota ceiling instead of overshooting it;
+#   - priority lanes: interactive generation (a teacher is waiting) always
+#     jumps ahead of background ingestion work in the queue;
+#   - a shared cooldown: a 429 pauses that model's bucket for everyone, rather
+#     than each caller discovering the exhausted quota on its own;
+#   - a global cap on concurrent in-flight calls.
+#
+# All scheduling runs on a single event loop in a daemon thread. Async code
+# awaits LLMGateway.agenerate(); the existing synchronous agents keep calling
+# core.config.generate_with_backoff(), which is a thin shim over generate_sync().
+
+import asyncio
+import heapq
+import itertools
+import random
+import threading
+import time
+from typing import Dict, Optional
+
+from google.genai import errors as genai_errors
+
+
+PRIORITY_INTERACTIVE = 0   # a teacher is waiting on this response
+PRIORITY_BACKGROUND = 1    # ingestion / batch work — yields to interactive calls
+
+
+def estimate_tokens(contents) -> int:
+    """Rough prompt-size estimate (~4 chars per token) used to reserve TPM
+    budget before the call. The real count from usage_metadata settles it after."""
+    if isinstance(contents, str):
+        return max(1, len(contents) // 4)
+    if isinstance(contents, (list, tuple)):
+        return max(1, sum(estimate_tokens(c) for c in contents))
+    if isinstance(contents, dict):
+        if "text" in contents:
+            return estimate_tokens(contents["text"])
+        if "parts" in contents:
+            return estimate_tokens(contents["parts"])
+        # inline images etc. — Gemini bills a fixed ~258 tokens per image
+        return 258
+    return max(1, len(str(contents)) // 4)
+
+
+class _ModelLimiter:
+    """Token bucket for one model. Waiters are served strictly in
+    (priority, arrival) order, so interactive calls overtake queued background ones."""
+
+    def __init__(self, rpm: int, tpm: int):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.request_budget = float(rpm)
+        self.token_budget = float(tpm)
+        self.updated = time.monotonic()
+        self.cooldown_until = 0.0
+
+        self._waiters = []
+        self._seq = itertools.count()
+        self._cond = asyncio.Condition()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        elapsed = now - self.updated
+        self.updated = now
+        self.request_budget = min(self.rpm, self.request_budget + elapsed * self.rpm / 60.0)
+        self.token_budget = min(self.tpm, self.token_budget + elapsed * self.tpm / 60.0)
+
+    def _seconds_until_ready(self, tokens: int) -> float:
+        now = time.monotonic()
+        waits = [self.cooldown_until - now]
+        if self.request_budget < 1:
+            waits.append((1 - self.request_budget) * 60.0 / self.rpm)
+        if self.token_budget < tokens:
+            waits.append((tokens - self.token_budget) * 60.0 / self.tpm)
+        return max(0.0, *waits)
+
+    async def acquire(self, priority: int, tokens: int) -> None:
+        # A single prompt larger than the whole TPM budget can still go through
+        # once the bucket is full — it just waits for a full minute of budget.
+        tokens = min(tokens, self.tpm)
+        entry = (priority, next(self._seq))
+
+        async with self._cond:
+            heapq.heappush(self._waiters, entry)
+            try:
+                while True:
+                    self._refill()
+                    wait = None
+                    if self._waiters[0] == entry:
+                        wait = self._seconds_until_ready(tokens)
+                        if wait <= 0:
+                            heapq.heappop(self._waiters)
+                            self.request_budget -= 1
+                            self.token_budget -= tokens
+                            # let the next waiter re-check now that the head moved
+                            self._cond.notify_all()
+                            return
+                    try:
+                        await asyncio.wait_for(self._cond.wait(), timeout=wait)
+                    except asyncio.TimeoutError:
+                        pass
+            except BaseException:
+                if entry in self._waiters:
+                    self._waiters.remove(entry)
+                    heapq.heapify(self._waiters)
+                    self._cond.notify_all()
+                raise
+
+    async def settle(self, reserved: int, actual: Optional[int]) -> None:
+        """Corrects the reservation with the real token count once known."""
+        if actual is None:
+            return
+        async with self._cond:
+            self._refill()
+            self.token_budget -= (actual - min(reserved, self.tpm))
+
+    async def penalize(self, delay: float) -> None:
+        """A 429 means the quota is exhausted for EVERY caller, not just this
+        one — pause the whole bucket and drain it."""
+        async with self._cond:
+            self.cooldown_until = max(self.cooldown_until, time.monotonic() + delay)
+            self.request_budget = min(self.request_budget, 0.0)
+            self._cond.notify_all()
+
+
+class LLMGateway:
+    """Shared, rate-limited front door for gemini_client.models.generate_content."""
+
+    def __init__(
+        self,
+        client,
+        default_rpm: int,
+        default_tpm: int,
+        max_concurrency: int,
+        model_limits: Optional[Dict[str, dict]] = None,
+    ):
+        self.client = client
+        self.default_rpm = default_rpm
+        self.default_tpm = default_tpm
+        self.max_concurrency = max_concurrency
+        self.model_limits = model_limits or {}
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_lock = threading.Lock()
+        self._limiters: Dict[str, _ModelLimiter] = {}
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+        self.calls = 0
+        self.rate_limited = 0
+
+    # ── event loop ────────────────────────────────────────────────────────────
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        with self._loop_lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(
+                    target=loop.run_forever, name="llm-gateway", daemon=True
+                )
+                thread.start()
+                self._loop = loop
+            return self._loop
+
+    def _limiter(self, model: str) -> _ModelLimiter:
+        if model not in self._limiters:
+            limits = self.model_limits.get(model, {})
+            self._limiters[model] = _ModelLimiter(
+                rpm=int(limits.get("rpm", self.default_rpm)),
+                tpm=int(limits.get("tpm", self.default_tpm)),
+            )
+        return self._limiters[model]
+
+    # ── scheduling ────────────────────────────────────────────────────────────
+
+    async def _generate(self, model, contents, config, max_attempts, priority):
+        # Runs on the gateway loop only, so limiter/semaphore state is never shared across loops.
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        limiter = self._limiter(model)
+        reserved = estimate_tokens(contents)
+
+        for attempt in range(1, max_attempts + 1):
+            await limiter.acquire(priority, reserved)
+            async with self._semaphore:
+                try:
+                    self.calls += 1
+                    response = await self.client.aio.models.generate_content(
+                        model=model, contents=contents, config=config
+                    )
+                except genai_errors.ClientError as e:
+                    if e.code != 429 or attempt == max_attempts:
+                        raise
+                    self.rate_limited += 1
+                    delay = 15 * (2 ** (attempt - 1)) + random.uniform(0, 3)
+                    print(f"[Gemini] 429 quota hit — pausing '{model}' for {delay:.0f}s "
+                          f"(attempt {attempt}/{max_attempts})")
+                    await limiter.penalize(delay)
+                    continue
+
+            usage = getattr(response, "usage_metadata", None)
+            await limiter.settle(reserved, getattr(usage, "total_token_count", None))
+            return response
+
+    async def agenerate(self, model, contents, config=None, max_attempts=4, priority=PRIORITY_INTERACTIVE):
+        """Async entry point. Safe to await from any event loop (e.g. FastAPI's)."""
+        loop = self._ensure_loop()
+        coro = self._generate(model, contents, config, max_attempts, priority)
+        if asyncio.get_running_loop() is loop:
+            return await coro
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, loop))
+
+    def generate_sync(self, model, contents, config=None, max_attempts=4, priority=PRIORITY_INTERACTIVE):
+        """Blocking shim for the existing synchronous agents. The calling thread
+        waits on a future while the shared scheduler handles pacing and 429s."""
+        loop = self._ensure_loop()
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            raise RuntimeError("generate_sync() called from the gateway loop — use agenerate()")
+        future = asyncio.run_coroutine_threadsafe(
+            self._generate(model, contents, config, max_attempts, priority), loop
+        )
+        return future.result()
+
+    def stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "rate_limited": self.rate_limited,
+            "max_concurrency": self.max_concurrency,
+            "models": {
+                model: {
+                    "rpm": lim.rpm,
+                    "tpm": lim.tpm,
+                    "queued": len(lim._waiters),
+                    "cooling_down": lim.cooldown_until > time.monotonic(),
+                }
+                for model, lim in self._limiters.items()
+            },
+        }
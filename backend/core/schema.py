@@ -0,0 +1,101 @@
+# schema.py - Additive column sync for tables that already exist.
+#
+# Base.metadata.create_all() only creates MISSING TABLES — it never alters an
+# existing one. We don't run a migration tool, so when a model gains a new
+# column, deployed databases would be missing it and every query on that table
+# would fail. ensure_added_columns() closes that gap for the one change we make
+# routinely: adding a nullable column. It compares each mapped table with the
+# live database and issues ALTER TABLE ... ADD COLUMN for whatever is missing.
+# ADD COLUMN alone would leave an added column without the index or foreign key
+# its model declares (e.g. the diff lookups on content_embedding.content_hash
+# would full-scan), so the declared indexes and foreign keys of existing tables
+# are created too when the database lacks them.
+#
+# Renames, type changes and drops are NOT handled here — do those by hand.
+
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import AddConstraint, CreateColumn
+
+
+def ensure_added_columns(engine, metadata) -> list:
+    """Adds columns that exist on the models but not in the database.
+    Returns the list of 'table.column' names that were added."""
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    added = []
+
+    with engine.begin() as conn:
+        for table in metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue   # create_all() handles brand-new tables
+            present = {col["name"] for col in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in present:
+                    continue
+                # CreateColumn renders "name TYPE [DEFAULT ...]" in the engine's dialect
+                ddl = str(CreateColumn(column).compile(dialect=engine.dialect))
+                quoted_table = engine.dialect.identifier_preparer.quote(table.name)
+                # SQLite has no ADD COLUMN IF NOT EXISTS (the column was just checked anyway)
+                guard = "" if engine.dialect.name == "sqlite" else "IF NOT EXISTS "
+                conn.execute(text(f"ALTER TABLE {quoted_table} ADD COLUMN {guard}{ddl}"))
+                added.append(f"{table.name}.{column.name}")
+
+    if added:
+        print(f"[Schema] Added missing column(s): {', '.join(added)}")
+    ensure_declared_indexes(engine, metadata, existing_tables)
+    ensure_declared_foreign_keys(engine, metadata, existing_tables)
+    return added
+
+
+def ensure_declared_indexes(engine, metadata, existing_tables) -> list:
+    """Creates the model-declared indexes (index=True / Index(...)) that an
+    existing table is missing. Returns the names of the created indexes."""
+    inspector = inspect(engine)
+    created = []
+    for table in metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        present = {ix["name"] for ix in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in present:
+                continue
+            try:
+                # checkfirst: the web app and the worker may both get here at startup
+                with engine.begin() as conn:
+                    index.create(bind=conn, checkfirst=True)
+                created.append(index.name)
+            except Exception as e:
+                print(f"[Schema] Could not create index {index.name} — {e}")
+
+    if created:
+        print(f"[Schema] Created missing index(es): {', '.join(created)}")
+    return created
+
+
+def ensure_declared_foreign_keys(engine, metadata, existing_tables) -> list:
+    """Adds the model-declared foreign keys that an existing table is missing.
+    A constraint the existing rows violate is logged and skipped, not fatal.
+    Returns 'table.column' for every foreign key that was added."""
+    if engine.dialect.name == "sqlite":
+        return []   # SQLite cannot add a constraint to an existing table
+    inspector = inspect(engine)
+    added = []
+    for table in metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        present = {tuple(fk["constrained_columns"]) for fk in inspector.get_foreign_keys(table.name)}
+        for constraint in table.foreign_key_constraints:
+            columns = tuple(constraint.column_keys)
+            if columns in present or constraint.referred_table.name not in existing_tables:
+                continue
+            label = f"{table.name}.{','.join(columns)}"
+            try:
+                with engine.begin() as conn:
+                    conn.execute(AddConstraint(constraint))
+                added.append(label)
+            except Exception as e:
+                print(f"[Schema] Could not add foreign key on {label} — {e}")
+
+    if added:
+        print(f"[Schema] Added missing foreign key(s): {', '.join(added)}")
+    return added
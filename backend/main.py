@@ -13,6 +13,7 @@ from fastapi.middleware.cors import CORSMiddleware
 
 # Config (DB engine / Base) and vector-store bootstrap
 from core.config import Base, engine
+from core.schema import ensure_added_columns
 from services import rag_service
 
 # Routers — each owns a slice of the API surface
@@ -34,6 +35,7 @@ async def lifespan(app: FastAPI):
     # On startup: create all SQL tables (if they don't exist) and Qdrant collection
     print("Starting up: Creating SQL tables and Qdrant vector collection...")
     Base.metadata.create_all(bind=engine)
+    ensure_added_columns(engine, Base.metadata)
     rag_service.init_vector_db()
 
     # The 'yield' is where the application actually runs and handles requests
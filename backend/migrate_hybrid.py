@@ -0,0 +1,75 @@
+# migrate_hybrid.py - One-off migration of the Qdrant collection to hybrid
+# (dense + BM25 sparse) search. Run by hand, once, from backend/:
+#     python migrate_hybrid.py [--wait SECONDS]
+#
+# Qdrant cannot add a sparse vector to an existing collection, so every point
+# is copied into a new collection and COLLECTION_NAME becomes an alias of it
+# (services/hybrid_search.migrate_to_hybrid_collection). Nothing may write to
+# the collection while it is copied, so this command:
+#   1. takes the ingestion pause lock exclusively (services/job_queue.py) —
+#      workers stop claiming jobs and file deletes are refused with a 503;
+#      a second copy of this command finds the lock taken and exits;
+#   2. waits until the jobs already running have finished;
+#   3. migrates, then releases the lock (also released if it crashes, since
+#      the lock belongs to this process's database connection).
+# Web and worker processes only REPORT a dense-only collection at startup;
+# they never migrate on their own.
+
+import argparse
+import sys
+import time
+
+from core.config import engine, SessionLocal
+from services import job_queue
+from services.hybrid_search import (
+    collection_available, hybrid_enabled, migrate_to_hybrid_collection, resume_hybrid_migration,
+)
+
+
+def _wait_for_running_jobs(timeout: float) -> bool:
+    deadline = time.monotonic() + timeout
+    while True:
+        db = SessionLocal()
+        try:
+            running = job_queue.active_job_count(db)
+        finally:
+            db.close()
+        if running == 0:
+            return True
+        if time.monotonic() >= deadline:
+            return False
+        print(f"[Migrate] Waiting for {running} running ingestion job(s) to finish...")
+        time.sleep(10)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Move the Qdrant collection to hybrid search.")
+    parser.add_argument("--wait", type=float, default=job_queue.INGEST_VISIBILITY_TIMEOUT,
+                        help="seconds to wait for running ingestion jobs (default: the visibility timeout)")
+    args = parser.parse_args()
+
+    with engine.connect() as conn:
+        if not job_queue.pause_ingestion(conn):
+            print("[Migrate] Could not take the ingestion pause lock (another migration is running, or a worker is mid-claim) — try again.")
+            return 1
+        conn.commit()
+        try:
+            print("[Migrate] Ingestion paused.")
+            if not collection_available():
+                # An earlier run stopped between dropping the source and creating the alias
+                return 0 if resume_hybrid_migration() else 1
+            if hybrid_enabled(refresh=True):
+                print("[Migrate] The collection already has the sparse vector — nothing to do.")
+                return 0
+            if not _wait_for_running_jobs(args.wait):
+                print("[Migrate] Ingestion jobs are still running — try again later.")
+                return 1
+            return 0 if migrate_to_hybrid_collection() else 1
+        finally:
+            job_queue.resume_ingestion(conn)
+            conn.commit()
+            print("[Migrate] Ingestion resumed.")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
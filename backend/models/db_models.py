@@ -1,8 +1,8 @@
 # models.py - This file defines the SQLAlchemy models that represent the database schema for our application. It includes tables for users, classes, subjects, chapters, topics, learning objectives, upload requests, ingestion jobs, content embeddings, teacher sessions, generated content, feedback, saved content, learning sessions, student interactions, remediation decisions, and topic performance. Each model corresponds to a table in the database and defines the structure of the data we will be working with.
-from sqlalchemy import TIMESTAMP, Column, Integer, String, Text, Boolean, Date, BigInteger, Numeric, ForeignKey
+from sqlalchemy import TIMESTAMP, Column, Integer, String, Text, Boolean, Date, BigInteger, Numeric, ForeignKey, LargeBinary
 from sqlalchemy.sql import func
-from sqlalchemy.orm import relationship
-from sqlalchemy import CheckConstraint
+from sqlalchemy.orm import relationship, deferred
+from sqlalchemy import CheckConstraint, UniqueConstraint
 from core.config import Base
 
 
@@ -77,6 +77,9 @@ class Chapter(Base):
     subject_id = Column(Integer,ForeignKey("subject.subject_id"))
     chapter_no = Column(Integer)
     name = Column(String(255),nullable=False)
+    # Bumped whenever the chapter's chunks change (ingestion, file deletion);
+    # part of every retrieval cache key (services/retrieval_cache.py)
+    content_version = Column(Integer, nullable=False, server_default="0")
     
     
 class Topic(Base):
@@ -86,6 +89,10 @@ class Topic(Base):
     chapter_id = Column(Integer,ForeignKey("chapter.chapter_id"))
     name = Column(String(255),nullable=False)
     description = Column(Text) 
+    # Query embedding of `description`, computed once at ingestion
+    # (services/topic_embeddings.py) — float32 bytes plus the model that made it.
+    description_embedding = deferred(Column(LargeBinary, nullable=True))
+    description_embedding_model = Column(String(100), nullable=True)
     
     
 class LearningObjective(Base):
@@ -120,6 +127,33 @@ class IngestionJob(Base):
     job_status = Column(String(50))
     chunk_count = Column(Integer, default=0)
 
+    # ── Durable queue fields (see services/job_queue.py) ──────────────────────
+    # The upload itself is stored on the job so any worker can pick it up,
+    # even after a restart. deferred() keeps it out of ordinary job queries.
+    chapter_id = Column(Integer, ForeignKey("chapter.chapter_id"), nullable=True)
+    source_type = Column(String(50), default="nctb")
+    file_name = Column(String(255))
+    file_size = Column(BigInteger)
+    file_data = deferred(Column(LargeBinary, nullable=True))
+    attempts = Column(Integer, default=0)
+    next_attempt_at = Column(TIMESTAMP, nullable=True)
+    locked_by = Column(String(255), nullable=True)
+    locked_at = Column(TIMESTAMP, nullable=True)
+    created_at = Column(TIMESTAMP, server_default=func.now())
+
+
+class IngestionCheckpoint(Base):
+    __tablename__ = "ingestion_checkpoint"
+    __table_args__ = (UniqueConstraint("job_id", "stage", name="uq_ingestion_checkpoint_job_stage"),)
+
+    # One row per completed pipeline stage ('pages', 'topics', 'chunks',
+    # 'embeddings') so a failed job resumes instead of starting over.
+    checkpoint_id = Column(Integer, primary_key=True)
+    job_id = Column(Integer, ForeignKey("ingestion_job.job_id"), index=True, nullable=False)
+    stage = Column(String(50), nullable=False)
+    payload = deferred(Column(Text, nullable=False))
+    created_at = Column(TIMESTAMP, server_default=func.now())
+
 
 class UploadMetadata(Base):
     __tablename__ = "upload_metadata"
@@ -137,7 +171,15 @@ class ContentEmbedding(Base):
     __tablename__ = "content_embedding"
 
     embedding_id = Column(Integer, primary_key=True)
-    embedding_vector = Column(Text)
+    # Legacy JSON-text vectors (~60 KB per 3072-dim row). New rows use
+    # embedding_blob instead — see services/content_embeddings.py.
+    embedding_vector = deferred(Column(Text))
+    # Packed little-endian float32 bytes (~12 KB per row)
+    embedding_blob = deferred(Column(LargeBinary, nullable=True))
+    embedding_dim = Column(Integer, nullable=True)
+    # Identity used by incremental re-ingestion (services/incremental_ingest.py)
+    content_hash = Column(String(64), index=True, nullable=True)
+    qdrant_point_id = Column(String(64), index=True, nullable=True)
     embedding_metadata = Column(Text)
     chapter_id = Column(Integer, ForeignKey("chapter.chapter_id"))
     job_id = Column(Integer, ForeignKey("ingestion_job.job_id"))
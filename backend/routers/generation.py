@@ -28,6 +28,7 @@ from agents.compiler_agent import run_compiler_agent
 from fastapi.responses import HTMLResponse
 import json
 import ast
+from functools import cached_property
 
 router = APIRouter(prefix="/generate", tags=["Worksheet Generation"])
 
@@ -260,6 +261,7 @@ async def create_study_note(
             "session_id": None,
             "html": result["html"],
             "concept_blocks_count": len(result.get("note", {}).get("concept_blocks", [])),
+            "timings": result.get("timings", {}),
             "warning": "Study note generated successfully but could not be saved to database."
         }
 
@@ -267,7 +269,8 @@ async def create_study_note(
         "content_id": generated.content_id,
         "session_id": teacher_session.session_id,
         "html": result["html"],
-        "concept_blocks_count": len(result.get("note", {}).get("concept_blocks", []))
+        "concept_blocks_count": len(result.get("note", {}).get("concept_blocks", [])),
+        "timings": result.get("timings", {})
     }
 
 
@@ -350,6 +353,71 @@ def get_worksheet(content_id: int, db: Session = Depends(get_db)):
     }
 
 
+class _RefineDeps:
+    """
+    Memoized inputs of /generate/refine. The route calls load_curriculum()
+    up front, so a missing row 404s before any LLM call; the rest is
+    computed the first time a refinement handler (or the compiler) reads it:
+      topic / chapter / subject  one joined query, 404 if any row is missing
+      curriculum_context         embedding + Qdrant search — only handle_add needs it
+      old_visuals                the stored visual output, parsed once
+    """
+
+    def __init__(self, db: Session, content: GeneratedContent):
+        self.db = db
+        self.content = content
+
+    @cached_property
+    def _curriculum_rows(self):
+        row = (
+            self.db.query(Topic, Chapter, Subject)
+            .outerjoin(Chapter, Chapter.chapter_id == Topic.chapter_id)
+            .outerjoin(Subject, Subject.subject_id == Chapter.subject_id)
+            .filter(Topic.topic_id == self.content.topic_id)
+            .first()
+        )
+        if not row:
+            raise HTTPException(status_code=404, detail="Topic not found")
+        topic, chapter, subject = row
+        if not chapter:
+            raise HTTPException(status_code=404, detail="Chapter not found")
+        if not subject:
+            raise HTTPException(status_code=404, detail="Subject not found")
+        return topic, chapter, subject
+
+    def load_curriculum(self) -> tuple:
+        """(topic, chapter, subject), loading them on first call; raises the
+        404 if any of the rows is missing."""
+        return self._curriculum_rows
+
+    @property
+    def topic(self) -> Topic:
+        return self._curriculum_rows[0]
+
+    @property
+    def chapter(self) -> Chapter:
+        return self._curriculum_rows[1]
+
+    @property
+    def subject(self) -> Subject:
+        return self._curriculum_rows[2]
+
+    @cached_property
+    def curriculum_context(self) -> str:
+        return search_curriculum_context(self.content.topic_id, self.topic.name, self.chapter.chapter_id)
+
+    @cached_property
+    def old_visuals(self) -> dict:
+        try:
+            if self.content.explanation:
+                parsed_v = ast.literal_eval(self.content.explanation)
+                if isinstance(parsed_v, dict):
+                    return parsed_v
+        except (ValueError, SyntaxError):
+            pass
+        return {}
+
+
 @router.post("/refine")
 async def refine_worksheet(
     content_id: int = Form(...),
@@ -375,21 +443,11 @@ async def refine_worksheet(
     if not content:
         raise HTTPException(status_code=404, detail="Content not found")
 
-    # Look up topic, chapter, subject (same pattern as create_worksheet)
-    topic = db.query(Topic).filter(Topic.topic_id == content.topic_id).first()
-    if not topic:
-        raise HTTPException(status_code=404, detail="Topic not found")
-
-    chapter = db.query(Chapter).filter(Chapter.chapter_id == topic.chapter_id).first()
-    if not chapter:
-        raise HTTPException(status_code=404, detail="Chapter not found")
-
-    subject = db.query(Subject).filter(Subject.subject_id == chapter.subject_id).first()
-    if not subject:
-        raise HTTPException(status_code=404, detail="Subject not found")
-
-    # Search curriculum context (needed if adding problems)
-    curriculum_context = search_curriculum_context(content.topic_id, topic.name,chapter.chapter_id)
+    # Curriculum context and old visuals are resolved on first use only — e.g.
+    # a remove-only refine never embeds or searches Qdrant. Topic/chapter/subject
+    # are loaded now so a missing row 404s before any LLM call is made.
+    deps = _RefineDeps(db, content)
+    deps.load_curriculum()
 
     # First: extract only remove_refs so we can remap remaining refinements
     # against the renumbered problem IDs before splitting into other groups.
@@ -410,13 +468,14 @@ async def refine_worksheet(
     visual_refs = [r for r in refinements_list if r["type"] == "add_visuals"]
 
     if add_refs:
-        problems = handle_add(problems, add_refs, topic, subject, chapter, content, curriculum_context)
+        problems = handle_add(problems, add_refs, deps.topic, deps.subject, deps.chapter, content,
+                              deps.curriculum_context)
 
     if diff_refs:
-        problems = handle_difficulty(problems, diff_refs, topic, subject, chapter, content)
+        problems = handle_difficulty(problems, diff_refs, deps.topic, deps.subject, deps.chapter, content)
 
     if simplify_refs:
-        problems = handle_simplify(problems, topic, subject, chapter, content)
+        problems = handle_simplify(problems, deps.topic, deps.subject, deps.chapter, content)
 
     if visual_refs:
         problems = handle_visuals(problems, visual_refs)
@@ -447,6 +506,7 @@ async def refine_worksheet(
                     "solution_steps": p["solution_steps"],
                     "needs_diagram": p.get("needs_diagram", False),
                     "diagram_type": p.get("diagram_type", "none"),
+                    "diagram_params": p.get("diagram_params"),
                     "diagram_description": p.get("diagram_description", "")
                 }
                 for p in needs_processing
@@ -457,19 +517,9 @@ async def refine_worksheet(
     all_localized.sort(key=lambda p: p["id"])
     localization_output = {"localized_problems": all_localized}
 
-    # ─── Load old visuals from DB ───
-    old_visuals = {}
-    try:
-        if content.explanation:
-            parsed_v = ast.literal_eval(content.explanation)
-            if isinstance(parsed_v, dict):
-                old_visuals = parsed_v
-    except (ValueError, SyntaxError):
-        old_visuals = {}
-
-    # Build old_visual_map (remapping IDs if remove happened)
+    # ─── Old visuals from DB (remapping IDs if remove happened) ───
     old_visual_map = {}
-    for v in old_visuals.get("problem_visuals", []):
+    for v in deps.old_visuals.get("problem_visuals", []):
         old_pid = v.get("problem_id")
         if id_remap is not None:
             if old_pid in id_remap:
@@ -518,7 +568,7 @@ async def refine_worksheet(
             final_visuals.append(old_visual_map[pid])
 
     visual_output = {
-        "robot_mascot": old_visuals.get("robot_mascot", new_visual_output.get("robot_mascot", "")),
+        "robot_mascot": deps.old_visuals.get("robot_mascot", new_visual_output.get("robot_mascot", "")),
         "problem_visuals": final_visuals
     }
 
@@ -526,10 +576,10 @@ async def refine_worksheet(
     worksheet_html = run_compiler_agent(
         localization_output=localization_output,
         visual_output=visual_output,
-        class_name=subject.class_name,
-        subject_name=subject.name,
-        chapter_name=chapter.name,
-        topic_name=topic.name,
+        class_name=deps.subject.class_name,
+        subject_name=deps.subject.name,
+        chapter_name=deps.chapter.name,
+        topic_name=deps.topic.name,
         difficulty=content.difficulty_level,
         style_description=""
     )
@@ -832,6 +882,19 @@ def debug_retrieved_chunks(topic_id: int, db: Session = Depends(get_db)):
     }
 
 
+@router.get("/debug/cache-stats")
+def debug_cache_stats():
+    from services.embedding_cache import embedding_cache
+    from core.config import llm_gateway, llm_response_cache
+    from services.retrieval_cache import retrieval_cache
+    return {
+        "embedding_cache": embedding_cache.stats(),
+        "retrieval_cache": retrieval_cache.stats(),
+        "llm_gateway": llm_gateway.stats(),
+        "llm_response_cache": llm_response_cache.stats() if llm_response_cache else {"enabled": False},
+    }
+
+
 @router.get("/debug/retrieved-chunks/chapter/{chapter_id}")
 def debug_retrieved_chunks_chapter(chapter_id: int, db: Session = Depends(get_db)):
     chapter = db.query(Chapter).filter(Chapter.chapter_id == chapter_id).first()
@@ -880,7 +943,7 @@ def debug_retrieved_chunks_subject(subject_id: int, db: Session = Depends(get_db
     if not subject:
         raise HTTPException(status_code=404, detail="Subject not found")
 
-    debug_result = debug_bulk_subject_chunks(subject_id)
+    debug_result = debug_bulk_subject_chunks(subject_id, subject.name)
 
     if debug_result.get("error"):
         return {
@@ -2,14 +2,16 @@
 # MODIFIED: Now accepts chapter_id instead of topic_id.
 # Topics are auto-extracted from the PDF by Gemini and inserted into the DB.
 
+from datetime import datetime
 from typing import Optional
-from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Depends, BackgroundTasks
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Depends
 from sqlalchemy.orm import Session
 from pydantic import BaseModel
 from core.config import get_db
 from services import rag_service
 from models.db_models import UploadRequest, IngestionJob, Chapter
-from services.ingestion_service import run_ingestion_pipeline
+from services import job_queue
+from services.ingestion_checkpoints import completed_stages, STAGES
 
 router = APIRouter(prefix="/ingest", tags=["Curriculum Ingestion"])
 
@@ -28,13 +30,14 @@ class JobStatusResponse(BaseModel):
     job_status: str
     chunk_count: int
     error_message: Optional[str] = None
+    attempts: int = 0
+    next_attempt_at: Optional[datetime] = None
 
 
 # ── POST /ingest/upload ───────────────────────────────────────────────────────
 
 @router.post("/upload", response_model=UploadResponse)
 async def upload_curriculum(
-    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
     # CHANGED: chapter_id instead of topic_id
     # Topics will be auto-extracted from the PDF by Gemini
@@ -52,7 +55,8 @@ async def upload_curriculum(
     - user_id:    integer ID of the teacher uploading it
 
     Topics are auto-extracted from the PDF — no need to pass topic_id manually.
-    Returns immediately with a job_id for polling.
+    The file is stored on a QUEUED ingestion job and processed by a separate
+    worker (worker.py). Returns immediately with a job_id for polling.
     """
 
     # ── VALIDATION 1: File type ───────────────────────────────────────────────
@@ -79,7 +83,6 @@ async def upload_curriculum(
 
     # ── READ FILE ─────────────────────────────────────────────────────────────
     file_bytes = await file.read()
-    file_size = len(file_bytes)
 
     # ── CREATE UploadRequest ──────────────────────────────────────────────────
     upload_request = UploadRequest(
@@ -92,31 +95,22 @@ async def upload_curriculum(
     db.add(upload_request)
     db.flush()
 
-    # ── CREATE IngestionJob ───────────────────────────────────────────────────
-    ingestion_job = IngestionJob(
+    # ── ENQUEUE IngestionJob ──────────────────────────────────────────────────
+    # The job row carries the file and chapter, so a worker can run it later —
+    # even after this web process restarts.
+    ingestion_job = job_queue.enqueue_ingestion_job(
+        db,
         request_id=upload_request.request_id,
-        job_status="QUEUED",
-        chunk_count=0
+        chapter_id=chapter_id,
+        file_bytes=file_bytes,
+        filename=file.filename,
+        source_type=source_type,
     )
-    db.add(ingestion_job)
-    db.flush()
 
     job_id = ingestion_job.job_id
     request_id = upload_request.request_id
     db.commit()
 
-    # ── SCHEDULE BACKGROUND PIPELINE ─────────────────────────────────────────
-    # Pass chapter_id instead of topic_id — pipeline will auto-create topics
-    background_tasks.add_task(
-        run_ingestion_pipeline,
-        job_id=job_id,
-        chapter_id=chapter_id,       # CHANGED
-        file_bytes=file_bytes,
-        filename=file.filename,
-        file_size=file_size,
-        source_type=source_type,        # NEW
-    )
-
     return UploadResponse(
         message="File received. Topics will be auto-extracted and ingested.",
         job_id=job_id,
@@ -136,10 +130,38 @@ def get_job_status(job_id: int, db: Session = Depends(get_db)):
         job_id=job.job_id,
         job_status=job.job_status,
         chunk_count=job.chunk_count,
-        error_message=job.error_message
+        error_message=job.error_message,
+        attempts=job.attempts or 0,
+        next_attempt_at=job.next_attempt_at,
     )
 
 
+# ── POST /ingest/retry/{job_id} ───────────────────────────────────────────────
+
+@router.post("/retry/{job_id}")
+def retry_job(job_id: int, db: Session = Depends(get_db)):
+    """
+    Re-queues a FAILED (or waiting RETRY) job. The worker resumes it from the
+    last completed stage checkpoint instead of re-running OCR, topic
+    extraction and embedding from scratch.
+    """
+    try:
+        job = job_queue.requeue_job(db, job_id)
+    except LookupError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+    done = completed_stages(db, job_id)
+    remaining = [stage for stage in STAGES if stage not in done]
+    return {
+        "job_id": job.job_id,
+        "job_status": job.job_status,
+        "completed_stages": done,
+        "resume_from": remaining[0] if remaining else "upload",
+    }
+
+
 # ── GET /ingest/jobs ──────────────────────────────────────────────────────────
 
 @router.get("/jobs")
@@ -152,14 +174,18 @@ def list_all_jobs(db: Session = Depends(get_db)):
             "request_id": job.request_id,
             "job_status": job.job_status,
             "chunk_count": job.chunk_count,
-            "error_message": job.error_message
+            "error_message": job.error_message,
+            "attempts": job.attempts or 0,
+            "locked_by": job.locked_by,
         })
-    return {"jobs": result, "total": len(result)}
+    return {"jobs": result, "total": len(result), "queue": job_queue.queue_stats(db)}
 
 
 @router.delete("/delete-file/{filename}")
 def delete_file(filename: str, db: Session = Depends(get_db)):
     result = rag_service.delete_file_from_system(filename, db)
+    if result["status"] == "paused":
+        raise HTTPException(status_code=503, detail=result["message"])
     if result["status"] == "error":
         raise HTTPException(status_code=500, detail=result["message"])
     return result
\ No newline at end of file
@@ -0,0 +1,103 @@
+# content_embeddings.py - Compact storage for the ContentEmbedding table.
+#
+# embedding_vector used to hold json.dumps() of a 3072-float list — ~60 KB of
+# ASCII per chunk — and STEP 7 added rows one at a time with db.add(). Vectors
+# are now stored as packed float32 bytes in embedding_blob (~12 KB, about 4-5x
+# smaller), and a whole job's rows are written with ONE executemany INSERT.
+#
+# Reading back is zero-copy: np.frombuffer() wraps the bytes from the driver
+# directly, no per-float parsing. Legacy rows that only have JSON text are
+# still decoded, so old and new rows can coexist.
+#
+# CONTENT_EMBEDDING_STORAGE: "binary" (default) or "json" (legacy format).
+
+import os
+import json
+from typing import List, Dict, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import insert
+from sqlalchemy.orm import Session, undefer
+
+from models.db_models import ContentEmbedding
+
+
+CONTENT_EMBEDDING_STORAGE = os.getenv("CONTENT_EMBEDDING_STORAGE", "binary").strip().lower()
+
+# Explicit little-endian so blobs are portable across machines
+_DTYPE = np.dtype("<f4")
+
+
+# ── ENCODE / DECODE ───────────────────────────────────────────────────────────
+
+def vector_to_blob(vector) -> bytes:
+    return np.asarray(vector, dtype=_DTYPE).tobytes()
+
+
+def blob_to_array(blob: bytes) -> np.ndarray:
+    """Zero-copy, read-only float32 view over the stored bytes."""
+    return np.frombuffer(blob, dtype=_DTYPE)
+
+
+def row_vector(row: ContentEmbedding) -> Optional[np.ndarray]:
+    """Decodes one row, whichever format it was written in."""
+    if row.embedding_blob is not None:
+        return blob_to_array(row.embedding_blob)
+    if row.embedding_vector:
+        return np.asarray(json.loads(row.embedding_vector), dtype=_DTYPE)
+    return None
+
+
+# ── WRITE ─────────────────────────────────────────────────────────────────────
+
+def save_content_embeddings(db: Session, rows: List[Dict]) -> int:
+    """Bulk-inserts ContentEmbedding rows in one executemany round-trip.
+    Each row: {vector, metadata (dict), chapter_id, job_id, source_type} and
+    optionally content_hash / qdrant_point_id.
+    The caller commits."""
+    if not rows:
+        return 0
+
+    binary = CONTENT_EMBEDDING_STORAGE != "json"
+    params = []
+    for row in rows:
+        params.append({
+            "embedding_blob": vector_to_blob(row["vector"]) if binary else None,
+            "embedding_vector": None if binary else json.dumps(row["vector"]),
+            "embedding_dim": len(row["vector"]),
+            "embedding_metadata": json.dumps(row["metadata"]),
+            "chapter_id": row["chapter_id"],
+            "job_id": row["job_id"],
+            "source_type": row["source_type"],
+            "content_hash": row.get("content_hash"),
+            "qdrant_point_id": row.get("qdrant_point_id"),
+        })
+
+    db.execute(insert(ContentEmbedding), params)
+    return len(params)
+
+
+# ── READ ──────────────────────────────────────────────────────────────────────
+
+def load_embeddings(db: Session, chapter_id: int = None, job_id: int = None) -> Tuple[List[int], np.ndarray]:
+    """Loads stored vectors as one (n, dim) float32 matrix, filtered by chapter
+    and/or job. Returns (embedding_ids, matrix) with matching row order."""
+    query = db.query(ContentEmbedding).options(
+        undefer(ContentEmbedding.embedding_blob),
+        undefer(ContentEmbedding.embedding_vector),
+    )
+    if chapter_id is not None:
+        query = query.filter(ContentEmbedding.chapter_id == chapter_id)
+    if job_id is not None:
+        query = query.filter(ContentEmbedding.job_id == job_id)
+
+    ids, vectors = [], []
+    for row in query.order_by(ContentEmbedding.embedding_id):
+        vector = row_vector(row)
+        if vector is not None:
+            ids.append(row.embedding_id)
+            vectors.append(vector)
+
+    if not vectors:
+        return [], np.empty((0, 0), dtype=_DTYPE)
+    return ids, np.vstack(vectors)
@@ -0,0 +1,235 @@
+# embedding_cache.py - Content-addressed cache for Gemini embeddings.
+#
+# The same chapter text is re-embedded on every re-upload, and the same topic
+# description is re-embedded on every worksheet/study-note/quiz request. Both
+# produce IDENTICAL vectors, so we key every embedding by
+#   (model, task_type, sha256(normalized text))
+# and keep it in two layers:
+#   1. an in-process LRU (OrderedDict) for hot entries — no disk access at all;
+#   2. a local SQLite file shared by every process on the pod (web + worker).
+# The SQLite layer is size-bounded: once it holds more than max_entries rows,
+# the least-recently-used rows are evicted, so it can run indefinitely.
+#
+# Vectors are stored as packed float32 bytes (array('f')) — about 12 KB for a
+# 3072-dim vector instead of ~60 KB of JSON text.
+
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from array import array
+from collections import OrderedDict
+from typing import List, Optional, Dict
+
+from core.config import CACHE_DIR
+
+
+EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "true").strip().lower() == "true"
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", os.path.join(CACHE_DIR, "embeddings.sqlite3"))
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "200000"))
+EMBEDDING_CACHE_MEMORY_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MEMORY_ENTRIES", "2000"))
+
+
+def normalize_text(text: str) -> str:
+    """Collapses all whitespace runs (newlines included) so cosmetic
+    differences in OCR output do not produce different cache keys. The
+    embedders send this same normalized text, so one key is one input."""
+    return " ".join(text.split())
+
+
+def make_cache_key(model: str, task_type: str, text: str) -> str:
+    digest = hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+    return f"{model}|{task_type}|{digest}"
+
+
+def _pack(vector: List[float]) -> bytes:
+    return array("f", vector).tobytes()
+
+
+def _unpack(blob: bytes) -> List[float]:
+    values = array("f")
+    values.frombytes(blob)
+    return values.tolist()
+
+
+class EmbeddingCache:
+    """Two-layer (memory LRU + SQLite) embedding cache. Thread-safe."""
+
+    def __init__(self, path: str, max_entries: int, memory_entries: int):
+        self.path = path
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._writes_since_prune = 0
+
+        self.hits = 0
+        self.memory_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    # ── storage ───────────────────────────────────────────────────────────────
+
+    def _db(self) -> sqlite3.Connection:
+        # Opened lazily so importing this module never touches the filesystem.
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS embedding_cache ("
+                " key TEXT PRIMARY KEY,"
+                " vector BLOB NOT NULL,"
+                " last_used REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_embedding_cache_last_used "
+                "ON embedding_cache (last_used)"
+            )
+            self._conn = conn
+        return self._conn
+
+    def _remember(self, key: str, vector: List[float]) -> None:
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _prune(self) -> None:
+        """Drops the least-recently-used rows once the table is over budget.
+        Trims down to 90% of max_entries so we don't prune on every insert."""
+        conn = self._db()
+        (count,) = conn.execute("SELECT COUNT(*) FROM embedding_cache").fetchone()
+        if count <= self.max_entries:
+            return
+        excess = count - int(self.max_entries * 0.9)
+        conn.execute(
+            "DELETE FROM embedding_cache WHERE key IN ("
+            " SELECT key FROM embedding_cache ORDER BY last_used ASC LIMIT ?)",
+            (excess,)
+        )
+        conn.commit()
+        self.evictions += excess
+        print(f"[Embedding Cache] Evicted {excess} least-recently-used entries")
+
+    # ── public API ────────────────────────────────────────────────────────────
+
+    def get_many(self, model: str, task_type: str, texts: List[str]) -> List[Optional[List[float]]]:
+        """Returns the cached vector for each text, or None for a miss (same order)."""
+        keys = [make_cache_key(model, task_type, t) for t in texts]
+        results: List[Optional[List[float]]] = [None] * len(keys)
+
+        with self._lock:
+            to_load: Dict[str, List[int]] = {}
+            for i, key in enumerate(keys):
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                    results[i] = self._memory[key]
+                    self.hits += 1
+                    self.memory_hits += 1
+                else:
+                    to_load.setdefault(key, []).append(i)
+
+            if to_load:
+                try:
+                    conn = self._db()
+                    found = {}
+                    wanted = list(to_load)
+                    # SQLite caps bound parameters per statement, so look up in slices
+                    for start in range(0, len(wanted), 500):
+                        part = wanted[start:start + 500]
+                        placeholders = ",".join("?" * len(part))
+                        rows = conn.execute(
+                            f"SELECT key, vector FROM embedding_cache WHERE key IN ({placeholders})",
+                            part
+                        ).fetchall()
+                        found.update(rows)
+
+                    if found:
+                        now = time.time()
+                        conn.executemany(
+                            "UPDATE embedding_cache SET last_used = ? WHERE key = ?",
+                            [(now, k) for k in found]
+                        )
+                        conn.commit()
+                except sqlite3.Error as e:
+                    print(f"[Embedding Cache] Read failed, treating as miss — {e}")
+                    found = {}
+
+                for key, positions in to_load.items():
+                    blob = found.get(key)
+                    if blob is None:
+                        self.misses += len(positions)
+                        continue
+                    vector = _unpack(blob)
+                    self._remember(key, vector)
+                    for i in positions:
+                        results[i] = vector
+                    self.hits += len(positions)
+
+        return results
+
+    def get(self, model: str, task_type: str, text: str) -> Optional[List[float]]:
+        return self.get_many(model, task_type, [text])[0]
+
+    def put_many(self, model: str, task_type: str, texts: List[str], vectors: List[Optional[List[float]]]) -> None:
+        """Stores every (text, vector) pair that has a vector. None vectors are skipped."""
+        rows = []
+        now = time.time()
+        with self._lock:
+            for text, vector in zip(texts, vectors):
+                if vector is None:
+                    continue
+                key = make_cache_key(model, task_type, text)
+                self._remember(key, list(vector))
+                rows.append((key, _pack(vector), now))
+
+            if not rows:
+                return
+            try:
+                conn = self._db()
+                conn.executemany(
+                    "INSERT OR REPLACE INTO embedding_cache (key, vector, last_used) VALUES (?, ?, ?)",
+                    rows
+                )
+                conn.commit()
+                self._writes_since_prune += len(rows)
+                if self._writes_since_prune >= 500:
+                    self._writes_since_prune = 0
+                    self._prune()
+            except sqlite3.Error as e:
+                print(f"[Embedding Cache] Write failed, continuing without cache — {e}")
+
+    def put(self, model: str, task_type: str, text: str, vector: Optional[List[float]]) -> None:
+        self.put_many(model, task_type, [text], [vector])
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            try:
+                (stored,) = self._db().execute("SELECT COUNT(*) FROM embedding_cache").fetchone()
+            except sqlite3.Error:
+                stored = None
+            return {
+                "enabled": EMBEDDING_CACHE_ENABLED,
+                "hits": self.hits,
+                "memory_hits": self.memory_hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "memory_entries": len(self._memory),
+                "stored_entries": stored,
+                "max_entries": self.max_entries,
+            }
+
+
+# One cache per process; every embedding call site goes through this instance.
+embedding_cache = EmbeddingCache(
+    path=EMBEDDING_CACHE_PATH,
+    max_entries=EMBEDDING_CACHE_MAX_ENTRIES,
+    memory_entries=EMBEDDING_CACHE_MEMORY_ENTRIES,
+)
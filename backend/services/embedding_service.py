@@ -1,13 +1,124 @@
 # embedding_service.py - Handles generating vector embeddings for text chunks.
 # An "embedding" is a list of numbers (a vector) that represents the meaning of text.
 # Two texts with similar meanings will have vectors that are close to each other.
-# We reuse the get_embedding function already written in services.py to avoid duplication.
+#
+# Ingestion embeds hundreds of chunks per book, so instead of one embed_content
+# call per chunk we send BATCHES of chunk texts per call and keep a bounded
+# number of batches in flight at once. The single-text embed call in
+# rag_service.py is still used as a per-chunk fallback when a batch fails.
+
+import os
+import time
+import random
+from concurrent.futures import ThreadPoolExecutor
 
 # Type hints for readable function signatures
 from typing import List, Dict, Optional
 
-# Import the existing get_embedding function from services.py so we don't rewrite it
-from services.rag_service import get_embedding
+from core.config import gemini_client, EMBEDDING_MODEL
+
+# The single-text embed call from rag_service.py, minus its cache (embed_texts caches itself)
+from services.rag_service import embed_text_uncached
+from services.embedding_cache import embedding_cache, normalize_text, EMBEDDING_CACHE_ENABLED
+
+
+# How many texts go into one embed_content call (the Gemini API caps a batch at 100).
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "100"))
+
+# How many batches are sent concurrently. Kept small so one big book does not
+# burn the whole per-minute embedding quota in a single burst.
+EMBEDDING_MAX_CONCURRENT_BATCHES = int(os.getenv("EMBEDDING_MAX_CONCURRENT_BATCHES", "4"))
+
+# 429 retries per batch before it falls back to per-chunk embedding.
+EMBEDDING_BATCH_MAX_ATTEMPTS = 4
+
+
+def _is_rate_limit_error(e: Exception) -> bool:
+    return "429" in str(e) or "quota" in str(e).lower()
+
+
+def _embed_batch(texts: List[str], task_type: str) -> List[Optional[List[float]]]:
+    """
+    Sends one batch of texts in a single embed_content call.
+    Returns one vector per input text (same order). Rate limits are retried with
+    backoff; any other failure (or a batch-size the backend rejects, e.g. Vertex
+    models that accept one input per request) falls back to embedding each text
+    on its own, so one bad chunk only costs its own slot (None).
+    """
+    # Embedded exactly as the cache key normalizes them (embedding_cache.py)
+    clean_texts = [normalize_text(t) for t in texts]
+
+    for attempt in range(1, EMBEDDING_BATCH_MAX_ATTEMPTS + 1):
+        try:
+            result = gemini_client.models.embed_content(
+                model=EMBEDDING_MODEL,
+                contents=clean_texts,
+                config={"task_type": task_type}
+            )
+            vectors = [e.values for e in result.embeddings]
+            if len(vectors) != len(texts):
+                raise ValueError(
+                    f"embed_content returned {len(vectors)} vectors for {len(texts)} texts"
+                )
+            return vectors
+
+        except Exception as e:
+            if _is_rate_limit_error(e) and attempt < EMBEDDING_BATCH_MAX_ATTEMPTS:
+                delay = 10 * (2 ** (attempt - 1)) + random.uniform(0, 2)
+                print(f"  [Embedding] Batch rate-limited — retrying in {delay:.0f}s "
+                      f"(attempt {attempt}/{EMBEDDING_BATCH_MAX_ATTEMPTS})")
+                time.sleep(delay)
+                continue
+            print(f"  [Embedding] Batch of {len(texts)} failed ({e}) — falling back to per-chunk embedding")
+            break
+
+    # embed_texts already counted these as misses and caches the results itself
+    is_query = task_type == "RETRIEVAL_QUERY"
+    return [embed_text_uncached(t, is_query=is_query) for t in texts]
+
+
+def embed_texts(texts: List[str], is_query: bool = False) -> List[Optional[List[float]]]:
+    """
+    Batched, concurrent embedding of many texts.
+    Returns vectors in the SAME ORDER as `texts`; a text that could not be
+    embedded holds None in its slot. Texts already in the embedding cache are
+    served from it, and only the misses are sent to Gemini.
+    """
+    if not texts:
+        return []
+
+    task_type = "RETRIEVAL_QUERY" if is_query else "RETRIEVAL_DOCUMENT"
+
+    if EMBEDDING_CACHE_ENABLED:
+        vectors = embedding_cache.get_many(EMBEDDING_MODEL, task_type, texts)
+    else:
+        vectors = [None] * len(texts)
+
+    missing = [i for i, v in enumerate(vectors) if v is None]
+    if len(missing) < len(texts):
+        print(f"  [Embedding] {len(texts) - len(missing)}/{len(texts)} texts served from cache")
+    if not missing:
+        return vectors
+
+    missing_texts = [texts[i] for i in missing]
+    batches = [
+        missing_texts[start:start + EMBEDDING_BATCH_SIZE]
+        for start in range(0, len(missing_texts), EMBEDDING_BATCH_SIZE)
+    ]
+
+    # executor.map preserves batch order, so flattening keeps input order intact
+    workers = max(1, min(EMBEDDING_MAX_CONCURRENT_BATCHES, len(batches)))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(lambda batch: _embed_batch(batch, task_type), batches)
+        fresh = [v for batch_vectors in results for v in batch_vectors]
+
+    if EMBEDDING_CACHE_ENABLED:
+        embedding_cache.put_many(EMBEDDING_MODEL, task_type, missing_texts, fresh)
+
+    for i, vector in zip(missing, fresh):
+        vectors[i] = vector
+
+    return vectors
 
 
 def generate_embeddings_for_chunks(chunks: List[Dict]) -> List[Optional[List[float]]]:
@@ -17,26 +128,24 @@ def generate_embeddings_for_chunks(chunks: List[Dict]) -> List[Optional[List[flo
 
     Returns a list of vectors in the SAME ORDER as the input chunks.
     If embedding fails for a specific chunk, that position holds None instead.
-    
-    The small delay between requests is intentional — it prevents us from
-    hitting the Google Gemini API rate limit too quickly.
     """
+    if not chunks:
+        return []
 
-    # This list will store the resulting embedding vector for each chunk
-    embeddings = []
-
-    # Process each chunk one at a time in order
-    for i, chunk in enumerate(chunks):
+    num_batches = (len(chunks) + EMBEDDING_BATCH_SIZE - 1) // EMBEDDING_BATCH_SIZE
+    print(f"  Embedding {len(chunks)} chunks in {num_batches} batch(es) "
+          f"(batch size {EMBEDDING_BATCH_SIZE}, up to {EMBEDDING_MAX_CONCURRENT_BATCHES} concurrent)...")
 
-        # Log progress so the developer can see what's happening in the terminal
-        print(f"  Generating embedding for chunk {i + 1} of {len(chunks)}...")
+    started = time.perf_counter()
 
-        # Call get_embedding with is_query=False because this is a document (not a search query)
-        # is_query=False tells the model to optimize for storage/retrieval
-        vector = get_embedding(chunk["text"], is_query=False)
+    # is_query=False because these are documents (not search queries)
+    embeddings = embed_texts([chunk["text"] for chunk in chunks], is_query=False)
 
-        # Append the result — either a valid vector or None if it failed
-        embeddings.append(vector)
+    elapsed = time.perf_counter() - started
+    failed = sum(1 for v in embeddings if v is None)
+    rate = len(chunks) / elapsed if elapsed > 0 else float("inf")
+    print(f"  Embedded {len(chunks) - failed}/{len(chunks)} chunks in {elapsed:.1f}s "
+          f"({rate:.1f} chunks/s, {failed} failed)")
 
     # Return all embeddings in the same order as the input chunks
-    return embeddings
\ No newline at end of file
+    return embeddings
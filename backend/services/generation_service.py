@@ -1,8 +1,19 @@
 # generation_service.py
+import os
 import json
 from services.rag_service import get_embedding, analyze_worksheet_style
 from core.config import qdrant_client, COLLECTION_NAME
-from qdrant_client.models import Filter, FieldCondition, MatchValue
+from qdrant_client.models import Filter, FieldCondition, MatchValue, MatchAny
+from sqlalchemy.orm import undefer
+from services.topic_embeddings import stored_topic_vector
+from services.topic_assignment import backfill_chapter_assignments
+from services.embedding_service import embed_texts
+from utils.stage_graph import run_stage_graph
+from utils.context_packer import pack_context, tokens_for_chars, CONTEXT_CANDIDATE_FACTOR, CONTEXT_MMR_LAMBDA
+from services.retrieval_cache import retrieval_cache
+from services.hybrid_search import (
+    chapter_has_sparse, hybrid_enabled, hybrid_query, hybrid_request, HYBRID_TOP_K, HYBRID_MAX_CONTEXT_CHARS,
+)
 from agents.content_agent import run_content_agent
 from agents.refinement_agent import run_refinement_agent
 from agents.localization_agent import run_localization_agent
@@ -244,6 +255,8 @@ def handle_simplify(problems, topic, subject, chapter, content):
             p["solution_steps"] = orig["solution_steps"]
             p["needs_diagram"] = orig.get("needs_diagram", False)
             p["diagram_type"] = orig.get("diagram_type", "none")
+            if orig.get("diagram_params"):
+                p["diagram_params"] = orig["diagram_params"]
 
     print(f"[Simplify] Simplified {len(simplified)} problems")
     return simplified
@@ -275,7 +288,41 @@ def handle_visuals(problems: list, visual_refs: list) -> list:
 
 
 
+NO_CONTENT_PREFIX = "No curriculum content found"
+
+
+def _retrieval_settings() -> dict:
+    """Everything besides the query that shapes a context — part of each cache key."""
+    return {
+        "hybrid": hybrid_enabled(),
+        "hybrid_top_k": HYBRID_TOP_K,
+        "hybrid_max_chars": HYBRID_MAX_CONTEXT_CHARS,
+        "candidate_factor": CONTEXT_CANDIDATE_FACTOR,
+        "mmr_lambda": CONTEXT_MMR_LAMBDA,
+        "retrieval_mode": RETRIEVAL_MODE,
+    }
+
+
+def _cacheable(context: str) -> bool:
+    # Empty results may come from a transient embedding failure — retry next time
+    return bool(context) and not context.startswith(NO_CONTENT_PREFIX)
+
+
 def search_curriculum_context(topic_id: int, topic_name: str, chapter_id: int) -> str:
+    """
+    Cached front of _search_curriculum_context_uncached(): the context is
+    reused until the chapter's content_version changes (services/retrieval_cache.py).
+    """
+    return retrieval_cache.get_or_compute(
+        "topic",
+        [chapter_id],
+        {"topic_id": topic_id, "topic_name": topic_name, **_retrieval_settings()},
+        lambda: _search_curriculum_context_uncached(topic_id, topic_name, chapter_id),
+        should_store=_cacheable,
+    )
+
+
+def _search_curriculum_context_uncached(topic_id: int, topic_name: str, chapter_id: int) -> str:
     """
     Fetches curriculum content using semantic search within a chapter.
     
@@ -284,8 +331,14 @@ def search_curriculum_context(topic_id: int, topic_name: str, chapter_id: int) -
     that belong to the topic.
     """
 
-    MAX_CONTEXT_CHARS = 15000
-    TOP_K = 10
+    # Hybrid (dense + BM25) ranking is precise enough for a smaller context —
+    # but only if the chapter's points actually carry the sparse vector
+    if chapter_has_sparse(chapter_id):
+        MAX_CONTEXT_CHARS = HYBRID_MAX_CONTEXT_CHARS
+        TOP_K = HYBRID_TOP_K
+    else:
+        MAX_CONTEXT_CHARS = 15000
+        TOP_K = 10
 
     # Fetch topic description from DB
     from models.db_models import Topic
@@ -293,16 +346,24 @@ def search_curriculum_context(topic_id: int, topic_name: str, chapter_id: int) -
     
     db = SessionLocal()
     try:
-        topic = db.query(Topic).filter(Topic.topic_id == topic_id).first()
+        topic = (
+            db.query(Topic)
+            .options(undefer(Topic.description_embedding))
+            .filter(Topic.topic_id == topic_id)
+            .first()
+        )
         # Use description if available, fall back to name
         query_text = topic.description if topic and topic.description else topic_name
+        # The description's query vector is stored at ingestion time
+        query_vector = stored_topic_vector(topic) if topic else None
     finally:
         db.close()
     
     print(f"[Context] Using query: '{query_text[:100]}...'")
 
-    # Get embedding for the query (description if available, else name)
-    query_vector = get_embedding(query_text, is_query=True)
+    # Embed only if the topic has no stored vector (e.g. ingested before they existed)
+    if query_vector is None:
+        query_vector = get_embedding(query_text, is_query=True)
 
     if not query_vector:
         print(f"[Context] Could not generate embedding for query")
@@ -318,40 +379,25 @@ def search_curriculum_context(topic_id: int, topic_name: str, chapter_id: int) -
         ]
     )
 
-    # Semantic search within the chapter
-    results = qdrant_client.query_points(
-        collection_name=COLLECTION_NAME,
-        query=query_vector,
-        query_filter=chapter_filter,
-        limit=TOP_K,
-        with_payload=True
-    ).points
+    # Semantic + lexical search within the chapter (services/hybrid_search.py);
+    # the name is added so exact-term matching also sees it
+    lexical_query = query_text if query_text == topic_name else f"{topic_name} {query_text}"
+    results = hybrid_query(query_vector, lexical_query, chapter_filter, TOP_K * CONTEXT_CANDIDATE_FACTOR)
 
     if not results:
         print(f"[Context] No chunks found for chapter_id={chapter_id}")
         return "No curriculum content found for this topic."
 
-    print(f"[Context] Found {len(results)} relevant chunks for topic '{topic_name}'")
-
-    # Build context string
-    context_parts = []
-    total_chars = 0
-    
-    for point in results:
-        text = point.payload.get("text", "")
-        filename = point.payload.get("filename", "unknown")
-        page = point.payload.get("page", "?")
-        score = point.score if hasattr(point, "score") else 0
-        
-        entry = f"[Source: {filename}, Page {page} | Relevance: {score:.3f}]\n{text}"
-        
-        if total_chars + len(entry) > MAX_CONTEXT_CHARS:
-            print(f"[Context] Truncating at {total_chars} chars (cap: {MAX_CONTEXT_CHARS})")
-            break
-        
-        context_parts.append(entry)
-        total_chars += len(entry)
+    # MMR-diversify, strip neighbour overlap, merge contiguous chunks and pack
+    # into the token budget (utils/context_packer.py)
+    candidates = [_point_to_chunk(point) for point in results]
+    passages = pack_context(candidates, tokens_for_chars(MAX_CONTEXT_CHARS, candidates))
+    print(f"[Context] Packed {len(results)} candidate chunks into {len(passages)} passage(s) for topic '{topic_name}'")
 
+    context_parts = [
+        f"[Source: {p['filename']}, Page {p['page']} | Relevance: {p['score']:.3f}]\n{p['text']}"
+        for p in passages
+    ]
     return "\n\n---\n\n".join(context_parts)
 
 # ─── Bulk, scope-aware retrieval helpers for quiz generation ───
@@ -366,50 +412,71 @@ def search_curriculum_context(topic_id: int, topic_name: str, chapter_id: int) -
 # CHAPTER-OF-TOPICS (for subject scope), then interleave those buckets
 # round-robin into the final context instead of ranking everything globally.
 
+#
+# RETRIEVAL_MODE picks how those buckets are built:
+#   "topics"   (default) per-topic buckets from ingestion-time topic payloads,
+#              else batched per-topic semantic searches (one bucket per topic)
+#   "grouped"  ONE query_points_groups request with server-side grouping —
+#              by topic_ids for a chapter, by chapter_id for a subject — and a
+#              per-group limit. Falls back to "topics" for chapters whose
+#              points carry no topic_ids payload yet.
+
 PER_TOPIC_LIMIT_CHAPTER = 5   # chunks per topic when bulk-fetching one chapter
 PER_TOPIC_LIMIT_SUBJECT = 3   # smaller — a subject fans out over far more topics
+PER_CHAPTER_LIMIT_SUBJECT = 12  # chunks per chapter group in "grouped" mode
 MAX_CONTEXT_CHARS_CHAPTER = 20000
 MAX_CONTEXT_CHARS_SUBJECT = 35000
 
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "topics").strip().lower()
+
 
-def _fetch_chunks_raw(query_text: str, qdrant_filter, limit: int) -> list:
-    """One Qdrant semantic search, returned as plain chunk dicts (no formatting)."""
-    query_vector = get_embedding(query_text, is_query=True)
+def _point_to_chunk(point) -> dict:
+    return {
+        "text": point.payload.get("text", ""),
+        "filename": point.payload.get("filename", "unknown"),
+        "page": point.payload.get("page", "?"),
+        "chunk_index": point.payload.get("chunk_index", "?"),
+        "score": point.score if hasattr(point, "score") else 0,
+    }
+
+
+def _fetch_chunks_raw(query_text: str, qdrant_filter, limit: int, query_vector=None) -> list:
+    """One Qdrant semantic search, returned as plain chunk dicts (no formatting).
+    Pass query_vector when it is already known (stored topic vectors) to skip the embedding call."""
+    if query_vector is None:
+        query_vector = get_embedding(query_text, is_query=True)
     if not query_vector:
         return []
 
-    results = qdrant_client.query_points(
-        collection_name=COLLECTION_NAME,
-        query=query_vector,
-        query_filter=qdrant_filter,
-        limit=limit,
-        with_payload=True
-    ).points
-
-    return [
-        {
-            "text": point.payload.get("text", ""),
-            "filename": point.payload.get("filename", "unknown"),
-            "page": point.payload.get("page", "?"),
-            "chunk_index": point.payload.get("chunk_index", "?"),
-            "score": point.score if hasattr(point, "score") else 0,
-        }
-        for point in results
-    ]
+    results = hybrid_query(query_vector, query_text, qdrant_filter, limit)
+    return [_point_to_chunk(point) for point in results]
 
 
 def _get_topics_for_chapter(chapter_id: int) -> list:
+    return _get_topics_for_chapters([chapter_id])[chapter_id]
+
+
+def _get_topics_for_chapters(chapter_ids: list) -> dict:
+    """{chapter_id: [topic, ...]} for several chapters in one query."""
     from models.db_models import Topic as TopicModel
     from core.config import SessionLocal
     db = SessionLocal()
     try:
-        topics = db.query(TopicModel).filter(TopicModel.chapter_id == chapter_id).all()
+        topics = (
+            db.query(TopicModel)
+            .options(undefer(TopicModel.description_embedding))
+            .filter(TopicModel.chapter_id.in_(chapter_ids))
+            .all()
+        )
         # Extract plain values NOW, while the session is still open — never
         # return live ORM objects that outlive this session's lifetime.
-        return [
-            {"topic_id": t.topic_id, "name": t.name, "description": t.description}
-            for t in topics
-        ]
+        by_chapter = {chapter_id: [] for chapter_id in chapter_ids}
+        for t in topics:
+            by_chapter[t.chapter_id].append(
+                {"topic_id": t.topic_id, "name": t.name, "description": t.description,
+                 "vector": stored_topic_vector(t)}
+            )
+        return by_chapter
     finally:
         db.close()
 
@@ -428,25 +495,279 @@ def _get_chapters_for_subject(subject_id: int) -> list:
         db.close()
 
 
+def _fetch_chunks_by_topic_payload(chapter_filter, topics: list, per_topic_limit: int):
+    """
+    Builds the per-topic buckets from the topic_ids / topic_scores payload that
+    ingestion writes (services/topic_assignment.py): ONE filtered scroll over
+    the chapter, no embedding call and no per-topic search.
+    Returns None while any chunk of the chapter is still unassigned (ingested
+    before topics existed), so the caller falls back to per-topic semantic
+    search instead of silently dropping those chunks. Topics that no chunk
+    was assigned to come back as empty buckets; the caller fills them.
+    """
+    records = []
+    offset = None
+    while True:
+        page, offset = qdrant_client.scroll(
+            collection_name=COLLECTION_NAME,
+            scroll_filter=chapter_filter,
+            with_payload=["text", "filename", "page", "chunk_index", "topic_ids", "topic_scores"],
+            with_vectors=False,
+            limit=256,
+            offset=offset,
+        )
+        records.extend(page)
+        if offset is None:
+            break
+
+    if not records or not all((r.payload or {}).get("topic_ids") for r in records):
+        return None
+
+    candidates = {t["topic_id"]: [] for t in topics}
+    for record in records:
+        payload = record.payload or {}
+        scores = payload.get("topic_scores") or {}
+        for topic_id in payload.get("topic_ids") or []:
+            if topic_id in candidates:
+                candidates[topic_id].append({
+                    "text": payload.get("text", ""),
+                    "filename": payload.get("filename", "unknown"),
+                    "page": payload.get("page", "?"),
+                    "chunk_index": payload.get("chunk_index", "?"),
+                    "score": scores.get(str(topic_id), 0.0),
+                })
+
+    groups = {}
+    for topic in topics:
+        ranked = sorted(candidates[topic["topic_id"]], key=lambda c: c["score"], reverse=True)
+        groups[topic["name"]] = ranked[:per_topic_limit]
+        if not ranked:
+            print(f"[Context] Topic '{topic['name']}' (id={topic['topic_id']}) has no assigned chunks")
+    return groups
+
+
+# Upper bound on searches sent in one query_batch_points request
+QUERY_BATCH_SIZE = 64
+
+
+def _semantic_groups_batched(chapter_specs: list, per_topic_limit: int) -> dict:
+    """
+    Per-topic semantic search for many chapters at once. Every topic query is
+    embedded in ONE batched embedding call (stored topic vectors are used
+    as-is) and all searches go out as query_batch_points requests, instead of
+    one get_embedding + query_points round-trip per topic.
+    chapter_specs: [{"chapter_id", "name", "topics"}]. Returns {chapter_id: {label: chunks}}.
+    """
+    searches = []   # (chapter_id, label, query_text, vector, filter, limit)
+    for spec in chapter_specs:
+        chapter_filter = Filter(
+            must=[FieldCondition(key="chapter_id", match=MatchValue(value=spec["chapter_id"]))]
+        )
+        if not spec["topics"]:
+            print(f"[Context] Chapter {spec['chapter_id']} ('{spec['name']}') has no topics in DB — falling back to one chapter-wide query")
+            searches.append((spec["chapter_id"], spec["name"], spec["name"], None, chapter_filter, 20))
+            continue
+        for topic in spec["topics"]:
+            query_text = topic["description"] if topic["description"] else topic["name"]
+            searches.append((spec["chapter_id"], topic["name"], query_text, topic.get("vector"),
+                             chapter_filter, per_topic_limit))
+
+    groups = {spec["chapter_id"]: {} for spec in chapter_specs}
+    if not searches:
+        return groups
+
+    missing = [i for i, s in enumerate(searches) if s[3] is None]
+    if missing:
+        fresh = embed_texts([searches[i][2] for i in missing], is_query=True)
+        for i, vector in zip(missing, fresh):
+            searches[i] = searches[i][:3] + (vector,) + searches[i][4:]
+
+    runnable = [s for s in searches if s[3] is not None]
+    for chapter_id, label, _, vector, _, _ in searches:
+        if vector is None:
+            print(f"[Context] Could not embed query for '{label}' — skipped")
+            groups[chapter_id][label] = []
+
+    for start in range(0, len(runnable), QUERY_BATCH_SIZE):
+        batch = runnable[start:start + QUERY_BATCH_SIZE]
+        responses = qdrant_client.query_batch_points(
+            collection_name=COLLECTION_NAME,
+            requests=[
+                hybrid_request(vector, query_text, qdrant_filter, limit)
+                for _, _, query_text, vector, qdrant_filter, limit in batch
+            ],
+        )
+        for (chapter_id, label, _, _, _, _), response in zip(batch, responses):
+            chunks = [_point_to_chunk(p) for p in response.points]
+            if not chunks:
+                print(f"[Context] '{label}' (chapter {chapter_id}) returned 0 chunks — likely no source PDF covers it")
+            groups[chapter_id][label] = chunks
+
+    print(f"[Context] {len(runnable)} semantic search(es) sent in "
+          f"{(len(runnable) + QUERY_BATCH_SIZE - 1) // QUERY_BATCH_SIZE} batch request(s)")
+    return groups
+
+
+def _backfill_topic_assignments(chapter_id: int, topics: list) -> bool:
+    """Assigns topics to the chapter's chunks that were stored without any.
+    False when the backfill failed, so the caller skips the payload fast path."""
+    try:
+        return backfill_chapter_assignments(chapter_id, topics) == 0
+    except Exception as e:
+        print(f"[Context] Topic backfill failed for chapter {chapter_id}: {e}")
+        return False
+
+
+def _fetch_chunks_for_chapters_bulk(chapters: list, per_topic_limit: int) -> dict:
+    """
+    Per-topic buckets for several chapters: {chapter_id: {topic_name: chunks}}.
+    Chapters whose chunks carry ingestion-time topic assignments (backfilled
+    here for chunks stored before topics existed) are served by one payload
+    scroll each. Whole chapters without assignments, and single topics that
+    no chunk was assigned to, share one batched semantic-search pass.
+    """
+    results = {}
+    pending = []
+    # Every chapter's topics in one DB round trip
+    topics_by_chapter = _get_topics_for_chapters([c["chapter_id"] for c in chapters])
+    for chapter in chapters:
+        topics = topics_by_chapter[chapter["chapter_id"]]
+        if topics and _backfill_topic_assignments(chapter["chapter_id"], topics):
+            chapter_filter = Filter(
+                must=[FieldCondition(key="chapter_id", match=MatchValue(value=chapter["chapter_id"]))]
+            )
+            # Fast path: topics were assigned at ingestion time
+            groups = _fetch_chunks_by_topic_payload(chapter_filter, topics, per_topic_limit)
+            if groups is not None:
+                results[chapter["chapter_id"]] = groups
+                missing = [t for t in topics if not groups[t["name"]]]
+                if missing:
+                    pending.append({"chapter_id": chapter["chapter_id"], "name": chapter["name"], "topics": missing})
+                continue
+        if topics:
+            print(f"[Context] Chapter {chapter['chapter_id']} has no topic assignments yet — per-topic semantic search")
+        pending.append({"chapter_id": chapter["chapter_id"], "name": chapter["name"], "topics": topics})
+
+    if pending:
+        for chapter_id, groups in _semantic_groups_batched(pending, per_topic_limit).items():
+            if chapter_id in results:
+                # Only the topics missing from the payload buckets were searched
+                results[chapter_id] = {
+                    label: groups.get(label) or chunks for label, chunks in results[chapter_id].items()
+                }
+            else:
+                results[chapter_id] = groups
+    return results
+
+
 def _fetch_chunks_for_chapter_bulk(chapter_id: int, chapter_name: str, per_topic_limit: int) -> dict:
+    return _fetch_chunks_for_chapters_bulk(
+        [{"chapter_id": chapter_id, "name": chapter_name}], per_topic_limit
+    )[chapter_id]
+
+
+def _query_groups(query_vector, qdrant_filter, group_by: str, groups: int, group_size: int) -> dict:
+    """One server-side grouped search: {group_key: [chunk, ...]}, best hits first
+    within each group. Points without the group_by field are skipped by Qdrant."""
+    response = qdrant_client.query_points_groups(
+        collection_name=COLLECTION_NAME,
+        query=query_vector,
+        query_filter=qdrant_filter,
+        group_by=group_by,
+        limit=groups,
+        group_size=group_size,
+        with_payload=True,
+    )
+    return {group.id: [_point_to_chunk(hit) for hit in group.hits] for group in response.groups}
+
+
+def _chapter_query_vector(chapter_name: str, topics: list):
+    """Centroid of the chapter's stored topic vectors (no API call); embeds the
+    chapter name only when no topic has a stored vector."""
+    return _topic_centroid(topics) or get_embedding(chapter_name, is_query=True)
+
+
+def _topic_centroid(topics: list):
+    """Mean of the topics' stored vectors, or None when none has one."""
+    vectors = [t["vector"] for t in topics if t.get("vector") is not None]
+    if not vectors:
+        return None
+    dim = len(vectors[0])
+    return [sum(v[i] for v in vectors) / len(vectors) for i in range(dim)]
+
+
+def _fetch_chapter_groups_grouped(chapter_id: int, chapter_name: str, per_topic_limit: int):
+    """Per-topic buckets for one chapter from a single query_points_groups call
+    grouped by topic_ids. Topics that get no group (nothing assigned, or
+    outranked by the centroid query) are filled by per-topic semantic search.
+    Returns None when the chapter has no topics or its chunks could not be
+    assigned, so the caller can use "topics" mode."""
     topics = _get_topics_for_chapter(chapter_id)
+    if not topics or not _backfill_topic_assignments(chapter_id, topics):
+        return None
+    query_vector = _chapter_query_vector(chapter_name, topics)
+    if not query_vector:
+        return None
+
     chapter_filter = Filter(
         must=[FieldCondition(key="chapter_id", match=MatchValue(value=chapter_id))]
     )
+    by_topic_id = _query_groups(query_vector, chapter_filter, "topic_ids", len(topics), per_topic_limit)
+    if not by_topic_id:
+        print(f"[Context] Chapter {chapter_id} has no assigned chunks — grouped mode falls back to per-topic retrieval")
+        return None
+
+    groups = {t["name"]: by_topic_id.get(t["topic_id"], []) for t in topics}
+    missing = [t for t in topics if not groups[t["name"]]]
+    if missing:
+        print(f"[Context] {len(missing)} topic(s) of chapter {chapter_id} got no group — per-topic semantic search")
+        fallback = _semantic_groups_batched(
+            [{"chapter_id": chapter_id, "name": chapter_name, "topics": missing}], per_topic_limit
+        )[chapter_id]
+        for topic in missing:
+            groups[topic["name"]] = fallback.get(topic["name"], [])
+    return groups
 
-    if not topics:
-        print(f"[Context] Chapter {chapter_id} ('{chapter_name}') has no topics in DB — falling back to one chapter-wide query")
-        return {chapter_name: _fetch_chunks_raw(chapter_name, chapter_filter, limit=20)}
 
-    groups = {}
-    for topic in topics:
-        query_text = topic["description"] if topic["description"] else topic["name"]
-        chunks = _fetch_chunks_raw(query_text, chapter_filter, limit=per_topic_limit)
-        if not chunks:
-            print(f"[Context] Topic '{topic['name']}' (id={topic['topic_id']}) returned 0 chunks — likely no source PDF covers it")
-        groups[topic["name"]] = chunks
+def _fetch_subject_groups_grouped(subject_name: str, chapters: list, per_chapter_limit: int) -> dict:
+    """{chapter_name: chunks} for a whole subject from ONE query_points_groups
+    call grouped by chapter_id — one group per chapter, per_chapter_limit hits
+    each. The query is the centroid of the subject's stored topic vectors;
+    chapters that get no group are searched on their own topic centroid."""
+    topics_by_chapter = _get_topics_for_chapters([c["chapter_id"] for c in chapters])
+    all_topics = [t for topics in topics_by_chapter.values() for t in topics]
+    query_vector = _chapter_query_vector(subject_name, all_topics)
+    if not query_vector:
+        return {c["name"]: [] for c in chapters}
+
+    subject_filter = Filter(
+        must=[FieldCondition(key="chapter_id", match=MatchAny(any=[c["chapter_id"] for c in chapters]))]
+    )
+    by_chapter_id = _query_groups(query_vector, subject_filter, "chapter_id", len(chapters), per_chapter_limit)
+
+    missing = [c for c in chapters if not by_chapter_id.get(c["chapter_id"])]
+    if missing:
+        print(f"[Context] {len(missing)} chapter(s) got no group — per-chapter semantic search")
+        # One pseudo-topic per chapter: its topic centroid, or its name embedded
+        specs = [
+            {"chapter_id": c["chapter_id"], "name": c["name"],
+             "topics": [{"name": c["name"], "description": "",
+                         "vector": _topic_centroid(topics_by_chapter[c["chapter_id"]])}]}
+            for c in missing
+        ]
+        for chapter_id, groups in _semantic_groups_batched(specs, per_chapter_limit).items():
+            by_chapter_id[chapter_id] = next(iter(groups.values()), [])
+    return {c["name"]: by_chapter_id.get(c["chapter_id"], []) for c in chapters}
+
+
+def _chapter_topic_groups(chapter_id: int, chapter_name: str) -> dict:
+    """Chapter-scope buckets in the configured RETRIEVAL_MODE."""
+    if RETRIEVAL_MODE == "grouped":
+        groups = _fetch_chapter_groups_grouped(chapter_id, chapter_name, PER_TOPIC_LIMIT_CHAPTER)
+        if groups is not None:
+            return groups
+    return _fetch_chunks_for_chapter_bulk(chapter_id, chapter_name, PER_TOPIC_LIMIT_CHAPTER)
 
-    return groups
 
 def _interleave_and_budget(groups: dict, max_chars: int) -> list:
     """
@@ -499,6 +820,42 @@ def search_curriculum_context_for_quiz(
     chapter_name: str = None,
     topic_id: int = None,
     topic_name: str = None,
+) -> str:
+    """
+    Cached front of _search_quiz_context_uncached(). Chapter contexts are keyed
+    on that chapter's content_version, subject contexts on the versions of all
+    of its chapters (services/retrieval_cache.py).
+    """
+    if scope == "topic":
+        return search_curriculum_context(topic_id, topic_name, chapter_id)
+
+    compute = lambda: _search_quiz_context_uncached(
+        scope, class_name, subject_id, subject_name, chapter_id, chapter_name, topic_id, topic_name
+    )
+    if scope == "chapter":
+        chapter_ids = [chapter_id]
+    elif scope == "subject":
+        chapter_ids = [c["chapter_id"] for c in _get_chapters_for_subject(subject_id)]
+    else:
+        return compute()    # raises for an unknown scope
+
+    params = {
+        "subject_id": subject_id, "subject_name": subject_name,
+        "chapter_id": chapter_id, "chapter_name": chapter_name,
+        **_retrieval_settings(),
+    }
+    return retrieval_cache.get_or_compute(f"quiz-{scope}", chapter_ids, params, compute, should_store=_cacheable)
+
+
+def _search_quiz_context_uncached(
+    scope: str,
+    class_name: str,
+    subject_id: int,
+    subject_name: str,
+    chapter_id: int = None,
+    chapter_name: str = None,
+    topic_id: int = None,
+    topic_name: str = None,
 ) -> str:
     """
     Scope-aware curriculum retrieval for quiz generation.
@@ -513,8 +870,10 @@ def search_curriculum_context_for_quiz(
 
     if scope == "chapter":
         print(f"[Context] Bulk-fetching chapter {chapter_id} ('{chapter_name}') per-topic...")
-        topic_groups = _fetch_chunks_for_chapter_bulk(chapter_id, chapter_name, PER_TOPIC_LIMIT_CHAPTER)
+        topic_groups = _chapter_topic_groups(chapter_id, chapter_name)
         selected = _interleave_and_budget(topic_groups, MAX_CONTEXT_CHARS_CHAPTER)
+        # The round-robin already enforced the budget — packing only drops duplicates and overlap
+        selected = pack_context(selected, float("inf"), lambda_=1.0)
 
         if not selected:
             print(f"[Context] No chunks found anywhere in chapter {chapter_id} ('{chapter_name}')")
@@ -529,15 +888,20 @@ def search_curriculum_context_for_quiz(
             return "No curriculum content found for this subject."
 
         print(f"[Context] Bulk-fetching subject {subject_id} ('{subject_name}') across {len(chapters)} chapters...")
-        chapter_groups = {}
+        if RETRIEVAL_MODE == "grouped":
+            chapter_groups = _fetch_subject_groups_grouped(subject_name, chapters, PER_CHAPTER_LIMIT_SUBJECT)
+        else:
+            groups_by_chapter = _fetch_chunks_for_chapters_bulk(chapters, PER_TOPIC_LIMIT_SUBJECT)
+            chapter_groups = {
+                chapter["name"]: [c for chunks in groups_by_chapter[chapter["chapter_id"]].values() for c in chunks]
+                for chapter in chapters
+            }
         for chapter in chapters:
-            topic_groups = _fetch_chunks_for_chapter_bulk(chapter["chapter_id"], chapter["name"], PER_TOPIC_LIMIT_SUBJECT)
-            flat = [c for chunks in topic_groups.values() for c in chunks]
-            if not flat:
+            if not chapter_groups[chapter["name"]]:
                 print(f"[Context] Chapter '{chapter['name']}' (id={chapter['chapter_id']}) contributed 0 chunks — likely no source PDF")
-            chapter_groups[chapter["name"]] = flat
 
         selected = _interleave_and_budget(chapter_groups, MAX_CONTEXT_CHARS_SUBJECT)
+        selected = pack_context(selected, float("inf"), lambda_=1.0)
 
         if not selected:
             print(f"[Context] No chunks found anywhere in subject {subject_id} ('{subject_name}')")
@@ -550,7 +914,7 @@ def search_curriculum_context_for_quiz(
 
 
 def debug_bulk_chapter_chunks(chapter_id: int, chapter_name: str) -> dict:
-    topic_groups = _fetch_chunks_for_chapter_bulk(chapter_id, chapter_name, PER_TOPIC_LIMIT_CHAPTER)
+    topic_groups = _chapter_topic_groups(chapter_id, chapter_name)
     selected = _interleave_and_budget(topic_groups, MAX_CONTEXT_CHARS_CHAPTER)
 
     per_topic_breakdown = [
@@ -559,6 +923,7 @@ def debug_bulk_chapter_chunks(chapter_id: int, chapter_name: str) -> dict:
     ]
 
     return {
+        "retrieval_mode": RETRIEVAL_MODE,
         "per_topic_limit": PER_TOPIC_LIMIT_CHAPTER,
         "max_context_chars": MAX_CONTEXT_CHARS_CHAPTER,
         "total_topics": len(topic_groups),
@@ -570,22 +935,32 @@ def debug_bulk_chapter_chunks(chapter_id: int, chapter_name: str) -> dict:
     }
 
 
-def debug_bulk_subject_chunks(subject_id: int) -> dict:
+def debug_bulk_subject_chunks(subject_id: int, subject_name: str = "") -> dict:
     chapters = _get_chapters_for_subject(subject_id)
     if not chapters:
         return {"error": "No chapters found for this subject", "chapter_breakdown": []}
 
+    if RETRIEVAL_MODE == "grouped":
+        # Server-side grouping is per chapter only — there is no per-topic breakdown
+        flat_by_chapter = _fetch_subject_groups_grouped(subject_name, chapters, PER_CHAPTER_LIMIT_SUBJECT)
+        groups_by_chapter = {c["chapter_id"]: {} for c in chapters}
+    else:
+        groups_by_chapter = _fetch_chunks_for_chapters_bulk(chapters, PER_TOPIC_LIMIT_SUBJECT)
+        flat_by_chapter = None
     chapter_groups = {}
     chapter_breakdown = []
     for chapter in chapters:
-        topic_groups = _fetch_chunks_for_chapter_bulk(chapter["chapter_id"], chapter["name"], PER_TOPIC_LIMIT_SUBJECT)
-        flat = [c for chunks in topic_groups.values() for c in chunks]
+        topic_groups = groups_by_chapter[chapter["chapter_id"]]
+        if flat_by_chapter is not None:
+            flat = flat_by_chapter[chapter["name"]]
+        else:
+            flat = [c for chunks in topic_groups.values() for c in chunks]
         if not flat:
             print(f"[Context] Chapter '{chapter['name']}' (id={chapter['chapter_id']}) contributed 0 chunks — likely no source PDF")
         chapter_groups[chapter["name"]] = flat
         chapter_breakdown.append({
-            "chapter_id": chapter.chapter_id,
-            "chapter_name": chapter.name,
+            "chapter_id": chapter["chapter_id"],
+            "chapter_name": chapter["name"],
             "chunks_found": len(flat),
             "per_topic_breakdown": [
                 {"topic_name": tn, "chunks_found": len(tc)} for tn, tc in topic_groups.items()
@@ -595,6 +970,7 @@ def debug_bulk_subject_chunks(subject_id: int) -> dict:
     selected = _interleave_and_budget(chapter_groups, MAX_CONTEXT_CHARS_SUBJECT)
 
     return {
+        "retrieval_mode": RETRIEVAL_MODE,
         "per_topic_limit": PER_TOPIC_LIMIT_SUBJECT,
         "max_context_chars": MAX_CONTEXT_CHARS_SUBJECT,
         "total_chapters": len(chapters),
@@ -686,6 +1062,7 @@ def generate_worksheet(
                     "solution_steps": p["solution_steps"],
                     "needs_diagram": p.get("needs_diagram", False),
                     "diagram_type": p.get("diagram_type", "none"),
+                    "diagram_params": p.get("diagram_params"),
                     "diagram_description": p.get("diagram_description", "")
                 }
                 for p in content_output["problems"]
@@ -747,82 +1124,111 @@ def generate_study_note(
     print(f"Topic: {topic_name} | Class: {class_name} | Language: {language}")
     print(f"{'='*50}\n")
 
-    # Step 1: Search Qdrant for curriculum context
-    print("[Pipeline] Searching curriculum context in Qdrant...")
-    curriculum_context = search_curriculum_context(topic_id, topic_name, chapter_id)
-    print(f"[Pipeline] Found context ({len(curriculum_context)} chars)")
+    # The stages form a small dependency graph (utils/stage_graph.py):
+    #
+    #   retrieval ──► note ──► visuals ──┐
+    #   videos ──────────────────────────┴──► compile
+    #
+    # Video search only needs the topic, so it runs while retrieval, the Study
+    # Note Agent and the Visual Agent are working.
+
+    def _retrieval():
+        # Step 1: Search Qdrant for curriculum context
+        print("[Pipeline] Searching curriculum context in Qdrant...")
+        curriculum_context = search_curriculum_context(topic_id, topic_name, chapter_id)
+        print(f"[Pipeline] Found context ({len(curriculum_context)} chars)")
+        return curriculum_context
+
+    def _note(retrieval):
+        # Step 2: Study Note Agent (writes directly in the target language)
+        print("\n[Pipeline] Running Study Note Agent...")
+        return run_study_note_agent(
+            topic_name=topic_name,
+            class_name=class_name,
+            subject_name=subject_name,
+            chapter_name=chapter_name,
+            curriculum_context=retrieval,
+            language=language
+        )
 
-    # Step 2: Study Note Agent (writes directly in the target language)
-    print("\n[Pipeline] Running Study Note Agent...")
-    note_output = run_study_note_agent(
-        topic_name=topic_name,
-        class_name=class_name,
-        subject_name=subject_name,
-        chapter_name=chapter_name,
-        curriculum_context=curriculum_context,
-        language=language
-    )
+    def _visuals(note):
+        # Step 3: Visual Agent — reuse as-is by wrapping flagged concept blocks
+        # in the localized_problems shape it expects. The "id" is the block's
+        # 1-based position in concept_blocks, so visuals map back to their blocks.
+        diagram_blocks = []
+        for i, block in enumerate(note.get("concept_blocks") or [], start=1):
+            if block.get("needs_diagram", False):
+                diagram_blocks.append({
+                    "id": i,
+                    "localized_question": block.get("heading", ""),
+                    "answer": "",
+                    "solution_steps": [],
+                    "needs_diagram": True,
+                    "diagram_type": block.get("diagram_type", "none"),
+                    "diagram_description": block.get("diagram_description", "")
+                })
+
+        if not diagram_blocks:
+            print("[Visual Agent] No visuals needed, skipping.")
+            return {"robot_mascot": "", "problem_visuals": []}
+        print("\n[Pipeline] Running Visual Agent...")
+        return run_visual_agent({"localized_problems": diagram_blocks}, "", language=language)
+
+    def _videos():
+        print("\n[Pipeline] Searching relevant YouTube videos...")
+        videos = run_video_search_agent(
+            topic_name   = topic_name,
+            class_name   = class_name,
+            subject_name = subject_name,
+            language     = language,
+            max_results  = 4
+        )
+        print(f"[Pipeline] Found {len(videos)} videos")
+        return videos
+
+    def _compile(note, visuals, videos):
+        if not note.get("concept_blocks"):
+            return None
+        # Step 4: Study Note Compiler
+        print("\n[Pipeline] Running Study Note Compiler...")
+        return run_study_note_compiler(
+            note_output=note,
+            visual_output=visuals,
+            class_name=class_name,
+            subject_name=subject_name,
+            chapter_name=chapter_name,
+            topic_name=topic_name,
+            language=language,
+            videos=videos                     #video add
+        )
 
+    results, timings = run_stage_graph({
+        "retrieval": (_retrieval, []),
+        "videos":    (_videos, []),
+        "note":      (_note, ["retrieval"]),
+        "visuals":   (_visuals, ["note"]),
+        "compile":   (_compile, ["note", "visuals", "videos"]),
+    })
+    print(f"[Pipeline] Stage timings (s): " + ", ".join(
+        f"{name}={t['duration_s']}" for name, t in timings.items()
+    ))
+
+    note_output = results["note"]
     if not note_output.get("concept_blocks"):
-        return {"error": "Study Note Agent failed to generate the note", "html": ""}
-
-    # Step 3: Visual Agent — reuse as-is by wrapping flagged concept blocks
-    # in the localized_problems shape it expects. The "id" is the block's
-    # 1-based position in concept_blocks, so visuals map back to their blocks.
-    print("\n[Pipeline] Running Visual Agent...")
-    diagram_blocks = []
-    for i, block in enumerate(note_output["concept_blocks"], start=1):
-        if block.get("needs_diagram", False):
-            diagram_blocks.append({
-                "id": i,
-                "localized_question": block.get("heading", ""),
-                "answer": "",
-                "solution_steps": [],
-                "needs_diagram": True,
-                "diagram_type": block.get("diagram_type", "none"),
-                "diagram_description": block.get("diagram_description", "")
-            })
-
-    if diagram_blocks:
-        visual_output = run_visual_agent({"localized_problems": diagram_blocks}, "", language=language)
-    else:
-        print("[Visual Agent] No visuals needed, skipping.")
-        visual_output = {"robot_mascot": "", "problem_visuals": []}
-    
-    #video agent 
-    print("\n[Pipeline] Searching relevant YouTube videos...")
-    videos = run_video_search_agent(
-        topic_name   = topic_name,
-        class_name   = class_name,
-        subject_name = subject_name,
-        language     = language,
-        max_results  = 4
-    )
-    print(f"[Pipeline] Found {len(videos)} videos")
-
-    # Step 4: Study Note Compiler
-    print("\n[Pipeline] Running Study Note Compiler...")
-    note_html = run_study_note_compiler(
-        note_output=note_output,
-        visual_output=visual_output,
-        class_name=class_name,
-        subject_name=subject_name,
-        chapter_name=chapter_name,
-        topic_name=topic_name,
-        language=language,
-        videos= videos                    #video add
-    )
+        return {"error": "Study Note Agent failed to generate the note", "html": "", "timings": timings}
 
     print(f"\n{'='*50}")
     print(f"STUDY NOTE GENERATION COMPLETE")
     print(f"{'='*50}\n")
 
+    curriculum_context = results["retrieval"]
     return {
-        "html": note_html,
+        "html": results["compile"],
         "note": note_output,
-        "visuals": visual_output,
-        "videos": videos,
-        "curriculum_context_used": curriculum_context[:200] + "..."
+        "visuals": results["visuals"],
+        "videos": results["videos"],
+        "curriculum_context_used": curriculum_context[:200] + "...",
+        "timings": timings,
     }
     
     
@@ -0,0 +1,263 @@
+# hybrid_search.py - Dense + sparse (BM25) retrieval fused with RRF.
+#
+# Next to its unnamed dense vector, every point carries a named sparse vector
+# SPARSE_VECTOR_NAME built locally at ingestion (utils/sparse_encoder.py), with
+# Modifier.IDF so Qdrant applies the IDF factor at query time. hybrid_query()
+# sends ONE query_points request with two prefetches — dense top-N and sparse
+# top-N under the same filter — fused server-side by reciprocal-rank fusion:
+# chunks that contain the exact formula or heading rise above chunks that are
+# only "about" the topic, so fewer chunks make a better context.
+#
+# Collections created before this change have no sparse vector, and Qdrant
+# cannot add one to an existing collection. migrate_to_hybrid_collection()
+# copies the points into a new collection that has the sparse vector,
+# backfills their sparse vectors from the stored chunk text, and makes
+# COLLECTION_NAME an alias of the new collection. It is run ONCE, by hand, via
+# backend/migrate_hybrid.py — which pauses ingestion first — never implicitly
+# at process start. Until then hybrid_enabled() stays False and retrieval
+# stays dense-only.
+#
+# The smaller hybrid context (HYBRID_TOP_K / HYBRID_MAX_CONTEXT_CHARS) is only
+# used for chapters whose points all carry the sparse vector
+# (chapter_has_sparse), since dense-only ranking needs the larger context.
+#
+# HYBRID_SEARCH: "1" (default) or "0" to force dense-only retrieval.
+
+import os
+from typing import List, Optional
+
+from qdrant_client.http.models import (
+    CreateAlias, CreateAliasOperation, DeleteAlias, DeleteAliasOperation, FieldCondition, Filter, Fusion,
+    FusionQuery, HasVectorCondition, MatchValue, Modifier, PointStruct, PointVectors, Prefetch, QueryRequest,
+    SparseVector, SparseVectorParams,
+)
+
+from core.config import qdrant_client, COLLECTION_NAME
+from utils.sparse_encoder import encode_document, encode_query
+
+
+SPARSE_VECTOR_NAME = "bm25"
+HYBRID_SEARCH = os.getenv("HYBRID_SEARCH", "1") == "1"
+# Candidates each branch contributes to the fusion
+HYBRID_PREFETCH_LIMIT = int(os.getenv("HYBRID_PREFETCH_LIMIT", "30"))
+# Single-topic context size when hybrid ranking is active (dense-only: 10 / 15000)
+HYBRID_TOP_K = int(os.getenv("HYBRID_TOP_K", "6"))
+HYBRID_MAX_CONTEXT_CHARS = int(os.getenv("HYBRID_MAX_CONTEXT_CHARS", "9000"))
+
+SPARSE_VECTORS_CONFIG = {SPARSE_VECTOR_NAME: SparseVectorParams(modifier=Modifier.IDF)}
+
+_collection_has_sparse: Optional[bool] = None
+
+
+def hybrid_enabled(refresh: bool = False) -> bool:
+    """True when hybrid search is switched on and the collection has the
+    sparse vector. The collection check is cached for the process lifetime."""
+    global _collection_has_sparse
+    if not HYBRID_SEARCH:
+        return False
+    if _collection_has_sparse is None or refresh:
+        try:
+            params = qdrant_client.get_collection(COLLECTION_NAME).config.params
+            _collection_has_sparse = SPARSE_VECTOR_NAME in (params.sparse_vectors or {})
+        except Exception as e:
+            print(f"[Hybrid] Could not read collection config ({e}) — dense-only retrieval")
+            return False
+    return _collection_has_sparse
+
+
+def document_sparse_vector(text: str) -> SparseVector:
+    indices, values = encode_document(text)
+    return SparseVector(indices=indices, values=values)
+
+
+def point_vector(dense: List[float], text: str):
+    """The `vector` field of a PointStruct: dense only, or dense + sparse."""
+    if not hybrid_enabled():
+        return dense
+    return {"": dense, SPARSE_VECTOR_NAME: document_sparse_vector(text)}
+
+
+def backfill_sparse_vectors(texts_by_point: dict, batch_size: int = 256,
+                            collection_name: str = None, wait: bool = False) -> int:
+    """Writes sparse vectors for existing points ({point_id: text}) without
+    touching their dense vectors — used for chunks kept by incremental
+    re-ingestion, which may predate the sparse index, and by the migration
+    (which names its target collection explicitly)."""
+    if not texts_by_point or (collection_name is None and not hybrid_enabled()):
+        return 0
+    items = list(texts_by_point.items())
+    for start in range(0, len(items), batch_size):
+        qdrant_client.update_vectors(
+            collection_name=collection_name or COLLECTION_NAME,
+            points=[
+                PointVectors(id=point_id, vector={SPARSE_VECTOR_NAME: document_sparse_vector(text)})
+                for point_id, text in items[start:start + batch_size]
+            ],
+            wait=wait,
+        )
+    return len(items)
+
+
+def chapter_has_sparse(chapter_id: int) -> bool:
+    """True when hybrid search is on and every point of the chapter carries
+    the sparse vector (one exact count of the points that do not)."""
+    if not hybrid_enabled():
+        return False
+    try:
+        missing = qdrant_client.count(
+            collection_name=COLLECTION_NAME,
+            count_filter=Filter(
+                must=[FieldCondition(key="chapter_id", match=MatchValue(value=chapter_id))],
+                must_not=[HasVectorCondition(has_vector=SPARSE_VECTOR_NAME)],
+            ),
+            exact=True,
+        ).count
+    except Exception as e:
+        print(f"[Hybrid] Could not check sparse vectors of chapter {chapter_id} ({e}) — dense-only context size")
+        return False
+    return missing == 0
+
+
+def _aliased_collection(name: str) -> Optional[str]:
+    """The collection behind alias `name`, or None when `name` is not an alias."""
+    for alias in qdrant_client.get_aliases().aliases:
+        if alias.alias_name == name:
+            return alias.collection_name
+    return None
+
+
+def collection_available() -> bool:
+    """True when COLLECTION_NAME exists as a collection or as an alias."""
+    return qdrant_client.collection_exists(COLLECTION_NAME) or _aliased_collection(COLLECTION_NAME) is not None
+
+
+def migration_pending() -> bool:
+    """True when COLLECTION_NAME is missing but a migrated collection exists —
+    a migration is between dropping its source and creating the alias."""
+    return not collection_available() and qdrant_client.collection_exists(f"{COLLECTION_NAME}_hybrid")
+
+
+def resume_hybrid_migration() -> bool:
+    """Creates the COLLECTION_NAME alias when a migration stopped after dropping
+    the source collection. Returns True when the migrated collection was found."""
+    target = f"{COLLECTION_NAME}_hybrid"
+    if not qdrant_client.collection_exists(target):
+        return False
+    qdrant_client.update_collection_aliases(change_aliases_operations=[
+        CreateAliasOperation(create_alias=CreateAlias(collection_name=target, alias_name=COLLECTION_NAME))
+    ])
+    print(f"[Hybrid] Resumed migration: alias '{COLLECTION_NAME}' -> '{target}'")
+    return True
+
+
+def migrate_to_hybrid_collection(batch_size: int = 256) -> bool:
+    """Moves a dense-only COLLECTION_NAME to a collection with the sparse
+    vector: create `<source>_hybrid`, copy every point (dense vector +
+    payload), backfill its sparse vector from the payload text, then point
+    the alias COLLECTION_NAME at the new collection and drop the old one.
+    Returns True when hybrid search is available afterwards.
+    Nothing may write to the collection meanwhile: run it only through
+    migrate_hybrid.py, which holds the ingestion pause lock."""
+    source = _aliased_collection(COLLECTION_NAME) or COLLECTION_NAME
+    target = f"{source}_hybrid"
+    params = qdrant_client.get_collection(source).config.params
+    dense_config = params.vectors[""] if isinstance(params.vectors, dict) else params.vectors
+
+    # A leftover target is from an interrupted migration — start it over
+    if qdrant_client.collection_exists(target):
+        qdrant_client.delete_collection(target)
+    qdrant_client.create_collection(
+        collection_name=target,
+        vectors_config=dense_config,
+        sparse_vectors_config=SPARSE_VECTORS_CONFIG,
+    )
+
+    copied = 0
+    offset = None
+    while True:
+        records, offset = qdrant_client.scroll(
+            collection_name=source,
+            with_payload=True,
+            with_vectors=True,
+            limit=batch_size,
+            offset=offset,
+        )
+        if records:
+            qdrant_client.upsert(
+                collection_name=target,
+                points=[
+                    PointStruct(
+                        id=r.id,
+                        vector=r.vector.get("") if isinstance(r.vector, dict) else r.vector,
+                        payload=r.payload,
+                    )
+                    for r in records
+                ],
+                wait=True,
+            )
+            backfill_sparse_vectors(
+                {r.id: (r.payload or {}).get("text", "") for r in records},
+                batch_size=batch_size, collection_name=target, wait=True,
+            )
+            copied += len(records)
+        if offset is None:
+            break
+
+    expected = qdrant_client.count(collection_name=source, exact=True).count
+    if qdrant_client.count(collection_name=target, exact=True).count != expected:
+        # Points were written to the source during the copy — keep it and retry
+        qdrant_client.delete_collection(target)
+        print(f"[Hybrid] '{source}' changed during the migration — kept it, retrieval stays dense-only")
+        return False
+
+    if source == COLLECTION_NAME:
+        # An alias cannot share its name with a collection: drop the source first
+        qdrant_client.delete_collection(source)
+        operations = [CreateAliasOperation(create_alias=CreateAlias(collection_name=target, alias_name=COLLECTION_NAME))]
+    else:
+        operations = [
+            DeleteAliasOperation(delete_alias=DeleteAlias(alias_name=COLLECTION_NAME)),
+            CreateAliasOperation(create_alias=CreateAlias(collection_name=target, alias_name=COLLECTION_NAME)),
+        ]
+    qdrant_client.update_collection_aliases(change_aliases_operations=operations)
+    if source != COLLECTION_NAME:
+        qdrant_client.delete_collection(source)
+
+    print(f"[Hybrid] Migrated {copied} point(s) from '{source}' to '{target}' "
+          f"(alias '{COLLECTION_NAME}') with sparse vector '{SPARSE_VECTOR_NAME}'")
+    return hybrid_enabled(refresh=True)
+
+
+def _query_args(query_vector: List[float], query_text: str, qdrant_filter, limit: int) -> dict:
+    """Keyword arguments shared by query_points() and QueryRequest: RRF over
+    dense + sparse prefetches, or a plain dense query when hybrid is
+    unavailable or the query has no lexical tokens."""
+    indices, values = encode_query(query_text or "")
+    if not hybrid_enabled() or not indices:
+        return {"query": query_vector, "filter": qdrant_filter, "limit": limit, "with_payload": True}
+    return {
+        "prefetch": [
+            Prefetch(query=query_vector, filter=qdrant_filter, limit=HYBRID_PREFETCH_LIMIT),
+            Prefetch(
+                query=SparseVector(indices=indices, values=values),
+                using=SPARSE_VECTOR_NAME,
+                filter=qdrant_filter,
+                limit=HYBRID_PREFETCH_LIMIT,
+            ),
+        ],
+        "query": FusionQuery(fusion=Fusion.RRF),
+        "limit": limit,
+        "with_payload": True,
+    }
+
+
+def hybrid_request(query_vector: List[float], query_text: str, qdrant_filter, limit: int) -> QueryRequest:
+    """The same search as hybrid_query(), for query_batch_points()."""
+    return QueryRequest(**_query_args(query_vector, query_text, qdrant_filter, limit))
+
+
+def hybrid_query(query_vector: List[float], query_text: str, qdrant_filter, limit: int) -> list:
+    """Top `limit` points by RRF over the dense and sparse rankings."""
+    args = _query_args(query_vector, query_text, qdrant_filter, limit)
+    args["query_filter"] = args.pop("filter")
+    return qdrant_client.query_points(collection_name=COLLECTION_NAME, **args).points
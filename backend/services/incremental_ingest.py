@@ -0,0 +1,202 @@
+# incremental_ingest.py - Chunk-level diff for re-uploaded files.
+#
+# Re-uploading a corrected edition of a chapter used to re-embed and re-store
+# every chunk, even when 95% of the text was unchanged. Each chunk now carries a
+# content_hash (utils/chunker.content_hash), stored in its Qdrant payload and
+# its ContentEmbedding row. Before embedding, the pipeline diffs the new chunks
+# against the points already stored for the same scope:
+#
+#   kept      same hash already stored  → no embedding; payload position
+#                                          (page/chunk_index) refreshed and the
+#                                          SQL row moved to the new job
+#   new       hash not stored yet       → embedded and upserted as usual
+#   vanished  stored hash not in upload → point and SQL row deleted
+#
+# The diff only covers points of the same chapter, source type and FILENAME:
+# re-uploading "math_ch3.pdf" replaces the earlier "math_ch3.pdf", while a
+# second, different PDF for the chapter is stored next to the first one (it
+# is never read as "everything else vanished"). Kept rows are moved to the
+# new job in the same transaction that deletes the vanished ones, so
+# delete_file_from_system() finds every row of the file under its job.
+#
+# Points written by the CURRENT job (an earlier attempt of a retried job) are
+# ignored by the diff: the retry rewrites them with the same ids, and
+# clear_job_rows() drops their SQL rows (but not the adopted kept ones) so
+# they are recreated once.
+#
+# Legacy points without a content_hash payload are hashed from their stored
+# text, so chapters ingested before this change benefit from the first re-upload.
+
+import json
+import uuid
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+from qdrant_client.http.models import (
+    Filter, FieldCondition, MatchValue, PointIdsList, SetPayload, SetPayloadOperation,
+)
+from sqlalchemy import or_
+from sqlalchemy.orm import Session
+
+from core.config import qdrant_client, COLLECTION_NAME
+from models.db_models import ContentEmbedding
+from utils.chunker import content_hash
+
+
+SCROLL_PAGE_SIZE = 512
+
+
+def _scope_filter(chapter_id: int, filename: str, source_type: str) -> Filter:
+    return Filter(must=[
+        FieldCondition(key="chapter_id", match=MatchValue(value=chapter_id)),
+        FieldCondition(key="source_type", match=MatchValue(value=source_type)),
+        FieldCondition(key="filename", match=MatchValue(value=filename)),
+    ])
+
+
+def stored_points_by_hash(chapter_id: int, filename: str, source_type: str,
+                          job_id: int) -> Dict[str, List[str]]:
+    """{content_hash: [point_id, ...]} for every stored point in the diff scope."""
+    by_hash = defaultdict(list)
+    offset = None
+    while True:
+        records, offset = qdrant_client.scroll(
+            collection_name=COLLECTION_NAME,
+            scroll_filter=_scope_filter(chapter_id, filename, source_type),
+            with_payload=["content_hash", "text", "job_id"],
+            with_vectors=False,
+            limit=SCROLL_PAGE_SIZE,
+            offset=offset,
+        )
+        for record in records:
+            payload = record.payload or {}
+            if payload.get("job_id") == job_id:
+                continue
+            h = payload.get("content_hash") or content_hash(payload.get("text", ""))
+            by_hash[h].append(str(record.id))
+        if offset is None:
+            break
+    return by_hash
+
+
+def diff_chunks(chunks: List[Dict], stored: Dict[str, List[str]]) -> Tuple[List[Dict], List[Tuple[Dict, str]], List[str]]:
+    """Splits chunks into (new_chunks, kept [(chunk, point_id)], vanished_point_ids).
+    Matching is a multiset match, so a paragraph repeated twice needs two stored copies."""
+    remaining = {h: list(ids) for h, ids in stored.items()}
+    new_chunks, kept = [], []
+    for chunk in chunks:
+        ids = remaining.get(chunk["content_hash"])
+        if ids:
+            kept.append((chunk, ids.pop(0)))
+        else:
+            new_chunks.append(chunk)
+    vanished = [pid for ids in remaining.values() for pid in ids]
+    return new_chunks, kept, vanished
+
+
+def new_point_id(filename: str, chunk: Dict, taken: set) -> str:
+    """Deterministic id for a new chunk (a retry reproduces it), derived from
+    the content hash so it can never collide with a kept chunk's position-based id."""
+    n = 0
+    while True:
+        point_id = str(uuid.uuid5(uuid.NAMESPACE_DNS, f"{filename}_{chunk['content_hash']}_{n}"))
+        if point_id not in taken:
+            taken.add(point_id)
+            return point_id
+        n += 1
+
+
+def refresh_kept_payloads(kept: List[Tuple[Dict, str]], filename: str,
+                          extra_payloads: Dict[str, Dict] = None) -> None:
+    """Kept chunks may have moved (new page/chunk_index) — update only those
+    payload fields (plus any per-point `extra_payloads`, e.g. re-assigned
+    topics), in batched calls. The payload job_id stays that of the job that
+    embedded the chunk, which is what lets a retry tell its own points apart."""
+    if not kept:
+        return
+    extra_payloads = extra_payloads or {}
+    operations = [
+        SetPayloadOperation(set_payload=SetPayload(
+            payload={
+                "filename": filename,
+                "page": chunk["page_num"],
+                "chunk_index": chunk["chunk_index"],
+                "content_hash": chunk["content_hash"],
+                **extra_payloads.get(point_id, {}),
+            },
+            points=[point_id],
+        ))
+        for chunk, point_id in kept
+    ]
+    for start in range(0, len(operations), SCROLL_PAGE_SIZE):
+        qdrant_client.batch_update_points(
+            collection_name=COLLECTION_NAME,
+            update_operations=operations[start:start + SCROLL_PAGE_SIZE],
+        )
+
+
+# ── SQL ROWS ──────────────────────────────────────────────────────────────────
+
+def _legacy_rows(db: Session, chapter_id: int, point_ids: List[str]) -> Dict[str, int]:
+    """{point_id: embedding_id} for rows written before qdrant_point_id
+    existed, which carry the id only inside their metadata JSON. One query
+    over the chapter's legacy rows instead of a LIKE scan per point."""
+    wanted = set(point_ids)
+    rows = db.query(ContentEmbedding.embedding_id, ContentEmbedding.embedding_metadata).filter(
+        ContentEmbedding.chapter_id == chapter_id,
+        ContentEmbedding.qdrant_point_id.is_(None),
+    ).all()
+    found = {}
+    for embedding_id, metadata in rows:
+        try:
+            point_id = json.loads(metadata or "{}").get("qdrant_point_id")
+        except (ValueError, AttributeError):
+            continue
+        if point_id in wanted:
+            found[point_id] = embedding_id
+    return found
+
+
+def clear_job_rows(db: Session, job_id: int, keep_point_ids: List[str]) -> None:
+    """Drops the rows an earlier attempt of this job inserted, keeping the
+    kept chunks' rows it adopted. The caller commits."""
+    query = db.query(ContentEmbedding).filter(
+        ContentEmbedding.job_id == job_id,
+        ContentEmbedding.qdrant_point_id.isnot(None),
+    )
+    if keep_point_ids:
+        query = query.filter(ContentEmbedding.qdrant_point_id.notin_(keep_point_ids))
+    query.delete(synchronize_session=False)
+
+
+def delete_vanished(db: Session, chapter_id: int, point_ids: List[str]) -> None:
+    """Removes vanished chunks from Qdrant and their ContentEmbedding rows in
+    one DELETE. The caller commits."""
+    if not point_ids:
+        return
+    qdrant_client.delete(
+        collection_name=COLLECTION_NAME,
+        points_selector=PointIdsList(points=point_ids),
+    )
+    legacy_ids = list(_legacy_rows(db, chapter_id, point_ids).values())
+    db.query(ContentEmbedding).filter(or_(
+        ContentEmbedding.qdrant_point_id.in_(point_ids),
+        ContentEmbedding.embedding_id.in_(legacy_ids),
+    )).delete(synchronize_session=False)
+
+
+def adopt_kept_rows(db: Session, chapter_id: int, point_ids: List[str], job_id: int) -> None:
+    """Moves the kept chunks' rows to the job that now owns the file, so
+    deleting either upload later removes exactly the live rows. Legacy rows
+    get their qdrant_point_id column filled on the way. The caller commits."""
+    if not point_ids:
+        return
+    db.query(ContentEmbedding).filter(
+        ContentEmbedding.qdrant_point_id.in_(point_ids)
+    ).update({ContentEmbedding.job_id: job_id}, synchronize_session=False)
+    legacy = _legacy_rows(db, chapter_id, point_ids)
+    if legacy:
+        db.bulk_update_mappings(ContentEmbedding, [
+            {"embedding_id": embedding_id, "job_id": job_id, "qdrant_point_id": point_id}
+            for point_id, embedding_id in legacy.items()
+        ])
@@ -0,0 +1,102 @@
+# ingestion_checkpoints.py - Per-stage checkpoints for the ingestion pipeline.
+#
+# run_ingestion_pipeline used to be all-or-nothing: a Qdrant or Postgres error
+# at the very end threw away minutes of OCR, topic extraction and embedding.
+# Each expensive stage now saves its output to the ingestion_checkpoint table,
+# keyed by (job_id, stage), as soon as it completes. A retried job (automatic
+# queue retry, a reclaimed lock, or POST /ingest/retry/{job_id}) loads those
+# outputs and skips straight to the first unfinished stage.
+#
+# Stages, in pipeline order:
+#   pages       parsed {page_num, text} records  (skips OCR)
+#   topics      [{topic_id, name}]               (skips Gemini topic extraction)
+#   chunks      chunk dicts                      (skips chunking)
+#   embeddings  one vector (or None) per chunk   (skips embedding)
+# The later steps (Qdrant upsert, SQL rows) are idempotent and simply re-run.
+#
+# Checkpoints are deleted once the job succeeds.
+
+import json
+import base64
+from array import array
+from typing import Any, List, Optional
+
+from sqlalchemy.orm import Session, undefer
+
+from models.db_models import IngestionCheckpoint
+
+
+STAGES = ["pages", "topics", "chunks", "embeddings"]
+
+
+# ── VECTOR ENCODING ───────────────────────────────────────────────────────────
+# 3072 floats as JSON text is ~60KB per chunk; packed float32 + base64 is ~16KB.
+
+def encode_vectors(vectors: List[Optional[List[float]]]) -> List[Optional[str]]:
+    return [
+        base64.b64encode(array("f", v).tobytes()).decode("ascii") if v is not None else None
+        for v in vectors
+    ]
+
+
+def decode_vectors(encoded: List[Optional[str]]) -> List[Optional[List[float]]]:
+    vectors = []
+    for item in encoded:
+        if item is None:
+            vectors.append(None)
+            continue
+        values = array("f")
+        values.frombytes(base64.b64decode(item))
+        vectors.append(values.tolist())
+    return vectors
+
+
+# ── READ / WRITE ──────────────────────────────────────────────────────────────
+
+def save_checkpoint(db: Session, job_id: int, stage: str, data: Any) -> None:
+    """Stores (or replaces) the output of one stage and commits."""
+    payload = json.dumps(data, ensure_ascii=False)
+    existing = db.query(IngestionCheckpoint).filter(
+        IngestionCheckpoint.job_id == job_id,
+        IngestionCheckpoint.stage == stage,
+    ).first()
+    if existing:
+        existing.payload = payload
+    else:
+        db.add(IngestionCheckpoint(job_id=job_id, stage=stage, payload=payload))
+    db.commit()
+    print(f"[Job {job_id}] Checkpoint saved: {stage} ({len(payload) / 1024:.0f} KB)")
+
+
+def load_checkpoint(db: Session, job_id: int, stage: str) -> Optional[Any]:
+    """Returns the saved output of a stage, or None if it never completed."""
+    row = (
+        db.query(IngestionCheckpoint)
+        .options(undefer(IngestionCheckpoint.payload))
+        .filter(IngestionCheckpoint.job_id == job_id, IngestionCheckpoint.stage == stage)
+        .first()
+    )
+    if row is None:
+        return None
+    try:
+        return json.loads(row.payload)
+    except ValueError:
+        print(f"[Job {job_id}] Checkpoint '{stage}' is unreadable — recomputing.")
+        return None
+
+
+def completed_stages(db: Session, job_id: int) -> List[str]:
+    """Stages with a saved checkpoint, in pipeline order."""
+    saved = {
+        stage for (stage,) in db.query(IngestionCheckpoint.stage)
+        .filter(IngestionCheckpoint.job_id == job_id)
+        .all()
+    }
+    return [stage for stage in STAGES if stage in saved]
+
+
+def clear_checkpoints(db: Session, job_id: int) -> None:
+    db.query(IngestionCheckpoint).filter(
+        IngestionCheckpoint.job_id == job_id
+    ).delete(synchronize_session=False)
+    db.commit()
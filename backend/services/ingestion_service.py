@@ -3,7 +3,6 @@
 # Auto-extracts topics from the PDF using Gemini, inserts them into the Topic table,
 # then chunks and embeds content per topic.
 
-import uuid
 import json
 from typing import List
 
@@ -11,13 +10,28 @@ from sqlalchemy.orm import Session
 from qdrant_client.http.models import PointStruct
 
 from utils.parser import parse_file
-from utils.chunker import chunk_pages_by_chapter
+from utils.chunker import chunk_pages_by_chapter, content_hash
 from services.embedding_service import generate_embeddings_for_chunks
-from core.config import qdrant_client, COLLECTION_NAME, SessionLocal
+from services.ingestion_checkpoints import (
+    save_checkpoint, load_checkpoint, completed_stages, clear_checkpoints,
+    encode_vectors, decode_vectors,
+)
+from services.vector_upload import upsert_points_streaming
+from services.hybrid_search import point_vector, backfill_sparse_vectors
+from services.retrieval_cache import bump_chapter_versions
+from services.job_queue import JobLockLost, assert_job_owner, fence_session
+from services.content_embeddings import save_content_embeddings
+from services.topic_assignment import topic_query_vectors, assign_topics, stored_vectors
+from services.topic_embeddings import store_topic_embeddings, load_topic_vectors
+from services.incremental_ingest import (
+    stored_points_by_hash, diff_chunks, new_point_id, refresh_kept_payloads, delete_vanished,
+    adopt_kept_rows, clear_job_rows,
+)
+from core.config import SessionLocal
 from models.db_models import IngestionJob, UploadMetadata, ContentEmbedding, UploadRequest, Topic
 from models.db_models import Chapter
 
-from core.config import gemini_client
+from core.config import generate_with_backoff, PRIORITY_BACKGROUND, EMBEDDING_MODEL
 
 
 
@@ -62,9 +76,12 @@ Chapter text (for context):
 {full_text[:30000]}
 """
 
-    response = gemini_client.models.generate_content(
+    # Background lane: ingestion must never delay a teacher's generation request
+    response = generate_with_backoff(
         model="gemini-2.5-flash",
-        contents=prompt
+        contents=prompt,
+        priority=PRIORITY_BACKGROUND,
+        cache=True      # re-ingesting the same chapter sends this exact prompt again
     )
     raw = response.text.strip()
 
@@ -132,10 +149,12 @@ Chapter text:
 {full_text[:50000]}
 """
 
-    response = gemini_client.models.generate_content(
-    model="gemini-2.5-flash",
-    contents=prompt
-)
+    response = generate_with_backoff(
+        model="gemini-2.5-flash",
+        contents=prompt,
+        priority=PRIORITY_BACKGROUND,
+        cache=True      # re-ingesting the same chapter sends this exact prompt again
+    )
     raw = response.text.strip()
 
     # Strip markdown code fences if Gemini adds them
@@ -158,6 +177,7 @@ Chapter text:
 
     # For each topic name, get or create a row in the Topic table
     result = []
+    needs_embedding = []    # topics whose description vector must be (re)computed
     for name in topic_names:
         name = name.strip()
         existing = db.query(Topic).filter(
@@ -170,6 +190,14 @@ Chapter text:
         
         if existing:
             topic_id = existing.topic_id
+            if existing.description != description:
+                # The stored vector is for the old description — drop it now so
+                # a failed re-embed falls back to query-time embedding, not a stale vector
+                existing.description_embedding = None
+                existing.description_embedding_model = None
+                needs_embedding.append(existing)
+            elif existing.description_embedding_model != EMBEDDING_MODEL:
+                needs_embedding.append(existing)
             existing.description = description   # update description
             print(f"  [Topic] Already exists: '{name}' (id={topic_id})")
         else:
@@ -181,10 +209,19 @@ Chapter text:
             db.add(new_topic)
             db.flush()
             topic_id = new_topic.topic_id
+            needs_embedding.append(new_topic)
             print(f"  [Topic] Created: '{name}' (id={topic_id})")
 
         result.append({"topic_id": topic_id, "name": name})
 
+    # Descriptions are the retrieval queries for their topics — embed them once
+    # here so generation requests never have to (services/topic_embeddings.py).
+    # A failure only costs the topics their stored vector; retrieval embeds those.
+    try:
+        store_topic_embeddings(db, needs_embedding)
+    except Exception as e:
+        print(f"[Auto-Extract] Could not embed topic descriptions ({e}) — retrieval will embed them on demand")
+
     db.commit()
     return result
 
@@ -198,37 +235,65 @@ def run_ingestion_pipeline(
     filename: str,
     file_size: int,
     source_type: str = "nctb",      # NEW
+    raise_errors: bool = False,
+    worker_id: str = None,
 ):
     """
-    Background pipeline. Steps:
+    Ingestion pipeline, run by the queue worker (worker.py). Steps:
     STEP 1 → Mark job PROCESSING
     STEP 2 → Parse PDF/TXT to extract text by page
     STEP 3 → Auto-extract topics using Gemini → insert into Topic table
     STEP 4 → Chunk text per topic using semantic assignment
+             (then diff against stored chunks — only new ones are embedded)
     STEP 5 → Generate embeddings
     STEP 6 → Upload vectors to Qdrant with topic_id in payload
     STEP 7 → Save ContentEmbedding records to PostgreSQL
     STEP 8 → Save UploadMetadata
     STEP 9 → Mark job SUCCESS
+
+    With raise_errors=True a failure is re-raised instead of being recorded as
+    FAILED, so the queue can decide between a retry and a final failure.
+
+    With worker_id, every commit first checks that this worker still holds
+    the job (job_queue.fence_session) — a worker whose lock expired stops
+    with JobLockLost at its next commit instead of racing the new owner.
     """
 
     db: Session = SessionLocal()
+    if worker_id:
+        fence_session(db, job_id, worker_id)
 
     try:
 
         # ── STEP 1: PROCESSING ────────────────────────────────────────────────
         job = db.query(IngestionJob).filter(IngestionJob.job_id == job_id).first()
         job.job_status = "PROCESSING"
+
+        # A retried or reclaimed job may have saved rows before it died.
+        # Qdrant point ids are deterministic (upsert overwrites), but SQL rows
+        # would be duplicated — clear this job's leftovers first (its
+        # ContentEmbedding rows after the diff, see STEP 4b).
+        db.query(UploadMetadata).filter(UploadMetadata.job_id == job_id).delete(synchronize_session=False)
         db.commit()
         print(f"[Job {job_id}] Status → PROCESSING")
 
 
+        # Stages that finished on an earlier attempt are loaded from their
+        # checkpoint instead of being recomputed (services/ingestion_checkpoints.py).
+        resumed = completed_stages(db, job_id)
+        if resumed:
+            print(f"[Job {job_id}] Resuming — completed stages: {', '.join(resumed)}")
+
+
         # ── STEP 2: PARSE FILE ────────────────────────────────────────────────
-        print(f"[Job {job_id}] Parsing '{filename}'...")
-        pages = parse_file(file_bytes, filename)
+        pages = load_checkpoint(db, job_id, "pages")
+        if pages is None:
+            print(f"[Job {job_id}] Parsing '{filename}'...")
+            pages = parse_file(file_bytes, filename)
 
-        if not pages:
-            raise ValueError("No readable text could be extracted from the uploaded file.")
+            if not pages:
+                raise ValueError("No readable text could be extracted from the uploaded file.")
+            save_checkpoint(db, job_id, "pages", pages)
 
         print(f"[Job {job_id}] Extracted {len(pages)} page(s).")
 
@@ -238,10 +303,13 @@ def run_ingestion_pipeline(
         topics = []
         # ── STEP 3: AUTO-EXTRACT TOPICS ───────────────────────────────────────
         if source_type == "nctb":
-            print(f"[Job {job_id}] Extracting topics with Gemini...")
-            topics = extract_topics_from_text(full_text, chapter_id, db)
-            if not topics:
-                raise ValueError("Gemini could not extract any topics from the uploaded file.")
+            topics = load_checkpoint(db, job_id, "topics")
+            if topics is None:
+                print(f"[Job {job_id}] Extracting topics with Gemini...")
+                topics = extract_topics_from_text(full_text, chapter_id, db)
+                if not topics:
+                    raise ValueError("Gemini could not extract any topics from the uploaded file.")
+                save_checkpoint(db, job_id, "topics", topics)
             print(f"[Job {job_id}] {len(topics)} topic(s) ready.")
         else :
             print(f"Foreign content , no topic extraction")
@@ -251,76 +319,149 @@ def run_ingestion_pipeline(
 
         # ── STEP 4: CHUNK TEXT PER TOPIC ──────────────────────────────────────
         # chunk_pages_by_topic assigns each chunk to the most relevant topic
-        print(f"[Job {job_id}] Chunking text with topic assignment...")
-        chunks = chunk_pages_by_chapter(pages)
-
-        print(f"[Job {job_id}] Created {len(chunks)} chunk(s).")
+        chunks = load_checkpoint(db, job_id, "chunks")
+        if chunks is None:
+            print(f"[Job {job_id}] Chunking text with topic assignment...")
+            chunks = chunk_pages_by_chapter(pages)
+            save_checkpoint(db, job_id, "chunks", chunks)
 
+        # Chunks checkpointed before content hashing existed have no hash yet
+        for chunk in chunks:
+            chunk.setdefault("content_hash", content_hash(chunk["text"]))
 
-        # ── STEP 5: GENERATE EMBEDDINGS ───────────────────────────────────────
-        print(f"[Job {job_id}] Generating embeddings...")
-        embeddings = generate_embeddings_for_chunks(chunks)
+        print(f"[Job {job_id}] Created {len(chunks)} chunk(s).")
 
 
-        # ── STEP 6: UPLOAD TO QDRANT ──────────────────────────────────────────
-        points = []
-        successful_chunks = []
+        # ── STEP 4b: DIFF AGAINST STORED CHUNKS ───────────────────────────────
+        # Only chunks whose text is not stored yet are embedded; unchanged ones
+        # are kept as-is and vanished ones deleted (services/incremental_ingest.py).
+        stored = stored_points_by_hash(chapter_id, filename, source_type, job_id)
+        new_chunks, kept, vanished = diff_chunks(chunks, stored)
+        print(f"[Job {job_id}] Diff vs stored: {len(new_chunks)} new, "
+              f"{len(kept)} unchanged, {len(vanished)} vanished.")
+        # Rows an earlier attempt inserted for new chunks are recreated below;
+        # rows of kept chunks it already adopted stay.
+        clear_job_rows(db, job_id, [point_id for _, point_id in kept])
+        db.commit()
 
-        for i, (chunk, vector) in enumerate(zip(chunks, embeddings)):
 
-            if vector is None:
-                print(f"  [Job {job_id}] Skipping chunk {i} — embedding failed.")
-                continue
+        # ── STEP 5: GENERATE EMBEDDINGS ───────────────────────────────────────
+        saved_embeddings = load_checkpoint(db, job_id, "embeddings")
+        if saved_embeddings is not None and len(saved_embeddings) == len(new_chunks):
+            embeddings = decode_vectors(saved_embeddings)
+            missing = [i for i, v in enumerate(embeddings) if v is None]
+            if missing:
+                # Only the chunks that failed last time are embedded again
+                print(f"[Job {job_id}] Re-embedding {len(missing)} chunk(s) that failed before...")
+                retried = generate_embeddings_for_chunks([new_chunks[i] for i in missing])
+                for i, vector in zip(missing, retried):
+                    embeddings[i] = vector
+                save_checkpoint(db, job_id, "embeddings", encode_vectors(embeddings))
+        else:
+            print(f"[Job {job_id}] Generating embeddings for {len(new_chunks)} new chunk(s)...")
+            embeddings = generate_embeddings_for_chunks(new_chunks)
+            save_checkpoint(db, job_id, "embeddings", encode_vectors(embeddings))
+
+
+        # ── STEP 5b: ASSIGN TOPICS ────────────────────────────────────────────
+        # Every chunk is tagged with its closest topic(s) of the chapter, so
+        # chapter/subject retrieval can filter by topic_ids instead of running
+        # one embedding + search per topic (services/topic_assignment.py).
+        chapter_topics = [
+            {"topic_id": t.topic_id, "name": t.name, "description": t.description}
+            for t in db.query(Topic).filter(Topic.chapter_id == chapter_id).all()
+        ]
+        topic_ids, topic_matrix = topic_query_vectors(
+            chapter_topics, load_topic_vectors(db, [t["topic_id"] for t in chapter_topics])
+        )
+        new_assignments = assign_topics(embeddings, topic_ids, topic_matrix)
 
-            point_id = str(uuid.uuid5(
-                uuid.NAMESPACE_DNS,
-                f"{filename}_{chunk['chunk_index']}"
-            ))
+        # Kept chunks are re-assigned too — the chapter's topics may have changed
+        kept_assignments = {}
+        if kept and topic_ids:
+            kept_vectors = stored_vectors([point_id for _, point_id in kept])
+            kept_ids = list(kept_vectors)
+            for point_id, assignment in zip(
+                kept_ids, assign_topics([kept_vectors[k] for k in kept_ids], topic_ids, topic_matrix)
+            ):
+                kept_assignments[point_id] = assignment
+        print(f"[Job {job_id}] Assigned chunks to {len(topic_ids)} topic(s).")
 
-            points.append(PointStruct(
-                id=point_id,
-                vector=vector,
-                payload={
-                    "text": chunk["text"],
-                    "filename": filename,
-                    "page": chunk["page_num"],
-                    "chunk_index": chunk["chunk_index"],
-                    "chapter_id": chapter_id,
-                    "job_id": job_id,
-                    "source_type": source_type,     # NEW
-                }
-            ))
 
-            successful_chunks.append({
-                "chunk": chunk,
-                "vector": vector,
-                "point_id": point_id
-            })
+        # ── STEP 6: UPLOAD TO QDRANT ──────────────────────────────────────────
+        # Vanished chunks go first, then unchanged ones get their position
+        # refreshed, then new points are streamed to Qdrant in parallel batches
+        # (services/vector_upload.py). successful_chunks only references the
+        # existing chunk/vector objects — nothing is copied.
+        # Qdrant writes are not transactional — make sure the job is still ours
+        if worker_id:
+            assert_job_owner(db, job_id, worker_id)
+        delete_vanished(db, chapter_id, vanished)
+        adopt_kept_rows(db, chapter_id, [point_id for _, point_id in kept], job_id)
+        db.commit()
+        refresh_kept_payloads(kept, filename, kept_assignments)
+        # Kept chunks may predate the sparse index (services/hybrid_search.py)
+        backfill_sparse_vectors({point_id: chunk["text"] for chunk, point_id in kept})
 
-        if points:
-            qdrant_client.upsert(collection_name=COLLECTION_NAME, points=points)
-            print(f"[Job {job_id}] Uploaded {len(points)} vectors to Qdrant.")
+        successful_chunks = []
+        taken_ids = {point_id for _, point_id in kept}
+
+        def _points():
+            for i, (chunk, vector) in enumerate(zip(new_chunks, embeddings)):
+
+                if vector is None:
+                    print(f"  [Job {job_id}] Skipping chunk {chunk['chunk_index']} — embedding failed.")
+                    continue
+
+                point_id = new_point_id(filename, chunk, taken_ids)
+
+                successful_chunks.append({
+                    "chunk": chunk,
+                    "vector": vector,
+                    "point_id": point_id
+                })
+
+                yield PointStruct(
+                    id=point_id,
+                    vector=point_vector(vector, chunk["text"]),   # + BM25 sparse vector
+                    payload={
+                        "text": chunk["text"],
+                        "filename": filename,
+                        "page": chunk["page_num"],
+                        "chunk_index": chunk["chunk_index"],
+                        "chapter_id": chapter_id,
+                        "job_id": job_id,
+                        "source_type": source_type,     # NEW
+                        "content_hash": chunk["content_hash"],
+                        **new_assignments[i],
+                    }
+                )
+
+        uploaded = upsert_points_streaming(_points(), label=f"Job {job_id}")
+        print(f"[Job {job_id}] Uploaded {uploaded} vectors to Qdrant.")
 
 
         # ── STEP 7: SAVE ContentEmbedding TO POSTGRESQL ───────────────────────
-        for item in successful_chunks:
-            vector_json = json.dumps(item["vector"])
-            meta_json = json.dumps({
-                "filename": filename,
-                "page_num": item["chunk"]["page_num"],
-                "chunk_index": item["chunk"]["chunk_index"],
+        # One bulk INSERT with float32 vectors (services/content_embeddings.py).
+        # Unchanged chunks keep their rows, already moved to this job at STEP 6.
+        save_content_embeddings(db, [
+            {
+                "vector": item["vector"],
+                "metadata": {
+                    "filename": filename,
+                    "page_num": item["chunk"]["page_num"],
+                    "chunk_index": item["chunk"]["chunk_index"],
+                    "chapter_id": chapter_id,
+                    "qdrant_point_id": item["point_id"]
+                },
                 "chapter_id": chapter_id,
-                "qdrant_point_id": item["point_id"]
-            })
-
-            content_embedding = ContentEmbedding(
-                embedding_vector=vector_json,
-                embedding_metadata=meta_json,
-                chapter_id = chapter_id,   
-                job_id=job_id,
-                source_type=source_type,        # NEW
-            )
-            db.add(content_embedding)
+                "job_id": job_id,
+                "source_type": source_type,        # NEW
+                "content_hash": item["chunk"]["content_hash"],
+                "qdrant_point_id": item["point_id"],
+            }
+            for item in successful_chunks
+        ])
 
         db.commit()
         print(f"[Job {job_id}] Saved {len(successful_chunks)} ContentEmbedding records.")
@@ -343,7 +484,7 @@ def run_ingestion_pipeline(
 
         # ── STEP 9: SUCCESS ───────────────────────────────────────────────────
         db.refresh(job)
-        job.chunk_count = len(successful_chunks)
+        job.chunk_count = len(successful_chunks) + len(kept)
         job.job_status = "SUCCESS"
 
         upload_request = db.query(UploadRequest).filter(
@@ -352,12 +493,32 @@ def run_ingestion_pipeline(
         if upload_request:
             upload_request.status = "completed"
 
+        # The chapter's chunks (and topics) changed — cached contexts are stale
+        bump_chapter_versions(db, [chapter_id])
         db.commit()
-        print(f"[Job {job_id}] Status → SUCCESS | {len(successful_chunks)} chunks stored.")
+        clear_checkpoints(db, job_id)
+        print(f"[Job {job_id}] Status → SUCCESS | {len(successful_chunks)} new + "
+              f"{len(kept)} unchanged chunks stored.")
 
 
+    except JobLockLost as e:
+        # Another worker owns the job now — leave every record to it
+        print(f"[Job {job_id}] Stopped — {e}")
+        db.rollback()
+        raise
+
     except Exception as e:
         print(f"[Job {job_id}] PIPELINE FAILED — {str(e)}")
+        db.rollback()
+        try:
+            # Qdrant may already hold part of this job's changes
+            bump_chapter_versions(db, [chapter_id])
+            db.commit()
+        except Exception as bump_e:
+            db.rollback()
+            print(f"[Job {job_id}] Could not bump chapter content version — {bump_e}")
+        if raise_errors:
+            raise
 
         try:
             job = db.query(IngestionJob).filter(IngestionJob.job_id == job_id).first()
@@ -0,0 +1,321 @@
+# job_queue.py - Durable ingestion queue backed by the ingestion_job table.
+#
+# Uploads used to run as FastAPI BackgroundTasks inside the web process: the
+# whole file sat in memory, a restart or deploy silently dropped the job, and
+# ingestion competed with teacher-facing generation for the same workers.
+#
+# Now the upload endpoint only INSERTs a QUEUED job (file bytes included) and
+# returns. Separate worker processes (backend/worker.py) claim jobs with
+#   SELECT ... FOR UPDATE SKIP LOCKED
+# so any number of workers can poll the same table without double-claiming.
+#
+# Job lifecycle (job_status):
+#   QUEUED ──claim──▶ PROCESSING ──▶ SUCCESS
+#                         │
+#                         └─ error ──▶ RETRY (next_attempt_at = now + backoff) ──claim──▶ ...
+#                                        └─ attempts exhausted ──▶ FAILED
+#
+# Visibility timeout: a worker refreshes locked_at while it works (heartbeat).
+# If a worker dies mid-job, its lock goes stale after INGEST_VISIBILITY_TIMEOUT
+# seconds and the job becomes claimable again — a deploy no longer kills a
+# half-finished book for good. Every claim counts as an attempt, so a job
+# that keeps killing its worker (e.g. out of memory) is marked FAILED once
+# INGEST_MAX_ATTEMPTS is spent instead of being reclaimed forever.
+#
+# Fencing: a worker whose lock went stale may still be running when another
+# worker reclaims the job. fence_session() makes every commit of the
+# pipeline's session first row-lock the job and check it is still ours;
+# otherwise the commit fails with JobLockLost and the old worker stops
+# without writing over the new owner.
+#
+# Pausing: every claim first takes the Postgres advisory lock
+# INGEST_PAUSE_LOCK_KEY in SHARED mode. A maintenance command that must not
+# race ingestion (migrate_hybrid.py) holds it EXCLUSIVELY, so no job is
+# claimed meanwhile, and waits for the running jobs to finish.
+
+import os
+import random
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import or_, and_, event, func, text
+from sqlalchemy.orm import Session, undefer
+
+from models.db_models import IngestionJob, UploadRequest
+
+
+INGEST_MAX_ATTEMPTS = int(os.getenv("INGEST_MAX_ATTEMPTS", "3"))
+INGEST_RETRY_BASE_SECONDS = float(os.getenv("INGEST_RETRY_BASE_SECONDS", "30"))
+INGEST_RETRY_MAX_SECONDS = float(os.getenv("INGEST_RETRY_MAX_SECONDS", "900"))
+# A PROCESSING job whose lock is older than this is assumed abandoned.
+INGEST_VISIBILITY_TIMEOUT = int(os.getenv("INGEST_VISIBILITY_TIMEOUT", "600"))
+
+CLAIMABLE_STATUSES = ("QUEUED", "RETRY")
+
+# App-wide advisory lock id ("INGP"); see "Pausing" above
+INGEST_PAUSE_LOCK_KEY = 0x494E4750
+
+
+class JobLockLost(Exception):
+    """The job was reclaimed by another worker while this one was running it."""
+
+
+def _now() -> datetime:
+    # TIMESTAMP columns are naive; keep every comparison in naive UTC
+    return datetime.utcnow()
+
+
+def enqueue_ingestion_job(
+    db: Session,
+    request_id: int,
+    chapter_id: int,
+    file_bytes: bytes,
+    filename: str,
+    source_type: str = "nctb",
+) -> IngestionJob:
+    """Adds a QUEUED job carrying everything a worker needs to run it.
+    The caller owns the transaction (flush/commit)."""
+    job = IngestionJob(
+        request_id=request_id,
+        job_status="QUEUED",
+        chunk_count=0,
+        chapter_id=chapter_id,
+        source_type=source_type,
+        file_name=filename,
+        file_size=len(file_bytes),
+        file_data=file_bytes,
+        attempts=0,
+        next_attempt_at=None,
+    )
+    db.add(job)
+    db.flush()
+    return job
+
+
+def _mark_abandoned(db: Session, job: IngestionJob) -> None:
+    """A stale PROCESSING job with no attempts left: its worker died on every
+    attempt, so it is FAILED instead of being claimed again."""
+    job.job_status = "FAILED"
+    job.error_message = (f"Worker '{job.locked_by}' stopped responding on attempt "
+                         f"{job.attempts}/{INGEST_MAX_ATTEMPTS} — giving up.")
+    job.locked_by = None
+    job.locked_at = None
+    job.next_attempt_at = None
+    upload_request = db.query(UploadRequest).filter(
+        UploadRequest.request_id == job.request_id
+    ).first()
+    if upload_request:
+        upload_request.status = "failed"
+    print(f"[Queue] Job {job.job_id} abandoned after {job.attempts} attempt(s) — FAILED.")
+
+
+def claim_next_job(db: Session, worker_id: str) -> Optional[IngestionJob]:
+    """Locks and claims the oldest runnable job, or returns None.
+    Runnable = QUEUED/RETRY and due, or PROCESSING with a stale lock
+    (stale jobs without attempts left are marked FAILED on the way).
+    Returns None while ingestion is paused."""
+    if ingestion_paused(db):
+        db.rollback()
+        return None
+    while True:
+        now = _now()
+        stale_before = now - timedelta(seconds=INGEST_VISIBILITY_TIMEOUT)
+
+        job = (
+            db.query(IngestionJob)
+            .options(undefer(IngestionJob.file_data))
+            .filter(or_(
+                and_(
+                    IngestionJob.job_status.in_(CLAIMABLE_STATUSES),
+                    or_(IngestionJob.next_attempt_at.is_(None), IngestionJob.next_attempt_at <= now),
+                ),
+                and_(
+                    IngestionJob.job_status == "PROCESSING",
+                    IngestionJob.locked_at.isnot(None),
+                    IngestionJob.locked_at < stale_before,
+                ),
+            ))
+            .filter(IngestionJob.file_data.isnot(None))
+            .order_by(IngestionJob.job_id)
+            .with_for_update(skip_locked=True)
+            .limit(1)
+            .first()
+        )
+        if job is None:
+            db.rollback()
+            return None
+
+        if job.job_status == "PROCESSING":
+            if (job.attempts or 0) >= INGEST_MAX_ATTEMPTS:
+                _mark_abandoned(db, job)
+                db.commit()
+                continue
+            print(f"[Queue] Job {job.job_id} lock from '{job.locked_by}' expired — reclaiming.")
+
+        job.job_status = "PROCESSING"
+        job.locked_by = worker_id
+        job.locked_at = now
+        job.attempts = (job.attempts or 0) + 1
+        job.error_message = None
+        db.commit()
+        return job
+
+
+def ingestion_paused(db: Session) -> bool:
+    """Takes the pause lock in shared mode for the current transaction; True
+    if a maintenance command holds it exclusively. Postgres only."""
+    if db.get_bind().dialect.name != "postgresql":
+        return False
+    return not db.execute(
+        text("SELECT pg_try_advisory_xact_lock_shared(:key)"), {"key": INGEST_PAUSE_LOCK_KEY}
+    ).scalar()
+
+
+def pause_ingestion(conn) -> bool:
+    """Takes the pause lock exclusively on `conn` (a dedicated connection; the
+    lock lasts until resume_ingestion or the connection closes). False if
+    another maintenance command already holds it."""
+    return bool(conn.execute(
+        text("SELECT pg_try_advisory_lock(:key)"), {"key": INGEST_PAUSE_LOCK_KEY}
+    ).scalar())
+
+
+def resume_ingestion(conn) -> None:
+    conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": INGEST_PAUSE_LOCK_KEY})
+
+
+def active_job_count(db: Session) -> int:
+    """PROCESSING jobs whose lock is still fresh (a worker is running them)."""
+    stale_before = _now() - timedelta(seconds=INGEST_VISIBILITY_TIMEOUT)
+    return (
+        db.query(func.count(IngestionJob.job_id))
+        .filter(IngestionJob.job_status == "PROCESSING", IngestionJob.locked_at >= stale_before)
+        .scalar()
+    )
+
+
+def heartbeat(db: Session, job_id: int, worker_id: str) -> bool:
+    """Extends the visibility timeout. Returns False if the job is no longer ours."""
+    updated = (
+        db.query(IngestionJob)
+        .filter(IngestionJob.job_id == job_id, IngestionJob.locked_by == worker_id)
+        .update({IngestionJob.locked_at: _now()}, synchronize_session=False)
+    )
+    db.commit()
+    return updated == 1
+
+
+def assert_job_owner(db: Session, job_id: int, worker_id: str) -> None:
+    """Row-locks the job inside the current transaction and raises JobLockLost
+    unless `worker_id` still holds it. The lock lasts until the commit, so no
+    other worker can reclaim the job in between."""
+    owner = (
+        db.query(IngestionJob.locked_by)
+        .filter(IngestionJob.job_id == job_id)
+        .with_for_update()
+        .scalar()
+    )
+    if owner != worker_id:
+        raise JobLockLost(f"Job {job_id} is now held by '{owner}', not '{worker_id}'.")
+
+
+def fence_session(db: Session, job_id: int, worker_id: str) -> None:
+    """Checks ownership of the job before every commit of `db`."""
+    @event.listens_for(db, "before_commit")
+    def _check_owner(session):
+        assert_job_owner(session, job_id, worker_id)
+
+
+def retry_delay_seconds(attempts: int) -> float:
+    """Exponential backoff with jitter: base, 2x base, 4x base ... capped."""
+    delay = INGEST_RETRY_BASE_SECONDS * (2 ** max(0, attempts - 1))
+    return min(INGEST_RETRY_MAX_SECONDS, delay) + random.uniform(0, INGEST_RETRY_BASE_SECONDS / 2)
+
+
+def complete_job(db: Session, job_id: int, worker_id: str) -> None:
+    """Releases the lock and drops the stored upload once the job succeeded."""
+    db.query(IngestionJob).filter(
+        IngestionJob.job_id == job_id, IngestionJob.locked_by == worker_id
+    ).update({
+        IngestionJob.locked_by: None,
+        IngestionJob.locked_at: None,
+        IngestionJob.next_attempt_at: None,
+        IngestionJob.file_data: None,
+    }, synchronize_session=False)
+    db.commit()
+
+
+def fail_job(db: Session, job_id: int, error: str, worker_id: str) -> str:
+    """Schedules a retry, or marks the job FAILED once attempts are exhausted.
+    Returns the new job_status (untouched if another worker holds the job)."""
+    job = db.query(IngestionJob).filter(IngestionJob.job_id == job_id).with_for_update().first()
+    if job is None:
+        return "MISSING"
+    if job.locked_by != worker_id:
+        owner, status = job.locked_by, job.job_status
+        db.rollback()
+        print(f"[Queue] Job {job_id} is held by '{owner}' — not recording this worker's failure.")
+        return status
+
+    job.error_message = error
+    job.locked_by = None
+    job.locked_at = None
+
+    if (job.attempts or 0) < INGEST_MAX_ATTEMPTS:
+        delay = retry_delay_seconds(job.attempts or 1)
+        job.job_status = "RETRY"
+        job.next_attempt_at = _now() + timedelta(seconds=delay)
+        print(f"[Queue] Job {job_id} attempt {job.attempts}/{INGEST_MAX_ATTEMPTS} failed — "
+              f"retrying in {delay:.0f}s.")
+    else:
+        job.job_status = "FAILED"
+        job.next_attempt_at = None
+        upload_request = db.query(UploadRequest).filter(
+            UploadRequest.request_id == job.request_id
+        ).first()
+        if upload_request:
+            upload_request.status = "failed"
+        print(f"[Queue] Job {job_id} FAILED after {job.attempts} attempt(s).")
+
+    db.commit()
+    return job.job_status
+
+
+def requeue_job(db: Session, job_id: int) -> IngestionJob:
+    """Puts a FAILED/RETRY job back on the queue immediately, with a fresh
+    attempt budget. Raises ValueError if the job can't be retried.
+    Stages checkpointed by earlier attempts are reused by the pipeline."""
+    job = db.query(IngestionJob).filter(IngestionJob.job_id == job_id).first()
+    if job is None:
+        raise LookupError(f"No ingestion job found with ID {job_id}.")
+    if job.job_status not in ("FAILED", "RETRY"):
+        raise ValueError(f"Job {job_id} is {job.job_status} — only FAILED or RETRY jobs can be retried.")
+    has_file = db.query(IngestionJob.job_id).filter(
+        IngestionJob.job_id == job_id, IngestionJob.file_data.isnot(None)
+    ).first() is not None
+    if not has_file:
+        raise ValueError(f"Job {job_id} has no stored upload to resume from — upload the file again.")
+
+    job.job_status = "QUEUED"
+    job.attempts = 0
+    job.next_attempt_at = None
+    job.locked_by = None
+    job.locked_at = None
+    upload_request = db.query(UploadRequest).filter(
+        UploadRequest.request_id == job.request_id
+    ).first()
+    if upload_request:
+        upload_request.status = "pending"
+    db.commit()
+    print(f"[Queue] Job {job_id} re-queued.")
+    return job
+
+
+def queue_stats(db: Session) -> dict:
+    """Job counts per status, for the status endpoints."""
+    rows = (
+        db.query(IngestionJob.job_status, func.count(IngestionJob.job_id))
+        .group_by(IngestionJob.job_status)
+        .all()
+    )
+    return {status or "UNKNOWN": count for status, count in rows}
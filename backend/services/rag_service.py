@@ -29,15 +29,34 @@ from schemas.user import UserCreate
 # for delete specific pdf from qdrant................................................
 from qdrant_client.models import Filter, FieldCondition, MatchValue, FilterSelector
 # from sqlalchemy.orm import Session
-from models.db_models import ContentEmbedding, UploadMetadata, IngestionJob, UploadRequest
+from models.db_models import ContentEmbedding, UploadMetadata, IngestionJob, UploadRequest, IngestionCheckpoint
+# Content-addressed cache shared by ingestion and retrieval embeddings
+from services.embedding_cache import embedding_cache, normalize_text, EMBEDDING_CACHE_ENABLED
+from services.hybrid_search import (
+    HYBRID_SEARCH, SPARSE_VECTOR_NAME, SPARSE_VECTORS_CONFIG, collection_available, hybrid_enabled,
+    migration_pending,
+)
+from services.retrieval_cache import bump_chapter_versions
+from services.job_queue import ingestion_paused
 # --- INITIALIZATION ---
 def init_vector_db():
     """Ensures the Qdrant collection exists on startup."""
-    if not qdrant_client.collection_exists(COLLECTION_NAME):
+    if migration_pending():
+        # Never create an empty collection under the name a migration is about to alias
+        print(f"'{COLLECTION_NAME}' is being migrated (or the migration stopped) — "
+              f"run `python migrate_hybrid.py` to finish it.")
+    elif not collection_available():
         qdrant_client.create_collection(
             collection_name=COLLECTION_NAME,
             vectors_config=VectorParams(size=3072, distance=Distance.COSINE),
+            sparse_vectors_config=SPARSE_VECTORS_CONFIG,
         )
+    elif HYBRID_SEARCH and not hybrid_enabled(refresh=True):
+        # Older collection without the BM25 sparse vector: Qdrant cannot add one
+        # in place. Migrating copies every point, so it is a one-off command that
+        # pauses ingestion (migrate_hybrid.py), not something every start runs.
+        print(f"'{COLLECTION_NAME}' has no sparse vector '{SPARSE_VECTOR_NAME}' — retrieval stays "
+              f"dense-only until `python migrate_hybrid.py` is run.")
 # --- NEW: Create a payload index for 'filename' ---
     try:
         qdrant_client.create_payload_index(
@@ -71,6 +90,17 @@ def init_vector_db():
     except Exception as e:
         pass
 
+    # Topic(s) each chunk was assigned to at ingestion (services/topic_assignment.py)
+    try:
+        qdrant_client.create_payload_index(
+            collection_name=COLLECTION_NAME,
+            field_name="topic_ids",
+            field_schema=PayloadSchemaType.INTEGER,
+        )
+        print("Ensured payload index exists for 'topic_ids'.")
+    except Exception as e:
+        pass
+
 # # --- AI & RAG LOGIC ---
 # def get_embedding(text: str, is_query: bool = False):
 #     """Generates embeddings with retry logic. Handles Query vs Document tasks."""
@@ -99,12 +129,33 @@ def get_embedding(text: str, is_query: bool = False):
     is_query=False → optimized for storing documents
     """
 
-    # Clean the text by removing newlines which can confuse the embedding model
-    clean_text = text.replace("\n", " ")
-
     # Choose the task type based on whether this is a query or a document
     task_type = "RETRIEVAL_QUERY" if is_query else "RETRIEVAL_DOCUMENT"
 
+    # Identical text was embedded before (re-upload, repeated topic query) —
+    # reuse the stored vector instead of another Gemini round-trip
+    if EMBEDDING_CACHE_ENABLED:
+        cached = embedding_cache.get(EMBEDDING_MODEL, task_type, text)
+        if cached is not None:
+            return cached
+
+    vector = embed_text_uncached(text, is_query=is_query)
+    if EMBEDDING_CACHE_ENABLED:
+        embedding_cache.put(EMBEDDING_MODEL, task_type, text, vector)
+    return vector
+
+
+def embed_text_uncached(text: str, is_query: bool = False):
+    """
+    One embed_content call for one text, bypassing the embedding cache — for
+    callers that do their own cache lookups and writes (embed_texts' per-chunk
+    fallback). The text is embedded exactly as the cache key normalizes it.
+    """
+    # Collapse whitespace (newlines confuse the embedding model) — the same
+    # normalization the cache key uses (services/embedding_cache.py)
+    clean_text = normalize_text(text)
+    task_type = "RETRIEVAL_QUERY" if is_query else "RETRIEVAL_DOCUMENT"
+
     while True:
         try:
             # Use the new SDK's embed_content method via the gemini_client
@@ -355,6 +406,13 @@ def delete_file_from_system(filename: str, db: Session):
     Deletes all vector embeddings for a specific file from Qdrant,
     and removes all related tracking records from PostgreSQL in the correct constraint order.
     """
+    # Holds the ingestion pause lock (shared) until the commit below, so a
+    # running collection migration (migrate_hybrid.py) never misses this delete
+    if ingestion_paused(db):
+        db.rollback()
+        return {"status": "paused",
+                "message": "The vector collection is being migrated — try deleting again in a few minutes."}
+
     try:
         # --- 1. DELETE FROM QDRANT ---
         print(f"Deleting '{filename}' from Qdrant...")
@@ -376,28 +434,43 @@ def delete_file_from_system(filename: str, db: Session):
         # --- 2. DELETE FROM POSTGRESQL ---
         print(f"Cleaning up '{filename}' metadata from PostgreSQL...")
         
-        # We start by finding the metadata to get the exact job_id
-        metadata_record = db.query(UploadMetadata).filter(UploadMetadata.file_name == filename).first()
+        # We start by finding the metadata to get the exact job_id(s). A file
+        # re-uploaded under the same name has one record per upload job (the
+        # latest job owns the live rows, see services/incremental_ingest.py).
+        metadata_records = db.query(UploadMetadata).filter(UploadMetadata.file_name == filename).all()
         
-        if metadata_record:
-            job_id = metadata_record.job_id
+        if metadata_records:
+            for metadata_record in metadata_records:
+                job_id = metadata_record.job_id
             
-            # Fetch the job to figure out the original request_id
-            job_record = db.query(IngestionJob).filter(IngestionJob.job_id == job_id).first()
-            request_id = job_record.request_id if job_record else None
+                # Fetch the job to figure out the original request_id
+                job_record = db.query(IngestionJob).filter(IngestionJob.job_id == job_id).first()
+                request_id = job_record.request_id if job_record else None
             
-            # A. Delete Content Embeddings (Child of IngestionJob)
-            db.query(ContentEmbedding).filter(ContentEmbedding.job_id == job_id).delete()
+                # Chapters whose chunks are removed — their cached contexts become stale
+                affected_chapters = {
+                    c for (c,) in db.query(ContentEmbedding.chapter_id)
+                    .filter(ContentEmbedding.job_id == job_id).distinct().all()
+                }
+                if job_record:
+                    affected_chapters.add(job_record.chapter_id)
+                bump_chapter_versions(db, list(affected_chapters))
+
+                # A. Delete Content Embeddings (Child of IngestionJob)
+                db.query(ContentEmbedding).filter(ContentEmbedding.job_id == job_id).delete()
             
-            # B. Delete Upload Metadata (Child of IngestionJob)
-            db.query(UploadMetadata).filter(UploadMetadata.job_id == job_id).delete()
+                # B. Delete Upload Metadata (Child of IngestionJob)
+                db.query(UploadMetadata).filter(UploadMetadata.job_id == job_id).delete()
             
-            # C. Delete Ingestion Job (Child of UploadRequest)
-            db.query(IngestionJob).filter(IngestionJob.job_id == job_id).delete()
+                # C. Delete resume checkpoints (Child of IngestionJob)
+                db.query(IngestionCheckpoint).filter(IngestionCheckpoint.job_id == job_id).delete()
+
+                # D. Delete Ingestion Job (Child of UploadRequest)
+                db.query(IngestionJob).filter(IngestionJob.job_id == job_id).delete()
             
-            # D. Delete Upload Request (Parent Record)
-            if request_id:
-                db.query(UploadRequest).filter(UploadRequest.request_id == request_id).delete()
+                # E. Delete Upload Request (Parent Record)
+                if request_id:
+                    db.query(UploadRequest).filter(UploadRequest.request_id == request_id).delete()
                 
             db.commit()
             print("PostgreSQL cleanup complete.")
@@ -406,6 +479,22 @@ def delete_file_from_system(filename: str, db: Session):
             # Fallback: If metadata didn't save due to a crash, clean up any orphaned UploadRequest
             orphaned_request = db.query(UploadRequest).filter(UploadRequest.file_name == filename).first()
             if orphaned_request:
+                # A queued/failed job never wrote UploadMetadata — remove it with its request
+                orphan_job_ids = [
+                    j for (j,) in db.query(IngestionJob.job_id)
+                    .filter(IngestionJob.request_id == orphaned_request.request_id).all()
+                ]
+                if orphan_job_ids:
+                    bump_chapter_versions(db, [
+                        c for (c,) in db.query(IngestionJob.chapter_id)
+                        .filter(IngestionJob.job_id.in_(orphan_job_ids)).all()
+                    ])
+                    db.query(IngestionCheckpoint).filter(
+                        IngestionCheckpoint.job_id.in_(orphan_job_ids)
+                    ).delete(synchronize_session=False)
+                    db.query(IngestionJob).filter(
+                        IngestionJob.job_id.in_(orphan_job_ids)
+                    ).delete(synchronize_session=False)
                 db.query(UploadRequest).filter(UploadRequest.request_id == orphaned_request.request_id).delete()
                 db.commit()
                 print("Cleaned up orphaned UploadRequest.")
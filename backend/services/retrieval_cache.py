@@ -0,0 +1,166 @@
+# retrieval_cache.py - Cache of formatted retrieval contexts, per chapter version.
+#
+# search_curriculum_context() ran again for every worksheet, study note and
+# /generate/refine call on the same topic — an embedding (when no stored
+# vector) plus a Qdrant search — although a chapter's chunks only change when
+# a file is ingested or deleted. The formatted context string is now cached
+# under
+#   (scope, chapter id(s), chapter content_version(s), sha256(query + limits))
+#
+# Chapter.content_version is bumped by run_ingestion_pipeline() and
+# delete_file_from_system(). A bump changes every key of that chapter, so
+# stale contexts are never read again and simply age out of the backend —
+# there is nothing to purge, and web and worker processes agree through the
+# database. A lookup costs one primary-key read of the version(s).
+#
+# RETRIEVAL_CACHE_BACKEND: "memory" (default), "sqlite", "redis" or "none".
+
+import os
+import json
+import hashlib
+import threading
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy.orm import Session
+
+from core.cache_backends import make_cache_backend
+from core.config import CACHE_DIR, SessionLocal
+from models.db_models import Chapter
+
+
+RETRIEVAL_CACHE_BACKEND = os.getenv("RETRIEVAL_CACHE_BACKEND", "memory").strip().lower()
+RETRIEVAL_CACHE_TTL_SECONDS = float(os.getenv("RETRIEVAL_CACHE_TTL_SECONDS", str(24 * 3600)))
+RETRIEVAL_CACHE_MAX_ENTRIES = int(os.getenv("RETRIEVAL_CACHE_MAX_ENTRIES", "2000"))
+RETRIEVAL_CACHE_REDIS_URL = os.getenv("RETRIEVAL_CACHE_REDIS_URL", "redis://localhost:6379/0")
+
+
+# ── CHAPTER VERSIONS ──────────────────────────────────────────────────────────
+
+def chapter_versions(chapter_ids: List[int]) -> Dict[int, int]:
+    """{chapter_id: content_version} in one query (unknown chapters → 0)."""
+    ids = [c for c in chapter_ids if c is not None]
+    if not ids:
+        return {}
+    db = SessionLocal()
+    try:
+        rows = db.query(Chapter.chapter_id, Chapter.content_version).filter(
+            Chapter.chapter_id.in_(ids)
+        ).all()
+    finally:
+        db.close()
+    versions = {chapter_id: version or 0 for chapter_id, version in rows}
+    return {c: versions.get(c, 0) for c in ids}
+
+
+def bump_chapter_versions(db: Session, chapter_ids: List[int]) -> None:
+    """Invalidates every cached context of these chapters. The caller commits."""
+    ids = sorted({c for c in chapter_ids if c is not None})
+    if not ids:
+        return
+    db.query(Chapter).filter(Chapter.chapter_id.in_(ids)).update(
+        {Chapter.content_version: Chapter.content_version + 1},
+        synchronize_session=False,
+    )
+    print(f"[Retrieval Cache] Bumped content version of chapter(s) {ids}")
+
+
+# ── CACHE ─────────────────────────────────────────────────────────────────────
+
+class RetrievalCache:
+    """Context-string cache with hit/miss metrics. Never raises: a broken
+    backend only means retrieval runs uncached."""
+
+    def __init__(self, backend, ttl_seconds: Optional[float]):
+        self.backend = backend
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def _count(self, field: str) -> None:
+        with self._lock:
+            setattr(self, field, getattr(self, field) + 1)
+
+    def get_or_compute(self, scope: str, chapter_ids: List[int], params: dict,
+                       compute: Callable[[], str],
+                       should_store: Callable[[str], bool] = bool) -> str:
+        """Returns the cached context for (scope, chapters at their current
+        versions, params), or runs `compute` and stores its result when
+        `should_store(result)` — e.g. not after a failed embedding call."""
+        try:
+            versions = chapter_versions(chapter_ids)
+        except Exception as e:
+            self._count("errors")
+            print(f"[Retrieval Cache] Version lookup failed, retrieving uncached — {e}")
+            return compute()
+
+        digest = hashlib.sha256(
+            json.dumps(params, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8")
+        ).hexdigest()
+        version_part = ",".join(f"{c}@{v}" for c, v in sorted(versions.items()))
+        key = f"{scope}|{version_part}|{digest}"
+
+        try:
+            cached = self.backend.get(key)
+        except Exception as e:
+            self._count("errors")
+            print(f"[Retrieval Cache] Read failed — {e}")
+            cached = None
+        if cached is not None:
+            self._count("hits")
+            print(f"[Retrieval Cache] HIT {scope} ({version_part})")
+            return cached
+
+        self._count("misses")
+        context = compute()
+        if not should_store(context):
+            return context
+        try:
+            self.backend.set(key, context, ttl=self.ttl_seconds)
+        except Exception as e:
+            self._count("errors")
+            print(f"[Retrieval Cache] Write failed — {e}")
+        return context
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            metrics = {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "errors": self.errors,
+                "ttl_seconds": self.ttl_seconds,
+            }
+        try:
+            metrics.update(self.backend.stats())
+        except Exception as e:
+            metrics["backend_error"] = str(e)
+        return metrics
+
+
+class _NoRetrievalCache(RetrievalCache):
+    def __init__(self):
+        super().__init__(backend=None, ttl_seconds=None)
+
+    def get_or_compute(self, scope, chapter_ids, params, compute, should_store=bool):
+        return compute()
+
+    def stats(self) -> dict:
+        return {"enabled": False}
+
+
+if RETRIEVAL_CACHE_BACKEND == "none":
+    retrieval_cache = _NoRetrievalCache()
+else:
+    retrieval_cache = RetrievalCache(
+        make_cache_backend(
+            RETRIEVAL_CACHE_BACKEND,
+            sqlite_path=os.path.join(CACHE_DIR, "retrieval.sqlite3"),
+            table="retrieval_cache",
+            max_entries=RETRIEVAL_CACHE_MAX_ENTRIES,
+            redis_url=RETRIEVAL_CACHE_REDIS_URL,
+        ),
+        ttl_seconds=RETRIEVAL_CACHE_TTL_SECONDS,
+    )
@@ -0,0 +1,164 @@
+# topic_assignment.py - Assigns chunks to topics once, at ingestion time.
+#
+# Chapter- and subject-scope quizzes used to rebuild topic buckets on EVERY
+# request: one embedding call plus one Qdrant search per topic (10-60 round
+# trips for a subject). Each chunk is now tagged during ingestion with the
+# topic(s) it belongs to, by cosine similarity between the chunk's document
+# vector and each topic's description (query) vector:
+#
+#   topic_ids     [int]             best topic, plus any other topic within
+#                                   TOPIC_ASSIGN_MARGIN of the best score
+#   topic_scores  {"<topic_id>": s} similarity per assigned topic
+#
+# topic_ids has an INTEGER payload index, so retrieval can simply scroll or
+# filter a chapter's points by topic with no embedding call at all
+# (generation_service._fetch_chunks_for_chapter_bulk).
+#
+# Points stored without topic_ids (ingested before this change, or while the
+# chapter had no topics) are assigned on first retrieval by
+# backfill_chapter_assignments(), so topic-filtered retrieval never silently
+# skips them. Once a chapter is backfilled this costs one empty scroll.
+
+import os
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from qdrant_client.http.models import (
+    FieldCondition, Filter, IsEmptyCondition, MatchValue, PayloadField, SetPayload, SetPayloadOperation,
+)
+
+from core.config import qdrant_client, COLLECTION_NAME
+from services.embedding_service import embed_texts
+
+
+# A chunk also joins a second topic when it scores within this margin of its best
+TOPIC_ASSIGN_MARGIN = float(os.getenv("TOPIC_ASSIGN_MARGIN", "0.03"))
+# ...but never when that score is below this floor
+TOPIC_ASSIGN_MIN_SCORE = float(os.getenv("TOPIC_ASSIGN_MIN_SCORE", "0.35"))
+TOPIC_ASSIGN_MAX_TOPICS = 3
+
+RETRIEVE_BATCH_SIZE = 256
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def topic_query_vectors(topics: List[Dict], stored: Dict[int, List[float]] = None) -> Tuple[List[int], Optional[np.ndarray]]:
+    """Each topic's description (or name) as a retrieval query vector — the
+    same vector retrieval uses for that topic. Vectors already stored on the
+    topic row are reused; only the rest are embedded. Returns (topic_ids, matrix)."""
+    stored = stored or {}
+    missing = [t for t in topics if t["topic_id"] not in stored]
+    fresh = embed_texts([t.get("description") or t["name"] for t in missing], is_query=True)
+    fresh_by_id = {t["topic_id"]: v for t, v in zip(missing, fresh)}
+    vectors = [stored.get(t["topic_id"]) or fresh_by_id.get(t["topic_id"]) for t in topics]
+    ids = [t["topic_id"] for t, v in zip(topics, vectors) if v is not None]
+    rows = [v for v in vectors if v is not None]
+    if not rows:
+        return [], None
+    return ids, _normalize_rows(np.asarray(rows, dtype=np.float32))
+
+
+def assign_topics(vectors: List[Optional[List[float]]], topic_ids: List[int],
+                  topic_matrix: Optional[np.ndarray]) -> List[Dict]:
+    """One {"topic_ids": [...], "topic_scores": {...}} payload per vector
+    (empty dict where the vector is missing or there are no topics)."""
+    if topic_matrix is None or not topic_ids:
+        return [{} for _ in vectors]
+
+    present = [i for i, v in enumerate(vectors) if v is not None]
+    assignments = [{} for _ in vectors]
+    if not present:
+        return assignments
+
+    chunk_matrix = _normalize_rows(np.asarray([vectors[i] for i in present], dtype=np.float32))
+    scores = chunk_matrix @ topic_matrix.T          # (chunks, topics) cosine similarities
+
+    for row, i in enumerate(present):
+        order = np.argsort(-scores[row])
+        best = float(scores[row, order[0]])
+        chosen = [order[0]] + [
+            j for j in order[1:TOPIC_ASSIGN_MAX_TOPICS]
+            if scores[row, j] >= best - TOPIC_ASSIGN_MARGIN and scores[row, j] >= TOPIC_ASSIGN_MIN_SCORE
+        ]
+        assignments[i] = {
+            "topic_ids": [int(topic_ids[j]) for j in chosen],
+            "topic_scores": {str(topic_ids[j]): round(float(scores[row, j]), 4) for j in chosen},
+        }
+    return assignments
+
+
+def stored_vectors(point_ids: List[str]) -> Dict[str, List[float]]:
+    """Fetches stored vectors for points that were not re-embedded (kept
+    chunks), so they can be re-assigned when the chapter's topics change."""
+    vectors = {}
+    for start in range(0, len(point_ids), RETRIEVE_BATCH_SIZE):
+        records = qdrant_client.retrieve(
+            collection_name=COLLECTION_NAME,
+            ids=point_ids[start:start + RETRIEVE_BATCH_SIZE],
+            with_payload=False,
+            with_vectors=True,
+        )
+        for record in records:
+            vector = _dense_vector(record.vector)
+            if vector is not None:
+                vectors[str(record.id)] = vector
+    return vectors
+
+
+def _dense_vector(vector):
+    if isinstance(vector, dict):
+        # Named vectors: the unnamed dense one, never the BM25 sparse vector
+        return vector.get("") or next((v for v in vector.values() if isinstance(v, list)), None)
+    return vector
+
+
+def backfill_chapter_assignments(chapter_id: int, topics: List[Dict]) -> int:
+    """Assigns topics to the chapter's points that have no topic_ids yet.
+    topics: [{"topic_id", "name", "description", "vector" (stored or None)}].
+    Returns how many points are STILL unassigned (0 unless the topics could
+    not be embedded), so the caller can fall back to semantic search."""
+    unassigned = Filter(must=[
+        FieldCondition(key="chapter_id", match=MatchValue(value=chapter_id)),
+        IsEmptyCondition(is_empty=PayloadField(key="topic_ids")),
+    ])
+    point_ids, vectors = [], []
+    offset = None
+    while True:
+        records, offset = qdrant_client.scroll(
+            collection_name=COLLECTION_NAME,
+            scroll_filter=unassigned,
+            with_payload=False,
+            with_vectors=True,
+            limit=RETRIEVE_BATCH_SIZE,
+            offset=offset,
+        )
+        for record in records:
+            point_ids.append(record.id)
+            vectors.append(_dense_vector(record.vector))
+        if offset is None:
+            break
+    if not point_ids:
+        return 0
+
+    topic_ids, topic_matrix = topic_query_vectors(
+        topics, {t["topic_id"]: t["vector"] for t in topics if t.get("vector") is not None}
+    )
+    assignments = assign_topics(vectors, topic_ids, topic_matrix)
+    operations = [
+        SetPayloadOperation(set_payload=SetPayload(payload=assignment, points=[point_id]))
+        for point_id, assignment in zip(point_ids, assignments)
+        if assignment
+    ]
+    for start in range(0, len(operations), RETRIEVE_BATCH_SIZE):
+        qdrant_client.batch_update_points(
+            collection_name=COLLECTION_NAME,
+            update_operations=operations[start:start + RETRIEVE_BATCH_SIZE],
+        )
+    print(f"[Topic Assignment] Backfilled topics for {len(operations)}/{len(point_ids)} "
+          f"unassigned point(s) of chapter {chapter_id}")
+    return len(point_ids) - len(operations)
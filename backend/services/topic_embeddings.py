@@ -0,0 +1,61 @@
+# topic_embeddings.py - Stored query embeddings for topic descriptions.
+#
+# Every worksheet, study note and quiz used to re-embed Topic.description
+# through Gemini before searching Qdrant, although descriptions only change
+# when a chapter is ingested. extract_topics_from_text() now embeds each
+# description once (as a retrieval QUERY — the same task type retrieval uses)
+# and stores it on the topic row as float32 bytes, tagged with the embedding
+# model. Retrieval reads the stored vector and only falls back to the API for
+# topics that have none yet (or were embedded with a different model).
+
+from typing import Dict, List, Optional
+
+from sqlalchemy.orm import Session, undefer
+
+from core.config import EMBEDDING_MODEL
+from models.db_models import Topic
+from services.content_embeddings import vector_to_blob, blob_to_array
+from services.embedding_service import embed_texts
+
+
+def store_topic_embeddings(db: Session, topics: List[Topic]) -> int:
+    """Embeds and stores the description of each topic row (one batched call).
+    The caller commits. Returns how many topics got a vector."""
+    if not topics:
+        return 0
+    texts = [t.description or t.name for t in topics]
+    vectors = embed_texts(texts, is_query=True)
+    stored = 0
+    for topic, vector in zip(topics, vectors):
+        if vector is None:
+            continue
+        topic.description_embedding = vector_to_blob(vector)
+        topic.description_embedding_model = EMBEDDING_MODEL
+        stored += 1
+    print(f"[Topic Embeddings] Stored {stored}/{len(topics)} description vector(s).")
+    return stored
+
+
+def stored_topic_vector(topic: Topic) -> Optional[List[float]]:
+    """The topic's stored query vector, or None if missing or from another model."""
+    if topic.description_embedding is None or topic.description_embedding_model != EMBEDDING_MODEL:
+        return None
+    return blob_to_array(topic.description_embedding).tolist()
+
+
+def load_topic_vectors(db: Session, topic_ids: List[int]) -> Dict[int, List[float]]:
+    """{topic_id: vector} for the topics that have a usable stored vector."""
+    if not topic_ids:
+        return {}
+    rows = (
+        db.query(Topic)
+        .options(undefer(Topic.description_embedding))
+        .filter(Topic.topic_id.in_(topic_ids))
+        .all()
+    )
+    vectors = {}
+    for row in rows:
+        vector = stored_topic_vector(row)
+        if vector is not None:
+            vectors[row.topic_id] = vector
+    return vectors
@@ -0,0 +1,89 @@
+# vector_upload.py - Streaming, batched Qdrant upserts for ingestion.
+#
+# STEP 6 used to build one list with every 3072-dim point of a book and send it
+# in a single upsert. Big books hit the request-size limit and the client's 30s
+# timeout, and every PointStruct sat in memory at once. upsert_points_streaming()
+# instead consumes points lazily from an iterator and:
+#   - sends bounded batches (QDRANT_UPSERT_BATCH_SIZE points each),
+#   - keeps up to QDRANT_UPSERT_PARALLEL batches in flight,
+#   - retries each failed batch on its own with backoff,
+#   - sends intermediate batches with wait=False (Qdrant acknowledges once the
+#     batch is in its write-ahead log) and the LAST batch with wait=True once
+#     all others were acknowledged — a barrier that guarantees the whole job
+#     is searchable when the function returns.
+# Only QDRANT_UPSERT_PARALLEL + 1 batches exist in memory at any time.
+
+import os
+import time
+import random
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from itertools import islice
+from typing import Iterable, List
+
+from qdrant_client.http.models import PointStruct
+
+from core.config import qdrant_client, COLLECTION_NAME
+
+
+QDRANT_UPSERT_BATCH_SIZE = int(os.getenv("QDRANT_UPSERT_BATCH_SIZE", "128"))
+QDRANT_UPSERT_PARALLEL = int(os.getenv("QDRANT_UPSERT_PARALLEL", "4"))
+QDRANT_UPSERT_MAX_ATTEMPTS = int(os.getenv("QDRANT_UPSERT_MAX_ATTEMPTS", "4"))
+
+
+def _upsert_batch(points: List[PointStruct], wait_for_apply: bool, label: str) -> int:
+    for attempt in range(1, QDRANT_UPSERT_MAX_ATTEMPTS + 1):
+        try:
+            qdrant_client.upsert(
+                collection_name=COLLECTION_NAME,
+                points=points,
+                wait=wait_for_apply,
+            )
+            return len(points)
+        except Exception as e:
+            if attempt == QDRANT_UPSERT_MAX_ATTEMPTS:
+                raise
+            delay = 2 ** attempt + random.uniform(0, 1)
+            print(f"  [{label}] Qdrant batch of {len(points)} failed ({e}) — "
+                  f"retry {attempt}/{QDRANT_UPSERT_MAX_ATTEMPTS - 1} in {delay:.1f}s")
+            time.sleep(delay)
+
+
+def _batches(points: Iterable[PointStruct], size: int):
+    iterator = iter(points)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def upsert_points_streaming(points: Iterable[PointStruct], label: str = "Qdrant") -> int:
+    """Upserts points in parallel batches. Returns the number of points sent.
+    Raises if any batch still fails after its retries."""
+    started = time.time()
+    total = 0
+    batches = _batches(points, QDRANT_UPSERT_BATCH_SIZE)
+
+    # Hold one batch back: it becomes the final wait=True barrier
+    pending_batch = next(batches, None)
+    if pending_batch is None:
+        return 0
+
+    with ThreadPoolExecutor(max_workers=QDRANT_UPSERT_PARALLEL) as executor:
+        in_flight = set()
+        for batch in batches:
+            if len(in_flight) >= QDRANT_UPSERT_PARALLEL:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                total += sum(f.result() for f in done)
+            in_flight.add(executor.submit(_upsert_batch, pending_batch, False, label))
+            pending_batch = batch
+        for future in in_flight:
+            total += future.result()
+
+    # Every earlier batch is acknowledged — waiting on the last one means all are applied
+    total += _upsert_batch(pending_batch, True, label)
+
+    elapsed = max(time.time() - started, 1e-6)
+    print(f"[{label}] Upserted {total} point(s) in {elapsed:.1f}s "
+          f"({total / elapsed:.0f} points/s).")
+    return total
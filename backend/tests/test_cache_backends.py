@@ -0,0 +1,20 @@
+# test_cache_backends.py - Size bounds and expiry of the memory and SQLite
+# cache backends.
+
+from core.cache_backends import MemoryCacheBackend, SQLiteCacheBackend
+
+
+def test_sqlite_cache_stays_near_a_small_max_entries(tmp_path):
+    cache = SQLiteCacheBackend(str(tmp_path / "cache.db"), table="llm_cache", max_entries=5)
+    for i in range(40):
+        cache.set(f"k{i}", "v")
+        assert cache.stats()["entries"] <= 2 * cache.max_entries
+    assert cache.get("k39") == "v"
+    assert cache.get("k0") is None
+
+
+def test_expired_entries_are_not_returned(tmp_path):
+    for cache in (MemoryCacheBackend(max_entries=10),
+                  SQLiteCacheBackend(str(tmp_path / "cache.db"), table="llm_cache")):
+        cache.set("k", "v", ttl=-1)
+        assert cache.get("k") is None
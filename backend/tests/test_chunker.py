@@ -0,0 +1,69 @@
+# test_chunker.py - Content hashes, token estimates and the structure-aware
+# page chunker.
+
+from utils.chunker import chunk_page_structured, chunk_pages_by_chapter, content_hash, estimate_tokens
+
+
+def _sentences(n, word="fraction"):
+    return " ".join(f"Sentence {i} is about the {word} topic here." for i in range(n))
+
+
+def test_content_hash_ignores_whitespace_only_changes():
+    assert content_hash("A  fraction\nhas two parts.") == content_hash(" A fraction has two parts. ")
+    assert content_hash("A fraction has two parts.") != content_hash("A fraction has three parts.")
+
+
+def test_estimate_tokens_charges_bengali_more_per_char():
+    assert estimate_tokens("abcd") == 1.0
+    assert estimate_tokens("অআইঈ") == 1.6
+    assert estimate_tokens("") == 0
+
+
+def test_short_page_is_one_chunk():
+    assert chunk_page_structured("One short sentence. Another one.") == ["One short sentence. Another one."]
+    assert chunk_page_structured("  \n\n ") == []
+
+
+def test_chunks_stay_within_the_budget_and_cover_the_page():
+    text = _sentences(60)
+    chunks = chunk_page_structured(text, max_tokens=60, overlap_tokens=15, min_tokens=10)
+    assert len(chunks) > 1
+    assert all(estimate_tokens(c) <= 60 for c in chunks)
+    for i in range(60):
+        assert any(f"Sentence {i} " in c for c in chunks)
+
+
+def test_neighbouring_chunks_overlap_by_whole_sentences():
+    chunks = chunk_page_structured(_sentences(30), max_tokens=60, overlap_tokens=15, min_tokens=10)
+    last_sentence = chunks[0].rsplit("Sentence ", 1)[1]
+    assert chunks[1].startswith("Sentence " + last_sentence)
+
+
+def test_tables_and_figures_are_never_split():
+    table = "| a | b |\n|---|---|\n| 1 | 2 |\n| 3 | 4 |\n"
+    figure = "[Figure: a number line from 0 to 1\nmarked in quarters]\n"
+    text = _sentences(6) + "\n" + table + figure + _sentences(6, word="decimal")
+    chunks = chunk_page_structured(text, max_tokens=60, overlap_tokens=0, min_tokens=10)
+    assert any(table.strip() in c for c in chunks)
+    assert any(figure.strip() in c for c in chunks)
+
+
+def test_chunk_does_not_end_on_a_heading():
+    text = _sentences(8) + "\n## Decimals\n" + _sentences(8, word="decimal")
+    chunks = chunk_page_structured(text, max_tokens=60, overlap_tokens=0, min_tokens=10)
+    assert not any(c.endswith("## Decimals") for c in chunks)
+    assert any(c.startswith("## Decimals") for c in chunks)
+
+
+def test_bengali_sentences_split_on_the_dari():
+    text = " ".join(["ভগ্নাংশ একটি সংখ্যা।"] * 40)
+    chunks = chunk_page_structured(text, max_tokens=40, overlap_tokens=0, min_tokens=5)
+    assert len(chunks) > 1
+    assert all(c.endswith("।") for c in chunks)
+
+
+def test_pages_keep_their_page_numbers_and_hashes():
+    pages = [{"page_num": 3, "text": _sentences(2)}, {"page_num": 4, "text": _sentences(2, word="decimal")}]
+    chunks = chunk_pages_by_chapter(pages)
+    assert [(c["chunk_index"], c["page_num"]) for c in chunks] == [(0, 3), (1, 4)]
+    assert all(c["content_hash"] == content_hash(c["text"]) for c in chunks)
@@ -0,0 +1,58 @@
+# test_context_packer.py - Budgeting, de-duplication, MMR ordering and
+# overlap merging of retrieved chunks.
+
+from utils.chunker import estimate_tokens
+from utils.context_packer import mmr_order, overlap_length, pack_context, tokens_for_chars
+
+
+def _chunk(text, index=None, score=1.0, filename="ch1.pdf", page=1):
+    return {"text": text, "filename": filename, "page": page, "chunk_index": index, "score": score}
+
+
+def test_char_cap_budget_follows_the_script_of_the_candidates():
+    english = [_chunk("a" * 1200)]
+    bengali = [_chunk("অ" * 1200)]
+    assert tokens_for_chars(1200, english) == estimate_tokens("a" * 1200)
+    assert tokens_for_chars(1200, bengali) == estimate_tokens("অ" * 1200)
+    assert tokens_for_chars(1200, []) == 300
+
+
+def test_bengali_chunk_fits_a_cap_of_its_own_length():
+    chunks = [_chunk("অ" * 1200, index=0)]
+    assert len(pack_context(chunks, tokens_for_chars(1200, chunks))) == 1
+
+
+def test_best_chunk_is_kept_when_nothing_fits():
+    chunks = [_chunk("x" * 4000, index=0, score=0.9), _chunk("y" * 4000, index=5, score=0.2)]
+    passages = pack_context(chunks, max_tokens=10)
+    assert [p["text"][0] for p in passages] == ["x"]
+
+
+def test_exact_duplicates_are_dropped():
+    chunks = [_chunk("Fractions  are parts of a whole.", index=0),
+              _chunk("Fractions are parts of a whole.", index=9)]
+    assert len(pack_context(chunks, max_tokens=1000)) == 1
+
+
+def test_overlap_length_finds_the_shared_sentence():
+    shared = "A fraction has a numerator and a denominator. "
+    assert overlap_length("Intro text. " + shared, shared + "Next part.") == len(shared)
+    assert overlap_length("Nothing in common here at all.", "Completely different sentence.") == 0
+
+
+def test_neighbours_merge_with_the_overlap_stripped():
+    shared = "A fraction has a numerator and a denominator. "
+    chunks = [_chunk("Intro text. " + shared, index=3, page=4),
+              _chunk(shared + "The denominator counts equal parts.", index=4, page=5)]
+    passages = pack_context(chunks, max_tokens=1000, lambda_=1.0)
+    assert len(passages) == 1
+    assert passages[0]["text"].count("numerator") == 1
+    assert passages[0]["page"] == "4-5" and passages[0]["merged_chunks"] == 2
+
+
+def test_mmr_prefers_a_different_chunk_over_a_near_duplicate():
+    chunks = [_chunk("carry the ten when adding two digit numbers", score=1.0),
+              _chunk("carry the ten when adding two digit numbers again", score=0.95),
+              _chunk("subtraction borrows from the tens column", score=0.9)]
+    order = mmr_order(chunks, lambda_=0.5)
+    assert order[:2] == [0, 2]
@@ -0,0 +1,55 @@
+# test_embedding_cache.py - Cache keys match what is embedded, and the
+# per-chunk fallback of a failed batch neither double-counts nor double-writes.
+
+from types import SimpleNamespace
+
+import pytest
+
+from services import embedding_service, rag_service
+from services.embedding_cache import EmbeddingCache, make_cache_key
+
+
+class _Gemini:
+    """embed_content stub: fails every multi-text batch, embeds single texts."""
+
+    def __init__(self):
+        self.sent = []
+        self.models = self
+
+    def embed_content(self, model, contents, config):
+        if isinstance(contents, list) and len(contents) > 1:
+            raise RuntimeError("500 internal error")
+        texts = contents if isinstance(contents, list) else [contents]
+        self.sent.extend(texts)
+        return SimpleNamespace(embeddings=[SimpleNamespace(values=[float(len(t)), 1.0]) for t in texts])
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    cache = EmbeddingCache(str(tmp_path / "embeddings.sqlite3"), max_entries=100, memory_entries=10)
+    gemini = _Gemini()
+    for module in (embedding_service, rag_service):
+        monkeypatch.setattr(module, "embedding_cache", cache)
+        monkeypatch.setattr(module, "EMBEDDING_CACHE_ENABLED", True)
+        monkeypatch.setattr(module, "gemini_client", gemini)
+    cache.gemini = gemini
+    return cache
+
+
+def test_texts_sharing_a_key_are_embedded_identically(cache):
+    assert make_cache_key("m", "t", "a \n\t b") == make_cache_key("m", "t", "a b")
+    rag_service.get_embedding("two\n\nwords  here")
+    assert cache.gemini.sent == ["two words here"]
+    assert rag_service.get_embedding("two words here") == [14.0, 1.0]
+    assert cache.gemini.sent == ["two words here"]
+
+
+def test_failed_batch_falls_back_without_double_counting(cache):
+    vectors = embedding_service.embed_texts(["first chunk", "second\nchunk"])
+    assert vectors == [[11.0, 1.0], [12.0, 1.0]]
+    assert cache.gemini.sent == ["first chunk", "second chunk"]
+    stats = cache.stats()
+    assert (stats["misses"], stats["hits"], stats["stored_entries"]) == (2, 0, 2)
+
+    assert embedding_service.embed_texts(["first chunk", "second chunk"]) == vectors
+    assert cache.stats()["hits"] == 2
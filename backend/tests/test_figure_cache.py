@@ -0,0 +1,68 @@
+# test_figure_cache.py - Figure descriptions are reused only for the exact same
+# image in the same page context.
+
+import base64
+import io
+
+import pytest
+from PIL import Image, ImageDraw
+
+from utils import figure_cache
+from utils.figure_cache import FigureDescriptionCache, cached_describe, figure_key
+
+
+def _png(draw=None, size=(200, 60)) -> str:
+    img = Image.new("RGB", size, "white")
+    if draw:
+        draw(ImageDraw.Draw(img))
+    buffer = io.BytesIO()
+    img.save(buffer, format="PNG")
+    return base64.b64encode(buffer.getvalue()).decode()
+
+
+BLANK = _png()
+NUMBER_LINE = _png(lambda d: d.line([(10, 30), (190, 30)], fill="black", width=2))
+
+
+@pytest.fixture
+def described(tmp_path, monkeypatch):
+    monkeypatch.setattr(figure_cache, "figure_cache", FigureDescriptionCache(str(tmp_path / "f.sqlite3"), 100))
+    monkeypatch.setattr(figure_cache, "FIGURE_CACHE_ENABLED", True)
+    calls = []
+
+    def describe(img_b64, text, context="page 1"):
+        def _call():
+            calls.append(text)
+            return text
+        return cached_describe(img_b64, _call, context=context)
+
+    describe.calls = calls
+    return describe
+
+
+def test_sparse_figures_never_share_a_description(described):
+    assert described(BLANK, "SKIP") == ("SKIP", False)
+    assert described(NUMBER_LINE, "A number line") == ("A number line", False)
+    assert described.calls == ["SKIP", "A number line"]
+
+
+def test_the_same_figure_in_the_same_context_is_reused(described):
+    described(NUMBER_LINE, "A number line")
+    assert described("data:image/png;base64," + NUMBER_LINE, "other") == ("A number line", True)
+    assert described.calls == ["A number line"]
+
+
+def test_another_page_context_is_described_again(described):
+    described(NUMBER_LINE, "Distances in km", context="Rahim walks to school")
+    assert described(NUMBER_LINE, "Fractions of one", context="Mark 3/4 on the line") == ("Fractions of one", False)
+
+
+def test_key_includes_the_image_dimensions():
+    assert figure_key(_png(size=(10, 20))).split("|")[1] == "10x20"
+    assert figure_key(_png(size=(10, 20))) != figure_key(_png(size=(20, 10)))
+
+
+def test_undecodable_image_skips_the_cache(described):
+    assert figure_key("bm90IGFuIGltYWdl") is None
+    described("bm90IGFuIGltYWdl", "first")
+    assert described("bm90IGFuIGltYWdl", "second") == ("second", False)
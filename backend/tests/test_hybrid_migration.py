@@ -0,0 +1,102 @@
+# test_hybrid_migration.py - Moving a dense-only collection behind an alias
+# to one with the BM25 sparse vector, the per-chapter sparse check that gates
+# the smaller hybrid context, and startup leaving the migration to
+# migrate_hybrid.py (in-memory Qdrant, 4-dim vectors).
+
+import pytest
+from qdrant_client import QdrantClient
+from qdrant_client.http.models import Distance, PointStruct, VectorParams
+
+from services import hybrid_search
+
+
+COLLECTION = "hybrid_migration_test"
+
+
+@pytest.fixture
+def qdrant(monkeypatch):
+    client = QdrantClient(location=":memory:")
+    monkeypatch.setattr(hybrid_search, "qdrant_client", client)
+    monkeypatch.setattr(hybrid_search, "COLLECTION_NAME", COLLECTION)
+    monkeypatch.setattr(hybrid_search, "HYBRID_SEARCH", True)
+    monkeypatch.setattr(hybrid_search, "_collection_has_sparse", None)
+    return client
+
+
+def _dense_collection(client, name=COLLECTION):
+    client.create_collection(name, vectors_config=VectorParams(size=4, distance=Distance.COSINE))
+    client.upsert(name, points=[
+        PointStruct(id=i, vector=[1.0, float(i), 0.0, 0.0],
+                    payload={"chapter_id": 7, "text": f"fraction number {i}"})
+        for i in range(1, 6)
+    ])
+
+
+def test_dense_collection_is_migrated_behind_an_alias(qdrant):
+    _dense_collection(qdrant)
+    assert not hybrid_search.hybrid_enabled(refresh=True)
+
+    assert hybrid_search.migrate_to_hybrid_collection(batch_size=2)
+    assert hybrid_search._aliased_collection(COLLECTION) == f"{COLLECTION}_hybrid"
+    assert hybrid_search.collection_available()
+    assert qdrant.count(COLLECTION, exact=True).count == 5
+    point = qdrant.retrieve(COLLECTION, ids=[3], with_vectors=True)[0]
+    assert point.payload["text"] == "fraction number 3"
+    assert point.vector[hybrid_search.SPARSE_VECTOR_NAME].indices
+    assert hybrid_search.chapter_has_sparse(7)
+
+
+def test_migration_of_an_aliased_collection_moves_the_alias(qdrant):
+    _dense_collection(qdrant, "legacy")
+    hybrid_search.qdrant_client.update_collection_aliases(change_aliases_operations=[
+        hybrid_search.CreateAliasOperation(create_alias=hybrid_search.CreateAlias(
+            collection_name="legacy", alias_name=COLLECTION))
+    ])
+    assert hybrid_search.migrate_to_hybrid_collection()
+    assert hybrid_search._aliased_collection(COLLECTION) == "legacy_hybrid"
+    assert not qdrant.collection_exists("legacy")
+
+
+def test_interrupted_migration_is_resumed(qdrant):
+    qdrant.create_collection(f"{COLLECTION}_hybrid", vectors_config=VectorParams(size=4, distance=Distance.COSINE))
+    assert not hybrid_search.collection_available()
+    assert hybrid_search.resume_hybrid_migration()
+    assert hybrid_search.collection_available()
+
+
+def test_chapter_with_dense_only_points_keeps_the_large_context(qdrant):
+    qdrant.create_collection(
+        COLLECTION,
+        vectors_config=VectorParams(size=4, distance=Distance.COSINE),
+        sparse_vectors_config=hybrid_search.SPARSE_VECTORS_CONFIG,
+    )
+    qdrant.upsert(COLLECTION, points=[
+        PointStruct(id=1, vector={"": [1.0, 0.0, 0.0, 0.0],
+                                  hybrid_search.SPARSE_VECTOR_NAME: hybrid_search.document_sparse_vector("halves")},
+                    payload={"chapter_id": 7}),
+        PointStruct(id=2, vector={"": [0.0, 1.0, 0.0, 0.0]}, payload={"chapter_id": 8}),
+    ])
+    assert hybrid_search.chapter_has_sparse(7)
+    assert not hybrid_search.chapter_has_sparse(8)
+
+
+def test_startup_leaves_a_pending_migration_to_the_command(qdrant, monkeypatch):
+    from services import rag_service
+    monkeypatch.setattr(rag_service, "qdrant_client", qdrant)
+    monkeypatch.setattr(rag_service, "COLLECTION_NAME", COLLECTION)
+    qdrant.create_collection(f"{COLLECTION}_hybrid", vectors_config=VectorParams(size=4, distance=Distance.COSINE))
+
+    rag_service.init_vector_db()
+    assert not qdrant.collection_exists(COLLECTION)
+    assert hybrid_search.migration_pending()
+
+
+def test_startup_does_not_migrate_a_dense_collection(qdrant, monkeypatch):
+    from services import rag_service
+    monkeypatch.setattr(rag_service, "qdrant_client", qdrant)
+    monkeypatch.setattr(rag_service, "COLLECTION_NAME", COLLECTION)
+    _dense_collection(qdrant)
+
+    rag_service.init_vector_db()
+    assert not qdrant.collection_exists(f"{COLLECTION}_hybrid")
+    assert not hybrid_search.hybrid_enabled(refresh=True)
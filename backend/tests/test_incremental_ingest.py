@@ -0,0 +1,101 @@
+# test_incremental_ingest.py - Chunk diff, diff scope and SQL row bookkeeping
+# of incremental re-ingestion (SQL on an in-memory SQLite database).
+
+import json
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from models.db_models import ContentEmbedding
+from services import incremental_ingest
+from services.incremental_ingest import (
+    adopt_kept_rows, clear_job_rows, delete_vanished, diff_chunks, new_point_id,
+)
+
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://")
+    ContentEmbedding.__table__.create(engine)
+    session = sessionmaker(bind=engine)()
+    yield session
+    session.close()
+
+
+@pytest.fixture
+def deleted_points(monkeypatch):
+    deleted = []
+
+    class _Qdrant:
+        def delete(self, collection_name, points_selector):
+            deleted.extend(points_selector.points)
+
+    monkeypatch.setattr(incremental_ingest, "qdrant_client", _Qdrant())
+    return deleted
+
+
+def _row(db, point_id, job_id, legacy=False):
+    db.add(ContentEmbedding(
+        chapter_id=7,
+        job_id=job_id,
+        qdrant_point_id=None if legacy else point_id,
+        embedding_metadata=json.dumps({"qdrant_point_id": point_id}),
+    ))
+    db.commit()
+
+
+def _jobs(db):
+    return {json.loads(r.embedding_metadata)["qdrant_point_id"]: r.job_id
+            for r in db.query(ContentEmbedding).all()}
+
+
+def test_diff_chunks_is_a_multiset_match():
+    chunks = [{"content_hash": "a"}, {"content_hash": "a"}, {"content_hash": "b"}]
+    new, kept, vanished = diff_chunks(chunks, {"a": ["p1"], "c": ["p3"]})
+    assert new == [{"content_hash": "a"}, {"content_hash": "b"}]
+    assert kept == [({"content_hash": "a"}, "p1")]
+    assert vanished == ["p3"]
+
+
+def test_new_point_id_is_deterministic_and_unique():
+    chunk = {"content_hash": "abc"}
+    taken = set()
+    first, second = new_point_id("f.pdf", chunk, taken), new_point_id("f.pdf", chunk, taken)
+    assert first != second
+    assert new_point_id("f.pdf", chunk, set()) == first
+
+
+def test_scope_is_limited_to_the_same_file():
+    fields = {c.key: c.match.value for c in incremental_ingest._scope_filter(7, "ch3.pdf", "nctb").must}
+    assert fields == {"chapter_id": 7, "source_type": "nctb", "filename": "ch3.pdf"}
+
+
+def test_delete_vanished_removes_new_and_legacy_rows(db, deleted_points):
+    _row(db, "p1", job_id=1)
+    _row(db, "p2", job_id=1, legacy=True)
+    _row(db, "p3", job_id=1)
+    delete_vanished(db, 7, ["p1", "p2"])
+    db.commit()
+    assert deleted_points == ["p1", "p2"]
+    assert _jobs(db) == {"p3": 1}
+
+
+def test_adopt_kept_rows_moves_rows_to_the_new_job(db):
+    _row(db, "p1", job_id=1)
+    _row(db, "p2", job_id=1, legacy=True)
+    _row(db, "p3", job_id=1)
+    adopt_kept_rows(db, 7, ["p1", "p2"], job_id=2)
+    db.commit()
+    assert _jobs(db) == {"p1": 2, "p2": 2, "p3": 1}
+    legacy = db.query(ContentEmbedding).filter(ContentEmbedding.job_id == 2).all()
+    assert sorted(r.qdrant_point_id for r in legacy) == ["p1", "p2"]
+
+
+def test_clear_job_rows_keeps_adopted_rows(db):
+    _row(db, "kept", job_id=2)
+    _row(db, "written-by-earlier-attempt", job_id=2)
+    _row(db, "other-job", job_id=1)
+    clear_job_rows(db, 2, ["kept"])
+    db.commit()
+    assert _jobs(db) == {"kept": 2, "other-job": 1}
@@ -0,0 +1,71 @@
+# test_job_queue.py - Claiming, attempt limits and fencing of the ingestion
+# queue on an in-memory SQLite database (FOR UPDATE is a no-op there).
+
+from datetime import timedelta
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from models.db_models import IngestionJob, UploadRequest
+from services import job_queue
+from services.job_queue import JobLockLost
+
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://")
+    UploadRequest.__table__.create(engine)
+    IngestionJob.__table__.create(engine)
+    session = sessionmaker(bind=engine)()
+    yield session
+    session.close()
+
+
+def _stale_job(db, attempts):
+    request = UploadRequest(file_name="ch1.pdf", status="pending")
+    db.add(request)
+    db.flush()
+    job = IngestionJob(
+        request_id=request.request_id, job_status="PROCESSING", file_name="ch1.pdf",
+        file_data=b"%PDF", attempts=attempts, locked_by="dead-worker",
+        locked_at=job_queue._now() - timedelta(seconds=job_queue.INGEST_VISIBILITY_TIMEOUT + 60),
+    )
+    db.add(job)
+    db.commit()
+    return job.job_id, request.request_id
+
+
+def test_stale_job_with_attempts_left_is_reclaimed(db):
+    job_id, _ = _stale_job(db, attempts=1)
+    job = job_queue.claim_next_job(db, "worker-b")
+    assert job.job_id == job_id
+    assert (job.locked_by, job.attempts) == ("worker-b", 2)
+
+
+def test_stale_job_without_attempts_left_fails(db):
+    job_id, request_id = _stale_job(db, attempts=job_queue.INGEST_MAX_ATTEMPTS)
+    assert job_queue.claim_next_job(db, "worker-b") is None
+    job = db.get(IngestionJob, job_id)
+    assert job.job_status == "FAILED" and job.locked_by is None
+    assert db.get(UploadRequest, request_id).status == "failed"
+
+
+def test_fenced_session_cannot_commit_after_reclaim(db):
+    job_id, _ = _stale_job(db, attempts=1)
+    job_queue.claim_next_job(db, "worker-b")
+
+    job_queue.fence_session(db, job_id, "dead-worker")
+    db.get(IngestionJob, job_id).chunk_count = 99
+    with pytest.raises(JobLockLost):
+        db.commit()
+    db.rollback()
+    assert db.get(IngestionJob, job_id).chunk_count != 99
+
+
+def test_fail_job_ignores_a_worker_that_lost_the_lock(db):
+    job_id, _ = _stale_job(db, attempts=1)
+    job_queue.claim_next_job(db, "worker-b")
+    assert job_queue.fail_job(db, job_id, "boom", "dead-worker") == "PROCESSING"
+    assert db.get(IngestionJob, job_id).locked_by == "worker-b"
+    assert job_queue.fail_job(db, job_id, "boom", "worker-b") == "RETRY"
@@ -0,0 +1,91 @@
+# test_retrieval_cache.py - Keys of the retrieval-context cache, invalidation
+# by chapter content_version, and skipping failed contexts (memory backend,
+# SQLite session).
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from core.cache_backends import MemoryCacheBackend
+from models.db_models import Chapter
+from services import retrieval_cache
+from services.generation_service import NO_CONTENT_PREFIX, _cacheable
+from services.retrieval_cache import RetrievalCache, bump_chapter_versions
+
+
+@pytest.fixture
+def session_factory(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path / 'retrieval.db'}")
+    Chapter.__table__.create(engine)
+    factory = sessionmaker(bind=engine)
+    db = factory()
+    db.add_all([Chapter(chapter_id=7, name="Fractions"), Chapter(chapter_id=8, name="Decimals")])
+    db.commit()
+    db.close()
+    monkeypatch.setattr(retrieval_cache, "SessionLocal", factory)
+    return factory
+
+
+@pytest.fixture
+def cache():
+    return RetrievalCache(MemoryCacheBackend(max_entries=100), ttl_seconds=None)
+
+
+def _counting(value):
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return value
+    return compute, calls
+
+
+def test_key_holds_scope_sorted_chapter_versions_and_params(session_factory, cache):
+    cache.get_or_compute("quiz-subject", [8, 7], {"b": 2, "a": 1}, lambda: "context")
+    (key,) = cache.backend._data
+    scope, versions, digest = key.split("|")
+    assert (scope, versions) == ("quiz-subject", "7@0,8@0")
+    assert len(digest) == 64
+
+    compute, calls = _counting("other")
+    assert cache.get_or_compute("quiz-subject", [7, 8], {"a": 1, "b": 2}, compute) == "context"
+    assert cache.get_or_compute("quiz-subject", [7, 8], {"a": 1, "b": 3}, compute) == "other"
+    assert cache.get_or_compute("topic", [7, 8], {"a": 1, "b": 2}, compute) == "other"
+    assert len(calls) == 2
+
+
+def test_bumping_a_chapter_invalidates_only_its_contexts(session_factory, cache):
+    compute, calls = _counting("context")
+    cache.get_or_compute("topic", [7], {"topic_id": 1}, compute)
+    cache.get_or_compute("topic", [8], {"topic_id": 2}, compute)
+
+    db = session_factory()
+    bump_chapter_versions(db, [7, None])
+    db.commit()
+    db.close()
+
+    cache.get_or_compute("topic", [7], {"topic_id": 1}, compute)
+    cache.get_or_compute("topic", [8], {"topic_id": 2}, compute)
+    assert len(calls) == 3
+    assert cache.stats()["hits"] == 1
+    assert retrieval_cache.chapter_versions([7, 8, 99]) == {7: 1, 8: 0, 99: 0}
+
+
+def test_failed_contexts_are_not_stored(session_factory, cache):
+    for failed in ("", f"{NO_CONTENT_PREFIX} for this topic."):
+        compute, calls = _counting(failed)
+        cache.get_or_compute("topic", [7], {"topic_id": 1}, compute, should_store=_cacheable)
+        cache.get_or_compute("topic", [7], {"topic_id": 1}, compute, should_store=_cacheable)
+        assert len(calls) == 2
+    assert cache.backend._data == {}
+    assert cache.stats()["misses"] == 4
+
+
+def test_version_lookup_failure_retrieves_uncached(cache, monkeypatch):
+    def _down():
+        raise RuntimeError("database down")
+
+    monkeypatch.setattr(retrieval_cache, "SessionLocal", _down)
+    assert cache.get_or_compute("topic", [7], {}, lambda: "context") == "context"
+    assert cache.stats()["errors"] == 1
+    assert cache.backend._data == {}
@@ -0,0 +1,23 @@
+# test_schema.py - Additive schema sync on a database created by an older
+# version of the models (in-memory SQLite).
+
+from sqlalchemy import create_engine, inspect, text
+
+from core.schema import ensure_added_columns
+from models.db_models import Base
+
+
+def test_added_columns_get_their_declared_indexes():
+    engine = create_engine("sqlite://")
+    # content_embedding as it was before content_hash / qdrant_point_id existed
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE content_embedding (embedding_id INTEGER PRIMARY KEY, chapter_id INTEGER)"
+        ))
+    added = ensure_added_columns(engine, Base.metadata)
+    assert {"content_embedding.content_hash", "content_embedding.qdrant_point_id"} <= set(added)
+    indexed = {tuple(ix["column_names"]) for ix in inspect(engine).get_indexes("content_embedding")}
+    assert {("content_hash",), ("qdrant_point_id",)} <= indexed
+
+    # Idempotent: a second start adds nothing
+    assert ensure_added_columns(engine, Base.metadata) == []
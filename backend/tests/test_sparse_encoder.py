@@ -0,0 +1,39 @@
+# test_sparse_encoder.py - Tokenization and BM25 sparse vectors.
+
+from utils.sparse_encoder import encode_document, encode_query, token_id, tokenize
+
+
+def test_tokenize_lowercases_words_and_adds_formula_tokens():
+    tokens = tokenize("Velocity: v = u + at")
+    assert tokens[:4] == ["velocity", "v", "u", "at"]
+    assert "v=u+at" in tokens
+
+
+def test_tokenize_keeps_bengali_combining_marks_inside_words():
+    assert tokenize("ভগ্নাংশের লব") == ["ভগ্নাংশের", "লব"]
+
+
+def test_token_id_is_stable_and_31_bit():
+    assert token_id("fraction") == token_id("fraction")
+    assert token_id("fraction") != token_id("decimal")
+    assert 0 <= token_id("ভগ্নাংশ") < 2 ** 31
+
+
+def test_document_weights_saturate_with_term_frequency():
+    indices, values = encode_document("half half half half quarter")
+    weights = dict(zip(indices, values))
+    half, quarter = weights[token_id("half")], weights[token_id("quarter")]
+    assert half > quarter
+    assert half < 4 * quarter
+    assert indices == sorted(indices)
+
+
+def test_query_weights_are_one_per_distinct_token():
+    indices, values = encode_query("half of a half")
+    assert sorted(indices) == sorted({token_id(t) for t in ("half", "of", "a")})
+    assert values == [1.0] * 3
+
+
+def test_empty_text_encodes_to_an_empty_vector():
+    assert encode_document("  ...  ") == ([], [])
+    assert encode_query("") == ([], [])
@@ -0,0 +1,60 @@
+# test_stage_graph.py - Dependency ordering, parallelism, timings and error
+# handling of run_stage_graph.
+
+import threading
+import time
+
+import pytest
+
+from utils.stage_graph import run_stage_graph
+
+
+def test_stages_receive_their_dependencies_results():
+    results, _ = run_stage_graph({
+        "a": (lambda: 2, []),
+        "b": (lambda a: a + 1, ["a"]),
+        "c": (lambda a, b: a * b, ["a", "b"]),
+    })
+    assert results == {"a": 2, "b": 3, "c": 6}
+
+
+def test_independent_stages_run_in_parallel():
+    both_running = threading.Barrier(2, timeout=5)
+    run_stage_graph({
+        "left": (lambda: both_running.wait(), []),
+        "right": (lambda: both_running.wait(), []),
+    })
+
+
+def test_timings_cover_every_stage_and_the_total():
+    _, timings = run_stage_graph({
+        "a": (lambda: time.sleep(0.02), []),
+        "b": (lambda a: None, ["a"]),
+    })
+    assert set(timings) == {"a", "b", "total"}
+    assert timings["a"]["duration_s"] >= 0.02
+    assert timings["b"]["start_s"] >= timings["a"]["end_s"]
+
+
+def test_unknown_dependency_is_rejected():
+    with pytest.raises(ValueError, match="unknown stage"):
+        run_stage_graph({"a": (lambda missing: None, ["missing"])})
+
+
+def test_cycle_is_rejected():
+    with pytest.raises(ValueError, match="cycle"):
+        run_stage_graph({"a": (lambda b: None, ["b"]), "b": (lambda a: None, ["a"])})
+
+
+def test_failure_stops_dependent_stages_and_is_reraised():
+    ran = []
+
+    def _fail():
+        raise RuntimeError("agent failed")
+
+    with pytest.raises(RuntimeError, match="agent failed"):
+        run_stage_graph({
+            "a": (_fail, []),
+            "b": (lambda a: ran.append("b"), ["a"]),
+        })
+    assert ran == []
@@ -0,0 +1,174 @@
+# test_svg_diagrams.py - Template diagram renderers, their model fallback,
+# how diagram_params travel through localization into the Visual Agent, and
+# the per-diagram validation and retries of its fan-out mode.
+
+import json
+import re
+from types import SimpleNamespace
+import xml.etree.ElementTree as ET
+
+import pytest
+
+from agents import visual_agent
+from agents.localization_agent import _carry_diagram_params
+from agents.visual_agent import svg_problem
+from utils.svg_diagrams import render_diagram
+
+
+EXAMPLES = {
+    "fraction_bar": {"fractions": [{"numerator": 2, "denominator": 8, "label": "Rahim"},
+                                   {"numerator": 3, "denominator": 8, "label": "Fatema"}]},
+    "number_line": {"start": 0, "end": 2, "step": "1/4",
+                    "marks": [{"value": "3/4", "label": "School"}, {"value": "1 1/2", "label": "Market"}]},
+    "bar_chart": {"categories": ["Mon", "Tue", "Wed"], "values": [4, 7, 2.5], "ylabel": "Mangoes"},
+    "area_model": {"fraction_a": {"numerator": 2, "denominator": 3},
+                   "fraction_b": {"numerator": 1, "denominator": 4}},
+    "pie_chart": {"slices": [{"value": 2, "label": "Rahim"}, {"value": 6, "label": "Left"}]},
+}
+
+
+def _texts(svg: str) -> list:
+    return [t.text for t in ET.fromstring(svg).iter("{http://www.w3.org/2000/svg}text")]
+
+
+@pytest.mark.parametrize("diagram_type", sorted(EXAMPLES))
+def test_templates_follow_the_svg_rules(diagram_type):
+    svg = render_diagram(diagram_type, dict(EXAMPLES[diagram_type], title="A & B <title>"))
+    assert svg_problem(svg) is None
+    root = ET.fromstring(svg)
+    _, _, width, height = (float(v) for v in root.attrib["viewBox"].split())
+    assert height / width <= 0.55
+    assert root.attrib["width"] == "100%" and "height" not in root.attrib
+    assert '"' not in svg
+    sizes = [int(s) for s in re.findall(r"font-size='(\d+)'", svg)]
+    assert sizes and min(sizes) >= 14
+    assert "A & B <title>" in _texts(svg)
+
+
+def test_bar_model_picks_the_renderer_from_the_params():
+    assert render_diagram("bar_model", EXAMPLES["fraction_bar"]) == render_diagram("fraction_bar", EXAMPLES["fraction_bar"])
+    assert render_diagram("bar_model", EXAMPLES["bar_chart"]) == render_diagram("bar_chart", EXAMPLES["bar_chart"])
+
+
+@pytest.mark.parametrize("diagram_type, params", [
+    ("shapes", {"sides": 4}),
+    ("number_line", None),
+    ("number_line", "same as original"),
+    ("number_line", {"start": "", "end": 10}),
+    ("number_line", {"start": 0, "end": 10, "marks": [{"value": ""}]}),
+    ("number_line", {"start": 0, "end": 1e309}),
+    ("number_line", {"start": 5, "end": 1}),
+    ("number_line", {"start": 0, "end": 10, "marks": [{"value": 12}]}),
+    ("fraction_bar", {"fractions": [{"numerator": 9, "denominator": 4}]}),
+    ("fraction_bar", {"fractions": {"numerator": 1}}),
+    ("bar_chart", {"categories": ["a", "b"], "values": [1]}),
+    ("bar_chart", {"categories": ["a"], "values": [1e309]}),
+    ("area_model", {"fraction_a": {"numerator": 1, "denominator": 0}, "fraction_b": {"numerator": 1, "denominator": 2}}),
+    ("pie_chart", {"slices": [{"value": 0}]}),
+])
+def test_unusable_params_fall_back_to_the_model(diagram_type, params):
+    assert render_diagram(diagram_type, params) is None
+
+
+def test_fraction_bar_hides_the_total():
+    texts = _texts(render_diagram("fraction_bar", EXAMPLES["fraction_bar"]))
+    assert "Total = ?" in texts
+    assert not any("5/8" in t for t in texts)
+
+
+def test_area_model_hides_the_product():
+    texts = _texts(render_diagram("area_model", EXAMPLES["area_model"]))
+    assert any(t.endswith("= ?") for t in texts)
+    assert not any("2/12" in t or "1/6" in t for t in texts)
+
+
+def test_localization_carries_diagram_params_by_id():
+    content = {"problems": [{"id": 1, "diagram_params": {"start": 0, "end": 5}},
+                            {"id": 2, "diagram_params": {"start": 0, "end": 9}},
+                            {"id": 3}]}
+    localized = {"localized_problems": [
+        {"id": 1},                                              # dropped by the model
+        {"id": 2, "diagram_params": "same as original"},        # placeholder echoed
+        {"id": 3, "diagram_params": {"start": 1, "end": 2}},    # model's own params stay
+    ]}
+    result = _carry_diagram_params(content, localized)["localized_problems"]
+    assert result[0]["diagram_params"] == {"start": 0, "end": 5}
+    assert result[1]["diagram_params"] == {"start": 0, "end": 9}
+    assert result[2]["diagram_params"] == {"start": 1, "end": 2}
+
+
+def test_visual_agent_sends_only_untemplated_problems_to_the_model(monkeypatch):
+    sent = []
+
+    def _model(problems, style_description, language):
+        sent.extend(p["id"] for p in problems)
+        return {"robot_mascot": "<svg/>", "problem_visuals": [
+            {"problem_id": p["id"], "svg_code": "<svg viewBox='0 0 1 1'/>", "description": ""} for p in problems
+        ]}
+
+    monkeypatch.setattr(visual_agent, "_run_visual_agent_model", _model)
+    result = visual_agent.run_visual_agent({"localized_problems": [
+        {"id": 1, "needs_diagram": True, "diagram_type": "shapes"},
+        {"id": 2, "needs_diagram": True, "diagram_type": "number_line",
+         "diagram_params": EXAMPLES["number_line"]},
+        {"id": 3, "needs_diagram": False},
+    ]})
+    assert sent == [1]
+    assert [v["problem_id"] for v in result["problem_visuals"]] == [1, 2]
+    assert result["robot_mascot"] == "<svg/>"
+
+
+VALID_SVG = "<svg xmlns='http://www.w3.org/2000/svg' viewBox='0 0 10 10'><rect width='5' height='5'/></svg>"
+
+
+@pytest.fixture
+def fanout(monkeypatch):
+    templates = {
+        "visual_svg_rules.txt": "rules",
+        "visual_diagram_prompt.txt": "diagram {problem_id} {problem_json} {style_description} {svg_rules}",
+        "visual_mascot_prompt.txt": "mascot {style_description} {svg_rules}",
+    }
+    monkeypatch.setattr(visual_agent, "load_prompt_template", templates.__getitem__)
+    monkeypatch.setattr(visual_agent, "VISUAL_FANOUT_MAX_ATTEMPTS", 2)
+    calls = []
+
+    def _generate(replies):
+        def _fake(model, contents, config, cache=None):
+            label = " ".join(contents.split()[:2]) if contents.startswith("diagram") else "mascot"
+            calls.append((label, cache))
+            reply = replies[label][sum(1 for c in calls if c[0] == label) - 1]
+            if isinstance(reply, Exception):
+                raise reply
+            return SimpleNamespace(text=json.dumps(reply))
+        monkeypatch.setattr(visual_agent, "generate_with_backoff", _fake)
+        return calls
+
+    return _generate
+
+
+def test_fanout_retries_only_the_invalid_diagram(fanout):
+    calls = fanout({
+        "diagram 1": [{"svg_code": "<svg>unclosed"}, {"svg_code": VALID_SVG, "description": "d1"}],
+        "diagram 2": [{"svg_code": VALID_SVG}],
+        "mascot": [{"robot_mascot": VALID_SVG}],
+    })
+    result = visual_agent._run_visual_agent_fanout([{"id": 1}, {"id": 2}], "style")
+    assert [v["problem_id"] for v in result["problem_visuals"]] == [1, 2]
+    assert result["problem_visuals"][0]["description"] == "d1"
+    assert result["robot_mascot"] == VALID_SVG
+    assert "failed_problem_ids" not in result
+    assert [c for c in calls if c[0] == "diagram 1"] == [("diagram 1", None), ("diagram 1", "refresh")]
+    assert [c for c in calls if c[0] == "diagram 2"] == [("diagram 2", None)]
+
+
+def test_fanout_request_errors_fail_only_their_own_diagram(fanout):
+    calls = fanout({
+        "diagram 1": [RuntimeError("500 INTERNAL"), RuntimeError("500 INTERNAL")],
+        "diagram 2": [{"svg_code": VALID_SVG}],
+        "mascot": [RuntimeError("503 UNAVAILABLE"), {"robot_mascot": VALID_SVG}],
+    })
+    result = visual_agent._run_visual_agent_fanout([{"id": 1}, {"id": 2}], "style")
+    assert [v["problem_id"] for v in result["problem_visuals"]] == [2]
+    assert result["failed_problem_ids"] == [1]
+    assert result["robot_mascot"] == VALID_SVG
+    assert len([c for c in calls if c[0] == "diagram 1"]) == 2
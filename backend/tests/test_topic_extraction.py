@@ -0,0 +1,59 @@
+# test_topic_extraction.py - Topic rows and their stored description vectors
+# when a chapter is re-ingested (in-memory SQLite, Gemini stubbed).
+
+import json
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from core.config import EMBEDDING_MODEL
+from models.db_models import Chapter, Topic
+from services import ingestion_service
+from services.content_embeddings import vector_to_blob
+from services.topic_embeddings import stored_topic_vector
+
+
+@pytest.fixture
+def db(monkeypatch):
+    engine = create_engine("sqlite://")
+    Chapter.__table__.create(engine)
+    Topic.__table__.create(engine)
+    session = sessionmaker(bind=engine)()
+    session.add(Chapter(chapter_id=7, name="Fractions"))
+    session.add(Topic(topic_id=1, chapter_id=7, name="Halves", description="old description",
+                      description_embedding=vector_to_blob([1.0, 0.0]),
+                      description_embedding_model=EMBEDDING_MODEL))
+    session.commit()
+
+    class _Response:
+        text = json.dumps(["Halves"])
+
+    monkeypatch.setattr(ingestion_service, "generate_with_backoff", lambda **kwargs: _Response())
+    yield session
+    session.close()
+
+
+def _reingest(db, monkeypatch, description, embed):
+    monkeypatch.setattr(ingestion_service, "generate_topic_descriptions",
+                        lambda names, chapter_name, text: {"Halves": description})
+    monkeypatch.setattr(ingestion_service, "store_topic_embeddings", embed)
+    ingestion_service.extract_topics_from_text("chapter text", 7, db)
+    db.expire_all()
+    return db.get(Topic, 1)
+
+
+def test_failed_re_embed_drops_the_stale_vector(db, monkeypatch):
+    def _fail(db, topics):
+        raise RuntimeError("embedding quota exhausted")
+
+    topic = _reingest(db, monkeypatch, "new description", _fail)
+    assert topic.description == "new description"
+    assert stored_topic_vector(topic) is None
+
+
+def test_unchanged_description_keeps_its_vector(db, monkeypatch):
+    embedded = []
+    topic = _reingest(db, monkeypatch, "old description", lambda db, topics: embedded.extend(topics))
+    assert embedded == []
+    assert stored_topic_vector(topic) == [1.0, 0.0]
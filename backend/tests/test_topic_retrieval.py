@@ -0,0 +1,125 @@
+# test_topic_retrieval.py - Per-topic chapter buckets from ingestion-time
+# topic assignments, with the backfill and semantic fallback for chunks and
+# topics the assignments do not cover (4-dim vectors in an in-memory Qdrant).
+
+import pytest
+from qdrant_client import QdrantClient
+from qdrant_client.http.models import Distance, PointStruct, VectorParams
+
+from services import generation_service, hybrid_search, topic_assignment
+
+
+COLLECTION = "topic_retrieval_test"
+
+FRACTIONS, DECIMALS, GEOMETRY = [1.0, 0.0, 0.0, 0.0], [0.0, 1.0, 0.0, 0.0], [0.0, 0.0, 1.0, 0.0]
+TOPICS = [
+    {"topic_id": 1, "name": "Fractions", "description": "", "vector": FRACTIONS},
+    {"topic_id": 2, "name": "Decimals", "description": "", "vector": DECIMALS},
+    {"topic_id": 3, "name": "Geometry", "description": "", "vector": GEOMETRY},
+]
+
+
+@pytest.fixture
+def qdrant(monkeypatch):
+    client = QdrantClient(location=":memory:")
+    client.create_collection(COLLECTION, vectors_config=VectorParams(size=4, distance=Distance.COSINE))
+    for module in (generation_service, topic_assignment):
+        monkeypatch.setattr(module, "qdrant_client", client)
+        monkeypatch.setattr(module, "COLLECTION_NAME", COLLECTION)
+    monkeypatch.setattr(hybrid_search, "_collection_has_sparse", False)
+    monkeypatch.setattr(generation_service, "_get_topics_for_chapters",
+                        lambda chapter_ids: {chapter_id: TOPICS for chapter_id in chapter_ids})
+    monkeypatch.setattr(generation_service, "embed_texts", lambda texts, is_query=False: [None for _ in texts])
+    return client
+
+
+def _point(client, point_id, vector, text, topic_id=None):
+    payload = {"chapter_id": 7, "text": text, "filename": "ch7.pdf", "page": 1, "chunk_index": point_id}
+    if topic_id is not None:
+        payload.update(topic_ids=[topic_id], topic_scores={str(topic_id): 0.9})
+    client.upsert(COLLECTION, points=[PointStruct(id=point_id, vector=vector, payload=payload)])
+
+
+def _texts(groups):
+    return {label: [c["text"] for c in chunks] for label, chunks in groups.items()}
+
+
+def test_unassigned_chunks_are_backfilled_before_the_payload_scroll(qdrant):
+    _point(qdrant, 1, FRACTIONS, "halves", topic_id=1)
+    _point(qdrant, 2, DECIMALS, "tenths")                   # stored before topics existed
+    _point(qdrant, 3, GEOMETRY, "triangles", topic_id=3)
+
+    groups = generation_service._fetch_chunks_for_chapter_bulk(7, "Numbers", per_topic_limit=5)
+    assert _texts(groups) == {"Fractions": ["halves"], "Decimals": ["tenths"], "Geometry": ["triangles"]}
+    backfilled = qdrant.retrieve(COLLECTION, ids=[2])[0].payload
+    assert backfilled["topic_ids"] == [2]
+
+
+def test_only_topics_without_chunks_use_semantic_search(qdrant, monkeypatch):
+    _point(qdrant, 1, FRACTIONS, "halves", topic_id=1)
+    _point(qdrant, 2, [0.0, 0.9, 0.1, 0.0], "tenths", topic_id=1)
+    searched = []
+    semantic = generation_service._semantic_groups_batched
+
+    def _spy(chapter_specs, per_topic_limit):
+        searched.extend(t["name"] for spec in chapter_specs for t in spec["topics"])
+        return semantic(chapter_specs, per_topic_limit)
+
+    monkeypatch.setattr(generation_service, "_semantic_groups_batched", _spy)
+    groups = generation_service._fetch_chunks_for_chapter_bulk(7, "Numbers", per_topic_limit=1)
+    assert searched == ["Decimals", "Geometry"]
+    assert list(groups) == ["Fractions", "Decimals", "Geometry"]
+    assert _texts(groups)["Fractions"] == ["halves"]
+    assert _texts(groups)["Decimals"] == ["tenths"]
+
+
+def test_failed_backfill_falls_back_to_semantic_search(qdrant, monkeypatch):
+    _point(qdrant, 1, FRACTIONS, "halves", topic_id=1)
+    _point(qdrant, 2, DECIMALS, "tenths")
+
+    def _fail(chapter_id, topics):
+        raise RuntimeError("qdrant down")
+
+    monkeypatch.setattr(generation_service, "backfill_chapter_assignments", _fail)
+    groups = generation_service._fetch_chunks_for_chapter_bulk(7, "Numbers", per_topic_limit=1)
+    assert _texts(groups)["Decimals"] == ["tenths"]
+
+
+def test_grouped_chapter_searches_only_topics_without_a_group(qdrant):
+    _point(qdrant, 1, FRACTIONS, "halves", topic_id=1)
+    _point(qdrant, 2, [0.0, 0.9, 0.1, 0.0], "tenths", topic_id=1)
+    _point(qdrant, 3, GEOMETRY, "triangles")                # backfilled into Geometry
+
+    groups = generation_service._fetch_chapter_groups_grouped(7, "Numbers", per_topic_limit=2)
+    assert sorted(_texts(groups)["Fractions"]) == ["halves", "tenths"]
+    assert _texts(groups)["Decimals"][0] == "tenths"                 # semantic fallback
+    assert _texts(groups)["Geometry"] == ["triangles"]
+
+
+def test_grouped_subject_queries_the_topic_centroid(qdrant, monkeypatch):
+    _point(qdrant, 1, FRACTIONS, "halves", topic_id=1)
+    monkeypatch.setattr(generation_service, "_get_topics_for_chapters",
+                        lambda chapter_ids: {7: TOPICS[:1], 8: TOPICS[1:2]})
+
+    def _no_embedding(text, is_query=False):
+        raise AssertionError("the subject name must not be embedded when topic vectors are stored")
+
+    monkeypatch.setattr(generation_service, "get_embedding", _no_embedding)
+    groups = generation_service._fetch_subject_groups_grouped(
+        "Maths", [{"chapter_id": 7, "name": "Numbers"}, {"chapter_id": 8, "name": "Measures"}], per_chapter_limit=2)
+    assert _texts(groups) == {"Numbers": ["halves"], "Measures": []}
+
+
+def test_topics_of_all_chapters_are_loaded_in_one_call(qdrant, monkeypatch):
+    loads = []
+
+    def _topics(chapter_ids):
+        loads.append(list(chapter_ids))
+        return {chapter_id: [] for chapter_id in chapter_ids}
+
+    monkeypatch.setattr(generation_service, "_get_topics_for_chapters", _topics)
+    monkeypatch.setattr(generation_service, "_semantic_groups_batched",
+                        lambda specs, limit: {spec["chapter_id"]: {} for spec in specs})
+    generation_service._fetch_chunks_for_chapters_bulk(
+        [{"chapter_id": 7, "name": "Numbers"}, {"chapter_id": 8, "name": "Measures"}], per_topic_limit=2)
+    assert loads == [[7, 8]]
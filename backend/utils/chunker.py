@@ -2,8 +2,20 @@
 # MODIFIED: Added chunk_pages_by_topic() which assigns each chunk to the most
 # relevant topic using simple keyword matching against Gemini-extracted topic names.
 
-from typing import List, Dict
+from typing import List, Dict, Tuple
+from bisect import bisect_right
+from itertools import accumulate
+import os
 import re
+import hashlib
+
+
+def content_hash(text: str) -> str:
+    """Stable identity for a chunk's text: SHA-256 of the whitespace-normalized
+    text. Used to skip re-embedding unchanged chunks when a file is re-uploaded."""
+    normalized = " ".join(text.split())
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
 
 def chunk_text(text: str, chunk_size: int = 800, overlap: int = 200) -> List[str]:
     """
@@ -81,26 +93,196 @@ def assign_topic_to_chunk(chunk_text: str, topics: List[dict]) -> dict:
     return best_topic
 
 
+# ── STRUCTURE-AWARE CHUNKER ───────────────────────────────────────────────────
+# chunk_text() cuts every N characters, so sentences, Bengali words, markdown
+# tables and [Figure: ...] blocks were split mid-way and the overlap was mostly
+# wasted. chunk_page_structured() instead:
+#   1. scans the page ONCE into atomic units — headings, whole tables, whole
+#      figure blocks, and sentences (ending in . ! ? or the Bengali dari '।');
+#   2. keeps a running token estimate per character, so the cost of any span
+#      is a subtraction of two prefix sums — no repeated string slicing;
+#   3. packs units into chunks with bisect over the units' end offsets,
+#      preferring to break before a heading, and overlaps only whole sentences.
+# Token counts are estimated (Latin ~4 chars/token, Bengali and other scripts
+# ~2.5 chars/token), which is close enough to size chunks for the embedder.
+
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "300"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "40"))
+# A trailing piece smaller than this is folded into the previous chunk.
+CHUNK_MIN_TOKENS = int(os.getenv("CHUNK_MIN_TOKENS", "60"))
+
+_SENTENCE_END = re.compile(r'(?<=[.!?\u0964\u0965])[\'"\)\]\u2019\u201d]*\s+')
+_HEADING_LINE = re.compile(r'^\s*(#{1,6}\s|\*\*[^*]+\*\*\s*$)')
+
+HEADING, TABLE, FIGURE, SENTENCE = "heading", "table", "figure", "sentence"
+
+
+def _token_prefix(text: str) -> List[float]:
+    """prefix[i] = estimated tokens in text[:i]."""
+    return list(accumulate(
+        (0.25 if ord(ch) < 128 else 0.4 for ch in text), initial=0.0
+    ))
+
+
+def estimate_tokens(text: str) -> float:
+    """Same per-character estimate as _token_prefix, for a whole string."""
+    return sum(0.25 if ord(ch) < 128 else 0.4 for ch in text)
+
+
+def _scan_units(text: str) -> List[Tuple[int, int, str]]:
+    """Splits a page into (start, end, kind) units without copying the text."""
+    units = []
+    pos = 0
+    lines = text.splitlines(keepends=True)
+    n = len(lines)
+    i = 0
+    while i < n:
+        line = lines[i]
+        stripped = line.strip()
+        start = pos
+
+        if not stripped:
+            pos += len(line)
+            i += 1
+            continue
+
+        if stripped.startswith("|"):
+            # a markdown table is one unit: every consecutive '|' line
+            while i < n and lines[i].strip().startswith("|"):
+                pos += len(lines[i])
+                i += 1
+            units.append((start, pos, TABLE))
+            continue
+
+        if stripped.startswith("[Figure:"):
+            # a figure description may wrap over several lines until its ']'
+            while i < n:
+                pos += len(lines[i])
+                i += 1
+                if lines[i - 1].rstrip().endswith("]"):
+                    break
+            units.append((start, pos, FIGURE))
+            continue
+
+        if _HEADING_LINE.match(line):
+            pos += len(line)
+            i += 1
+            units.append((start, pos, HEADING))
+            continue
+
+        # ordinary line: split into sentences
+        end = pos + len(line)
+        cursor = start
+        for m in _SENTENCE_END.finditer(text, start, end):
+            if m.end() > cursor:
+                units.append((cursor, m.end(), SENTENCE))
+                cursor = m.end()
+        if cursor < end:
+            units.append((cursor, end, SENTENCE))
+        pos = end
+        i += 1
+
+    return units
+
+
+def _split_oversized(units, text: str, prefix: List[float], max_tokens: int):
+    """Breaks any unit larger than the budget at whitespace (tables at row
+    boundaries, since every row ends in a newline), so every unit fits."""
+    result = []
+    for start, end, kind in units:
+        if prefix[end] - prefix[start] <= max_tokens:
+            result.append((start, end, kind))
+            continue
+        splitter = re.compile(r'\n') if kind == TABLE else re.compile(r'\s+')
+        cuts = [m.end() for m in splitter.finditer(text, start, end)] + [end]
+        piece_start = start
+        last_cut = start
+        for cut in cuts:
+            if prefix[cut] - prefix[piece_start] > max_tokens and last_cut > piece_start:
+                result.append((piece_start, last_cut, kind))
+                piece_start = last_cut
+            last_cut = cut
+        if piece_start < end:
+            result.append((piece_start, end, kind))
+    return result
+
+
+def chunk_page_structured(
+    text: str,
+    max_tokens: int = CHUNK_MAX_TOKENS,
+    overlap_tokens: int = CHUNK_OVERLAP_TOKENS,
+    min_tokens: int = CHUNK_MIN_TOKENS,
+) -> List[str]:
+    """Chunks one page on structural boundaries within a token budget."""
+    prefix = _token_prefix(text)
+    units = _split_oversized(_scan_units(text), text, prefix, max_tokens)
+    if not units:
+        return []
+
+    starts = [prefix[u[0]] for u in units]
+    ends = [prefix[u[1]] for u in units]
+    n = len(units)
+    chunks = []
+    i = 0
+
+    while i < n:
+        # furthest unit that still fits in the budget
+        j = bisect_right(ends, starts[i] + max_tokens, lo=i)
+        j = max(j, i + 1)
+
+        if j < n:
+            # prefer to break before a heading once the chunk is half full
+            for h in range(i + 1, j):
+                if units[h][2] == HEADING and starts[h] - starts[i] >= max_tokens / 2:
+                    j = h
+                    break
+            # never end a chunk on a dangling heading
+            if units[j - 1][2] == HEADING and j - 1 > i:
+                j -= 1
+            # fold a small remainder into this chunk instead of emitting a stub
+            if ends[n - 1] - starts[j] < min_tokens and ends[n - 1] - starts[i] <= max_tokens * 1.25:
+                j = n
+
+        chunk = text[units[i][0]:units[j - 1][1]].strip()
+        if chunk:
+            chunks.append(chunk)
+        if j >= n:
+            break
+
+        # overlap: step back over whole trailing sentences within the overlap budget
+        k = j
+        while (k - 1 > i and units[k - 1][2] == SENTENCE
+               and ends[j - 1] - starts[k - 1] <= overlap_tokens):
+            k -= 1
+        i = k
+
+    return chunks
+
+
 def chunk_pages_by_chapter(
     pages: List[Dict],
-    chunk_size: int = 800,
-    overlap: int = 200
+    max_tokens: int = CHUNK_MAX_TOKENS,
+    overlap_tokens: int = CHUNK_OVERLAP_TOKENS,
 ) -> List[Dict]:
     """
-    Chunks all pages WITHOUT topic assignment.
+    Chunks all pages WITHOUT topic assignment, using the structure-aware
+    chunker (one page never spills into another, so page_num stays exact).
     Topic-based retrieval happens at query time using semantic search.
     """
     all_chunks = []
     chunk_index = 0
 
     for page in pages:
-        page_chunks = chunk_text(page["text"], chunk_size=chunk_size, overlap=overlap)
+        page_chunks = chunk_page_structured(
+            page["text"], max_tokens=max_tokens, overlap_tokens=overlap_tokens
+        )
 
         for chunk_text_content in page_chunks:
             all_chunks.append({
                 "chunk_index": chunk_index,
                 "text": chunk_text_content,
-                "page_num": page["page_num"]
+                "page_num": page["page_num"],
+                "content_hash": content_hash(chunk_text_content),
             })
             chunk_index += 1
 
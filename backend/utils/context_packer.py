@@ -0,0 +1,188 @@
+# context_packer.py - Post-retrieval context packing (CPU only, no API calls).
+#
+# The context handed to the agents used to be "the first chunks that fit under
+# MAX_CONTEXT_CHARS, by score". Neighbouring chunks repeat their sentence
+# overlap (utils/chunker.py), near-identical chunks from two editions of a
+# book both got in, and the budget ran out before the second-best idea did.
+# pack_context() instead:
+#
+#   1. drops exact duplicates (same whitespace-normalized text);
+#   2. orders candidates by MMR — relevance minus similarity to what is
+#      already chosen — using BM25 sparse vectors (utils/sparse_encoder.py)
+#      as the similarity space, so no vectors have to be fetched;
+#   3. packs them greedily into a TOKEN budget, charging a chunk only for the
+#      text it adds: the overlap with an already chosen chunk_index neighbour
+#      from the same file is free;
+#   4. merges runs of contiguous chunks into one passage with the overlap
+#      stripped, so each sentence appears once.
+#
+# Passages come back best-first, each shaped like a retrieved chunk
+# ({text, filename, page, chunk_index, score, ...}), with "page" as a range
+# ("12-13") when a merged passage spans pages.
+#
+# CONTEXT_MMR_LAMBDA: 1.0 = pure relevance, 0.0 = pure diversity.
+
+import os
+import math
+from typing import Dict, List, Optional
+
+from utils.chunker import estimate_tokens
+from utils.sparse_encoder import encode_document
+
+
+CONTEXT_MMR_LAMBDA = float(os.getenv("CONTEXT_MMR_LAMBDA", "0.7"))
+# Chunks this similar to a chosen one are treated as duplicates and skipped
+CONTEXT_DUPLICATE_SIMILARITY = float(os.getenv("CONTEXT_DUPLICATE_SIMILARITY", "0.9"))
+# Shortest suffix/prefix match accepted as chunker overlap
+MIN_OVERLAP_CHARS = 20
+# Retrieve this many times the final chunk count, so MMR has room to choose
+CONTEXT_CANDIDATE_FACTOR = int(os.getenv("CONTEXT_CANDIDATE_FACTOR", "2"))
+
+
+def tokens_for_chars(max_chars: int, chunks: List[Dict]) -> float:
+    """A char cap expressed as a token budget, using the token density of the
+    candidates themselves: estimate_tokens charges Bengali text 0.4 per char
+    against 0.25 for ASCII, so a fixed 4 chars/token would give Bengali
+    contexts only 62.5% of the char cap."""
+    chars = sum(len(c["text"]) for c in chunks)
+    if not chars:
+        return max_chars * 0.25
+    return max_chars * sum(estimate_tokens(c["text"]) for c in chunks) / chars
+
+
+# ── SIMILARITY ────────────────────────────────────────────────────────────────
+
+def _sparse(text: str) -> Dict[int, float]:
+    indices, values = encode_document(text)
+    norm = math.sqrt(sum(v * v for v in values)) or 1.0
+    return {i: v / norm for i, v in zip(indices, values)}
+
+
+def _cosine(a: Dict[int, float], b: Dict[int, float]) -> float:
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(v * b.get(i, 0.0) for i, v in a.items())
+
+
+def _relevance(chunks: List[Dict]) -> List[float]:
+    """Scores rescaled to [0, 1] — cosine and RRF scores live on different scales."""
+    scores = [float(c.get("score") or 0.0) for c in chunks]
+    low, high = min(scores), max(scores)
+    if high - low < 1e-9:
+        return [1.0] * len(scores)
+    return [(s - low) / (high - low) for s in scores]
+
+
+def mmr_order(chunks: List[Dict], lambda_: float = CONTEXT_MMR_LAMBDA) -> List[int]:
+    """Indices of `chunks` in MMR order, near-duplicates removed."""
+    vectors = [_sparse(c["text"]) for c in chunks]
+    relevance = _relevance(chunks)
+    remaining = list(range(len(chunks)))
+    max_sim = [0.0] * len(chunks)       # similarity to the closest chosen chunk
+    order = []
+
+    while remaining:
+        best = max(remaining, key=lambda i: lambda_ * relevance[i] - (1 - lambda_) * max_sim[i])
+        remaining.remove(best)
+        order.append(best)
+        for i in remaining:
+            max_sim[i] = max(max_sim[i], _cosine(vectors[i], vectors[best]))
+        remaining = [i for i in remaining if max_sim[i] < CONTEXT_DUPLICATE_SIMILARITY]
+    return order
+
+
+# ── OVERLAP / MERGE ───────────────────────────────────────────────────────────
+
+def overlap_length(first: str, second: str) -> int:
+    """Length of the longest suffix of `first` that is a prefix of `second`."""
+    limit = min(len(first), len(second))
+    # Overlaps start on a sentence, so candidate starts are where second's head occurs in first
+    head = second[:MIN_OVERLAP_CHARS]
+    if len(head) < MIN_OVERLAP_CHARS:
+        return 0
+    start = first.find(head, len(first) - limit)
+    while start != -1:
+        if second.startswith(first[start:]):
+            return len(first) - start
+        start = first.find(head, start + 1)
+    return 0
+
+
+def _position(chunk: Dict):
+    index = chunk.get("chunk_index")
+    return (chunk.get("filename"), index) if isinstance(index, int) else None
+
+
+def _merge_run(run: List[Dict]) -> Dict:
+    text = run[0]["text"]
+    for previous, chunk in zip(run, run[1:]):
+        text += "\n" + chunk["text"][overlap_length(previous["text"], chunk["text"]):].lstrip()
+    first_page, last_page = run[0].get("page"), run[-1].get("page")
+    merged = dict(max(run, key=lambda c: float(c.get("score") or 0.0)))
+    merged.update({
+        "text": text,
+        "page": first_page if first_page == last_page else f"{first_page}-{last_page}",
+        "chunk_index": run[0].get("chunk_index"),
+        "merged_chunks": len(run),
+    })
+    return merged
+
+
+# ── PACK ──────────────────────────────────────────────────────────────────────
+
+def pack_context(chunks: List[Dict], max_tokens: float,
+                 lambda_: Optional[float] = None) -> List[Dict]:
+    """Selects, de-overlaps and merges retrieved chunks into at most
+    `max_tokens` (estimated) of context — or the best chunk alone when not
+    even that one fits. Returns passages best-first."""
+    lambda_ = CONTEXT_MMR_LAMBDA if lambda_ is None else lambda_
+
+    unique, seen = [], set()
+    for chunk in chunks:
+        key = " ".join(chunk["text"].split())
+        if key and key not in seen:
+            seen.add(key)
+            unique.append(chunk)
+    if not unique:
+        return []
+
+    chosen = {}         # position (or id) -> chunk
+    rank = {}           # position -> MMR rank, to order passages best-first
+    used = 0.0
+    order = mmr_order(unique, lambda_)
+    for r, i in enumerate(order):
+        chunk = unique[i]
+        pos = _position(chunk) or ("#", i)
+        cost = estimate_tokens(chunk["text"])
+        if pos[0] != "#":
+            before = chosen.get((pos[0], pos[1] - 1))
+            after = chosen.get((pos[0], pos[1] + 1))
+            if before:
+                cost -= estimate_tokens(chunk["text"][:overlap_length(before["text"], chunk["text"])])
+            if after:
+                cost -= estimate_tokens(chunk["text"][len(chunk["text"]) - overlap_length(chunk["text"], after["text"]):])
+        if used + cost > max_tokens + 1e-6:     # float slack: an exact fit must fit
+            continue
+        chosen[pos] = chunk
+        rank[pos] = r
+        used += max(cost, 0.0)
+    if not chosen:
+        # Even the best chunk is over budget — an oversized context beats none
+        pos = _position(unique[order[0]]) or ("#", order[0])
+        chosen[pos] = unique[order[0]]
+        rank[pos] = 0
+
+    # Runs of consecutive chunk_index values from the same file become one passage
+    passages = []
+    for pos in sorted(chosen, key=lambda p: (str(p[0]), p[1])):
+        previous = passages[-1] if passages else None
+        if (previous and pos[0] != "#" and previous["file"] == pos[0]
+                and previous["last"] == pos[1] - 1):
+            previous["run"].append(chosen[pos])
+            previous["last"] = pos[1]
+            previous["rank"] = min(previous["rank"], rank[pos])
+        else:
+            passages.append({"file": pos[0], "last": pos[1], "run": [chosen[pos]], "rank": rank[pos]})
+
+    passages.sort(key=lambda p: p["rank"])
+    return [_merge_run(p["run"]) if len(p["run"]) > 1 else dict(p["run"][0]) for p in passages]
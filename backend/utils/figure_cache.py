@@ -0,0 +1,108 @@
+# figure_cache.py - Exact-content cache for pixtral figure descriptions.
+#
+# NCTB books reuse the same icons, mascots and diagrams, and a re-uploaded
+# chapter repeats every figure; each copy used to cost a pixtral call. A
+# description is now keyed by exactly what produced it:
+#   sha256(decoded image bytes) | width x height | sha256(nearby page text)
+# so only the same picture, described with the same page context, reuses a
+# stored description (or stored 'SKIP' verdict).
+#
+# There is deliberately NO near-duplicate matching: a 64-bit perceptual hash
+# of a line diagram, table or blank crop carries almost no information (a
+# plain number line and a blank image are 2 bits apart), so near matches
+# handed sparse diagrams the wrong description or another figure's SKIP.
+#
+# Storage is a size-bounded SQLite table (core/cache_backends.py). Stateless
+# w.r.t. the rest of the app — no core.config imports, same as the other utils.
+
+import os
+import io
+import base64
+import hashlib
+import threading
+from typing import Optional, Tuple
+
+from PIL import Image
+
+from core.cache_backends import SQLiteCacheBackend
+
+
+FIGURE_CACHE_ENABLED = os.getenv("FIGURE_CACHE_ENABLED", "true").strip().lower() == "true"
+FIGURE_CACHE_PATH = os.getenv(
+    "FIGURE_CACHE_PATH", os.path.join(os.getenv("CACHE_DIR", ".cache"), "figures.sqlite3")
+)
+FIGURE_CACHE_MAX_ENTRIES = int(os.getenv("FIGURE_CACHE_MAX_ENTRIES", "50000"))
+# The describer only sees this much of the page text (utils/parser.py)
+FIGURE_CONTEXT_CHARS = 500
+
+
+def figure_key(img_b64: str, context: str = "") -> Optional[str]:
+    """Cache key of one figure in one page context. Returns None if the image
+    can't be decoded (it is then described without the cache)."""
+    if img_b64.startswith("data:"):
+        img_b64 = img_b64.split(",", 1)[-1]
+    try:
+        data = base64.b64decode(img_b64)
+        with Image.open(io.BytesIO(data)) as img:
+            width, height = img.size
+    except Exception:
+        return None
+    image_digest = hashlib.sha256(data).hexdigest()
+    context_digest = hashlib.sha256((context or "")[:FIGURE_CONTEXT_CHARS].encode("utf-8")).hexdigest()
+    return f"{image_digest}|{width}x{height}|{context_digest}"
+
+
+class FigureDescriptionCache:
+    """Exact lookup of figure descriptions by figure_key(). Thread-safe."""
+
+    def __init__(self, path: str, max_entries: int):
+        self._store = SQLiteCacheBackend(path, table="figure_description_cache", max_entries=max_entries)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, key: str) -> Optional[str]:
+        try:
+            description = self._store.get(key)
+        except Exception as e:
+            print(f"[Figure Cache] Read failed, treating as miss — {e}")
+            description = None
+        with self._lock:
+            if description is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return description
+
+    def store(self, key: str, description: str) -> None:
+        try:
+            self._store.set(key, description)
+        except Exception as e:
+            print(f"[Figure Cache] Write failed, continuing without cache — {e}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, **self._store.stats()}
+
+
+figure_cache = FigureDescriptionCache(
+    path=FIGURE_CACHE_PATH,
+    max_entries=FIGURE_CACHE_MAX_ENTRIES,
+)
+
+
+def cached_describe(img_b64: str, describe, context: str = "") -> Tuple[str, bool]:
+    """Returns (description, from_cache). `describe` is called only on a miss,
+    and its result (including 'SKIP') is stored for the next identical figure
+    in the same page context. Exceptions from `describe` propagate so the
+    caller's failure handling stays in charge."""
+    key = figure_key(img_b64, context) if FIGURE_CACHE_ENABLED else None
+    if key is not None:
+        cached = figure_cache.lookup(key)
+        if cached is not None:
+            return cached, True
+
+    description = describe()
+    if key is not None and description:
+        figure_cache.store(key, description)
+    return description, False
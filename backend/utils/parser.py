@@ -8,7 +8,10 @@
 #   1. Figures: each ![img-N] tag is replaced with a text "[Figure: ...]"
 #      description from pixtral-12b (or removed if purely decorative). If a
 #      single image fails to describe, the original tag is kept — one bad image
-#      never aborts the parse.
+#      never aborts the parse. All figures of the document are described
+#      concurrently (FIGURE_DESCRIBE_WORKERS), then stitched back per page.
+#      Figures already seen (same image bytes, same page context) reuse
+#      their stored description — see utils/figure_cache.py.
 #   2. Noise removal is DOCUMENT-AGNOSTIC (no hardcoded book words):
 #        - running headers/footers/watermarks are detected because they REPEAT
 #          across many pages, then removed;
@@ -22,13 +25,23 @@
 # pipeline treats each page as its own record; rejoining is applied within a
 # page only.
 
+import io
 import re
+import json
 import time
+import hashlib
+import multiprocessing
+import unicodedata
 from collections import Counter
-from typing import List, Dict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from typing import List, Dict, Optional
 
 import os
 from mistralai.client import Mistral
+from pypdf import PdfReader
+
+from core.cache_backends import SQLiteCacheBackend
+from utils.figure_cache import cached_describe, FIGURE_CONTEXT_CHARS
 
 
 # ── MISTRAL CLIENT SETUP ──────────────────────────────────────────────────────
@@ -37,6 +50,9 @@ mistral_client = Mistral(api_key=os.environ["MISTRAL_API_KEY"])
 OCR_MODEL = "mistral-ocr-latest"
 VISION_MODEL = "pixtral-12b-2409"
 
+# Max concurrent pixtral calls while describing figures (all pages at once).
+FIGURE_DESCRIBE_WORKERS = int(os.getenv("FIGURE_DESCRIBE_WORKERS", "8"))
+
 
 # ── FIGURE DESCRIPTION (pixtral) ──────────────────────────────────────────────
 
@@ -55,7 +71,7 @@ def _describe_image(img_b64: str, context: str = "") -> str:
         "reply with exactly: SKIP."
     )
     if context:
-        prompt += f"\n\nNearby text:\n{context[:500]}"
+        prompt += f"\n\nNearby text:\n{context[:FIGURE_CONTEXT_CHARS]}"
     resp = mistral_client.chat.complete(
         model=VISION_MODEL,
         messages=[{"role": "user", "content": [
@@ -66,18 +82,74 @@ def _describe_image(img_b64: str, context: str = "") -> str:
     return resp.choices[0].message.content.strip()
 
 
-def _replace_images(md: str, page_images, page_num: int) -> str:
+def _describe_all_figures(ocr_pages) -> Dict[tuple, Optional[str]]:
+    """Describe every figure of every page concurrently on a bounded thread pool.
+    Returns {(page_index, image_id): description}; a figure whose description
+    failed maps to None so its original tag is kept."""
+    jobs = [
+        (page_idx, img, page.markdown)
+        for page_idx, page in enumerate(ocr_pages)
+        for img in (getattr(page, "images", None) or [])
+    ]
+    if not jobs:
+        return {}
+
+    print(f"[Parser] Describing {len(jobs)} figure(s) across {len(ocr_pages)} page(s) "
+          f"with up to {FIGURE_DESCRIBE_WORKERS} parallel pixtral calls...")
+    started = time.perf_counter()
+
+    def describe(img, md):
+        # The same figure in the same page context (e.g. a re-uploaded chapter)
+        # reuses the stored description or SKIP verdict without a pixtral call
+        return cached_describe(img.image_base64, lambda: _describe_image(img.image_base64, md), context=md)
+
+    descriptions: Dict[tuple, Optional[str]] = {}
+    cache_hits = cache_misses = 0
+    with ThreadPoolExecutor(max_workers=FIGURE_DESCRIBE_WORKERS) as executor:
+        futures = {
+            executor.submit(describe, img, md): (page_idx, img.id)
+            for page_idx, img, md in jobs
+        }
+        for future in as_completed(futures):
+            page_idx, img_id = futures[future]
+            try:
+                desc, from_cache = future.result()
+            except Exception as e:
+                print(f"[Parser] Warning: could not describe image '{img_id}' on "
+                      f"page {page_idx + 1} — keeping original tag. ({e})")
+                descriptions[(page_idx, img_id)] = None
+                cache_misses += 1
+                continue
+            descriptions[(page_idx, img_id)] = desc
+            if from_cache:
+                cache_hits += 1
+            else:
+                cache_misses += 1
+
+    print(f"[Parser] Figure descriptions done in {time.perf_counter() - started:.1f}s "
+          f"(figure cache: {cache_hits} hit(s), {cache_misses} miss(es))")
+    return descriptions
+
+
+def _replace_images(md: str, page_images, page_num: int, descriptions: Dict[str, Optional[str]] = None) -> str:
     """Replace each ![img] tag in `md` with a [Figure: ...] description.
     Decorative images are removed. If describing an image fails, its original
-    tag is left in place so no page content is lost."""
+    tag is left in place so no page content is lost.
+    `descriptions` ({image_id: text or None}) comes from _describe_all_figures;
+    when it is not given, each image is described here, one at a time."""
     for img in page_images:
         tag_pattern = re.compile(r'!\[[^\]]*' + re.escape(img.id) + r'[^\]]*\]\([^)]*\)')
-        try:
-            desc = _describe_image(img.image_base64, context=md)
-        except Exception as e:
-            print(f"[Parser] Warning: could not describe image '{img.id}' on "
-                  f"page {page_num} — keeping original tag. ({e})")
-            continue
+        if descriptions is not None:
+            desc = descriptions.get(img.id)
+            if desc is None:
+                continue
+        else:
+            try:
+                desc = _describe_image(img.image_base64, context=md)
+            except Exception as e:
+                print(f"[Parser] Warning: could not describe image '{img.id}' on "
+                      f"page {page_num} — keeping original tag. ({e})")
+                continue
         if desc.upper() == "SKIP":
             md = tag_pattern.sub('', md)
         else:
@@ -153,13 +225,118 @@ def _clean_page_text(md: str, headers: set) -> str:
     return text
 
 
-# ── PDF PARSER (Mistral OCR + pixtral figure descriptions) ────────────────────
+# ── LOCAL FAST PATH (born-digital pages via pypdf) ───────────────────────────
+# Many uploads (especially 'foreign' enrichment material) are born-digital PDFs
+# with a real text layer. Those pages are extracted locally with pypdf, in
+# parallel across a process pool; only scanned / image-only pages (or pages
+# whose text layer is garbled) are sent to Mistral OCR.
+
+LOCAL_TEXT_MIN_CHARS = int(os.getenv("LOCAL_TEXT_MIN_CHARS", "200"))
+LOCAL_EXTRACT_SAMPLE_PAGES = 8
+LOCAL_EXTRACT_WORKERS = int(os.getenv("LOCAL_EXTRACT_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Below this many pages the process pool costs more than it saves.
+LOCAL_EXTRACT_POOL_MIN_PAGES = 24
+# Pages that carry images still go to OCR so their figures get described.
+# Set to false to trade figure descriptions for speed on image-heavy digital PDFs.
+LOCAL_TEXT_OCR_FIGURE_PAGES = os.getenv("LOCAL_TEXT_OCR_FIGURE_PAGES", "true").strip().lower() == "true"
+
+# Legacy Bengali fonts (SutonnyMJ etc.) extract as Latin-1 / punctuation soup
+# like "evsjv‡`k"; a high share of these characters means the layer is unusable.
+_LEGACY_FONT_CHARS = re.compile(r'[\u00a1-\u00bf\u00c0-\u02ff\u2020-\u2030\u2039-\u203a]')
+_WORD = re.compile(r'[\w\u0980-\u09FF]{2,}')
+
+
+def _is_usable_text_layer(text: str) -> bool:
+    stripped = (text or "").strip()
+    if len(stripped) < LOCAL_TEXT_MIN_CHARS:
+        return False
+    bad = sum(
+        1 for ch in stripped
+        if ch == '\ufffd' or '\ue000' <= ch <= '\uf8ff'
+        or (unicodedata.category(ch) == 'Cc' and ch not in '\n\r\t')
+    )
+    if bad / len(stripped) > 0.01:
+        return False
+    if len(_LEGACY_FONT_CHARS.findall(stripped)) / len(stripped) > 0.03:
+        return False
+    return len(_WORD.findall(stripped)) >= 20
 
-def extract_text_from_pdf(file_bytes: bytes, filename: str = "document.pdf") -> List[Dict]:
-    """Extract text from a PDF via Mistral OCR, replace figures with text
-    descriptions, remove document-specific running headers/footers, and return
-    one {page_num, text} record per page (page provenance preserved)."""
 
+def _page_has_figures(page) -> bool:
+    """True if the page draws any image XObject. Checked from the resource
+    dictionary only — no image is decoded."""
+    try:
+        xobjects = (page.get("/Resources") or {}).get("/XObject") or {}
+        return any(
+            xobjects[name].get_object().get("/Subtype") == "/Image" for name in xobjects
+        )
+    except Exception:
+        return False
+
+
+def _local_page_text(page) -> Optional[str]:
+    """Text of one pypdf page if it can skip OCR, else None."""
+    try:
+        text = page.extract_text() or ""
+    except Exception:
+        return None
+    if not _is_usable_text_layer(text):
+        return None
+    # Figures are only described on the OCR path, so keep those pages there.
+    if LOCAL_TEXT_OCR_FIGURE_PAGES and _page_has_figures(page):
+        return None
+    return text
+
+
+def _extract_page_range(args) -> List[Optional[str]]:
+    """Process-pool worker: classifies and extracts pages [start, end) of the
+    PDF with pypdf. Module-level so it can be pickled."""
+    file_bytes, start, end = args
+    reader = PdfReader(io.BytesIO(file_bytes))
+    return [_local_page_text(reader.pages[i]) for i in range(start, end)]
+
+
+def _extract_text_layer(file_bytes: bytes) -> List[Optional[str]]:
+    """Returns one entry per page: the locally extracted text when the page has
+    a usable text layer (and no figures), or None when the page must go to OCR.
+    A quick sample of pages is checked first, so a fully scanned book costs
+    only a handful of pypdf page reads before falling through to OCR."""
+    try:
+        reader = PdfReader(io.BytesIO(file_bytes))
+        num_pages = len(reader.pages)
+    except Exception as e:
+        print(f"[Parser] pypdf could not open the file ({e}) — using OCR for every page.")
+        return []
+    if num_pages == 0:
+        return []
+
+    step = max(1, num_pages // LOCAL_EXTRACT_SAMPLE_PAGES)
+    sample = list(range(0, num_pages, step))[:LOCAL_EXTRACT_SAMPLE_PAGES]
+    if not any(_local_page_text(reader.pages[i]) is not None for i in sample):
+        print(f"[Parser] No usable text layer in {len(sample)} sampled page(s) — OCR for every page.")
+        return [None] * num_pages
+
+    if num_pages < LOCAL_EXTRACT_POOL_MIN_PAGES or LOCAL_EXTRACT_WORKERS <= 1:
+        return _extract_page_range((file_bytes, 0, num_pages))
+
+    per_worker = -(-num_pages // LOCAL_EXTRACT_WORKERS)
+    ranges = [
+        (file_bytes, start, min(start + per_worker, num_pages))
+        for start in range(0, num_pages, per_worker)
+    ]
+    # "spawn", not the default fork: the worker process runs a heartbeat thread
+    # and thread pools, and a forked child can inherit one of their locks held
+    # (deadlock). Spawned children start clean and re-import only this module.
+    with ProcessPoolExecutor(max_workers=LOCAL_EXTRACT_WORKERS,
+                             mp_context=multiprocessing.get_context("spawn")) as executor:
+        return [t for chunk in executor.map(_extract_page_range, ranges) for t in chunk]
+
+
+# ── PDF PARSER (Mistral OCR + pixtral figure descriptions) ────────────────────
+
+def _ocr_page_markdowns(file_bytes: bytes, filename: str, page_indices: List[int] = None) -> Dict[int, str]:
+    """Runs Mistral OCR (all pages, or only `page_indices`, 0-based) and returns
+    {page_index: markdown} with figures replaced by pixtral descriptions."""
     print(f"[Parser] Uploading '{filename}' to Mistral OCR...")
     uploaded = mistral_client.files.upload(
         file={"file_name": filename, "content": file_bytes},
@@ -169,45 +346,80 @@ def extract_text_from_pdf(file_bytes: bytes, filename: str = "document.pdf") ->
     print("[Parser] Waiting for Mistral servers to process the upload...")
     time.sleep(5)
 
-    signed_url = mistral_client.files.get_signed_url(file_id=uploaded.id)
-
-    print("[Parser] Running Mistral OCR (this may take a while for large files)...")
-    response = mistral_client.ocr.process(
-        model=OCR_MODEL,
-        document={"type": "document_url", "document_url": signed_url.url},
-        include_image_base64=True,   # needed for figure descriptions
-        timeout_ms=300000,
-    )
+    try:
+        signed_url = mistral_client.files.get_signed_url(file_id=uploaded.id)
+
+        print("[Parser] Running Mistral OCR (this may take a while for large files)...")
+        ocr_kwargs = {}
+        if page_indices is not None:
+            ocr_kwargs["pages"] = page_indices
+        response = mistral_client.ocr.process(
+            model=OCR_MODEL,
+            document={"type": "document_url", "document_url": signed_url.url},
+            include_image_base64=True,   # needed for figure descriptions
+            timeout_ms=300000,
+            **ocr_kwargs,
+        )
+    finally:
+        # ── Clean up uploaded file from Mistral ───────────────────────────────
+        try:
+            mistral_client.files.delete(file_id=uploaded.id)
+            print("[Parser] Cleaned up uploaded file from Mistral.")
+        except Exception as e:
+            print(f"[Parser] Warning: Could not delete Mistral file — {e}")
 
     # ── Pass 1: build per-page markdown with figures replaced by descriptions ─
-    print("[Parser] Describing figures with pixtral...")
-    page_markdowns: List[str] = []
+    # Every figure in the document is described in parallel first, then the
+    # results are stitched back into their own page, in tag order.
+    descriptions = _describe_all_figures(response.pages)
+    page_markdowns: Dict[int, str] = {}
     for i, page in enumerate(response.pages):
-        md = page.markdown
-        md = _replace_images(md, getattr(page, "images", []), i + 1)
-        page_markdowns.append(md)
+        page_index = getattr(page, "index", None)
+        if page_index is None:
+            page_index = page_indices[i] if page_indices is not None else i
+        page_images = getattr(page, "images", None) or []
+        page_descriptions = {img.id: descriptions.get((i, img.id)) for img in page_images}
+        page_markdowns[page_index] = _replace_images(
+            page.markdown, page_images, page_index + 1, page_descriptions
+        )
+    return page_markdowns
+
+
+def extract_text_from_pdf(file_bytes: bytes, filename: str = "document.pdf") -> List[Dict]:
+    """Extract text from a PDF — pages with a usable text layer locally via
+    pypdf, the rest via Mistral OCR with figures replaced by text descriptions —
+    remove document-specific running headers/footers, and return one
+    {page_num, text} record per page (page provenance preserved)."""
+
+    local_texts = _extract_text_layer(file_bytes)
+    ocr_indices = [i for i, t in enumerate(local_texts) if t is None]
+
+    if local_texts and not ocr_indices:
+        print(f"[Parser] All {len(local_texts)} page(s) have a text layer — skipping OCR.")
+        page_markdowns = dict(enumerate(local_texts))
+    elif local_texts and len(ocr_indices) < len(local_texts):
+        print(f"[Parser] {len(local_texts) - len(ocr_indices)} page(s) extracted locally, "
+              f"{len(ocr_indices)} scanned page(s) sent to OCR.")
+        page_markdowns = {i: t for i, t in enumerate(local_texts) if t is not None}
+        page_markdowns.update(_ocr_page_markdowns(file_bytes, filename, ocr_indices))
+    else:
+        page_markdowns = _ocr_page_markdowns(file_bytes, filename)
+
+    ordered = [page_markdowns[i] for i in sorted(page_markdowns)]
 
     # ── Pass 2: detect running headers across all pages, then clean per page ──
-    headers = _find_running_headers(page_markdowns)
+    headers = _find_running_headers(ordered)
     if headers:
         print(f"[Parser] Removing {len(headers)} running header/footer line(s): "
               f"{sorted(headers)}")
 
     pages: List[Dict] = []
-    for i, md in enumerate(page_markdowns):
-        text = _clean_page_text(md, headers)
+    for i in sorted(page_markdowns):
+        text = _clean_page_text(page_markdowns[i], headers)
         if text:
             pages.append({"page_num": i + 1, "text": text})
 
-    print(f"[Parser] Mistral OCR complete. Extracted {len(pages)} page(s).")
-
-    # ── Clean up uploaded file from Mistral ───────────────────────────────────
-    try:
-        mistral_client.files.delete(file_id=uploaded.id)
-        print("[Parser] Cleaned up uploaded file from Mistral.")
-    except Exception as e:
-        print(f"[Parser] Warning: Could not delete Mistral file — {e}")
-
+    print(f"[Parser] PDF extraction complete. Extracted {len(pages)} page(s).")
     return pages
 
 
@@ -225,8 +437,51 @@ def extract_text_from_txt(file_bytes: bytes) -> List[Dict]:
     return []
 
 
+# ── OCR RESULT CACHE ──────────────────────────────────────────────────────────
+# Cleaned per-page output keyed by SHA-256 of the PDF bytes. OCR_CACHE_MAX_FILES
+# bounds how many parsed documents are retained (least-recently-used evicted);
+# set it to 0 to disable. Bump OCR_CACHE_VERSION whenever the cleaning logic
+# above changes, so stale output is never reused.
+OCR_CACHE_VERSION = "v3"
+OCR_CACHE_MAX_FILES = int(os.getenv("OCR_CACHE_MAX_FILES", "200"))
+OCR_CACHE_TTL_SECONDS = float(os.getenv("OCR_CACHE_TTL_SECONDS", "0")) or None
+
+ocr_cache = SQLiteCacheBackend(
+    os.getenv("OCR_CACHE_PATH", os.path.join(os.getenv("CACHE_DIR", ".cache"), "ocr.sqlite3")),
+    table="ocr_pages",
+    max_entries=OCR_CACHE_MAX_FILES,
+) if OCR_CACHE_MAX_FILES > 0 else None
+
+
 # ── DISPATCHER ────────────────────────────────────────────────────────────────
 
+def _cached_pdf_pages(file_bytes: bytes, filename: str) -> List[Dict]:
+    """extract_text_from_pdf behind a content-addressed store: the same PDF
+    bytes (a retried job, or a re-upload under another chapter/filename) skip
+    the whole Mistral upload -> OCR -> pixtral sequence."""
+    if ocr_cache is None:
+        return extract_text_from_pdf(file_bytes, filename)
+
+    key = f"{OCR_CACHE_VERSION}:{hashlib.sha256(file_bytes).hexdigest()}"
+    try:
+        cached = ocr_cache.get(key)
+    except Exception as e:
+        print(f"[Parser] Warning: OCR cache read failed — {e}")
+        cached = None
+    if cached is not None:
+        pages = json.loads(cached)
+        print(f"[Parser] OCR cache hit for '{filename}' — reusing {len(pages)} parsed page(s).")
+        return pages
+
+    pages = extract_text_from_pdf(file_bytes, filename)
+    if pages:
+        try:
+            ocr_cache.set(key, json.dumps(pages, ensure_ascii=False), ttl=OCR_CACHE_TTL_SECONDS)
+        except Exception as e:
+            print(f"[Parser] Warning: OCR cache write failed — {e}")
+    return pages
+
+
 def parse_file(file_bytes: bytes, filename: str) -> List[Dict]:
     """Dispatcher: picks the parser by file extension.
     Returns [{"page_num": int, "text": str}, ...]. Raises ValueError on
@@ -234,7 +489,7 @@ def parse_file(file_bytes: bytes, filename: str) -> List[Dict]:
     filename_lower = filename.lower()
 
     if filename_lower.endswith(".pdf"):
-        return extract_text_from_pdf(file_bytes, filename)
+        return _cached_pdf_pages(file_bytes, filename)
     elif filename_lower.endswith(".txt"):
         return extract_text_from_txt(file_bytes)
     else:
@@ -0,0 +1,73 @@
+# sparse_encoder.py - Local BM25-style sparse vectors for lexical retrieval.
+#
+# Dense embeddings rank exact terms poorly: a formula such as "v = u + at" or
+# a Bengali heading is smeared into a 3072-dim vector, so retrieval used to
+# over-fetch to be safe. Each chunk now also gets a sparse vector — one
+# dimension per token — that Qdrant scores lexically:
+#
+#   document side  BM25 term-frequency saturation, computed here:
+#                    tf * (k1 + 1) / (tf + k1 * (1 - b + b * len / avg_len))
+#   query side     1.0 per distinct query token
+#   IDF            applied by Qdrant at query time (Modifier.IDF on the
+#                  sparse vector), so it always reflects the live collection.
+#
+# No vocabulary is stored: token ids are a stable 31-bit hash of the token.
+#
+# Tokenization handles Bengali (vowel signs and other combining marks stay
+# inside the word — Python's \w alone would split on them) and keeps formulas
+# as one extra token with whitespace removed, so "v = u + at" also matches
+# "v=u+at" exactly.
+
+import os
+import re
+import zlib
+from collections import Counter
+from typing import List, Tuple
+
+
+BM25_K1 = float(os.getenv("BM25_K1", "1.2"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+# Typical chunk length in tokens (utils/chunker.py packs up to 300 model tokens)
+BM25_AVG_DOC_TOKENS = float(os.getenv("BM25_AVG_DOC_TOKENS", "180"))
+
+# Latin/digit word characters plus the whole Bengali block (letters, vowel signs, digits)
+_WORD_RE = re.compile(r"[\wঀ-৿]+")
+# operand (op operand)+  e.g. "v = u + at", "a^2 + b^2 = c^2", "x ÷ 2"
+_FORMULA_RE = re.compile(r"[\wঀ-৿.]+(?:\s*[=+\-*/^×÷<>≤≥]\s*[\wঀ-৿.]+)+")
+
+
+def tokenize(text: str) -> List[str]:
+    """Lower-cased word tokens, plus one whitespace-free token per formula."""
+    text = text.lower()
+    tokens = _WORD_RE.findall(text)
+    tokens.extend(re.sub(r"\s+", "", m).strip(".") for m in _FORMULA_RE.findall(text))
+    return tokens
+
+
+def token_id(token: str) -> int:
+    return zlib.crc32(token.encode("utf-8")) & 0x7FFFFFFF
+
+
+def _to_sparse(weights: Counter) -> Tuple[List[int], List[float]]:
+    by_id = Counter()
+    for token, weight in weights.items():
+        by_id[token_id(token)] += weight       # hash collisions simply add up
+    indices = sorted(by_id)
+    return indices, [float(by_id[i]) for i in indices]
+
+
+def encode_document(text: str) -> Tuple[List[int], List[float]]:
+    """(indices, values) of the BM25-weighted term frequencies of a chunk."""
+    counts = Counter(tokenize(text))
+    length = sum(counts.values())
+    if not length:
+        return [], []
+    norm = BM25_K1 * (1 - BM25_B + BM25_B * length / BM25_AVG_DOC_TOKENS)
+    return _to_sparse(Counter({
+        token: tf * (BM25_K1 + 1) / (tf + norm) for token, tf in counts.items()
+    }))
+
+
+def encode_query(text: str) -> Tuple[List[int], List[float]]:
+    """(indices, values) with weight 1.0 per distinct query token."""
+    return _to_sparse(Counter({token: 1.0 for token in set(tokenize(text))}))
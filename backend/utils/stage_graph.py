@@ -0,0 +1,67 @@
+# stage_graph.py - Runs pipeline stages as a small dependency graph.
+#
+# Generation pipelines used to call their agents strictly one after another,
+# even when a stage needs none of the others' output (e.g. the YouTube search
+# of a study note only needs the topic). run_stage_graph() takes
+#   {name: (function, [names of the stages it depends on])}
+# and starts every stage on a thread pool as soon as its dependencies have
+# finished. Each function receives the finished dependencies' results as
+# keyword arguments, named after the stages.
+#
+# Returns (results, timings). timings holds start/end offsets and the duration
+# of every stage in seconds, plus the wall-clock total, so slow stages can be
+# spotted in API responses. If a stage raises, no new stages are started and
+# the exception is re-raised once the running ones have finished.
+
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Callable, Dict, List, Tuple
+
+
+def run_stage_graph(stages: Dict[str, Tuple[Callable, List[str]]],
+                    max_workers: int = 4) -> Tuple[Dict[str, object], Dict[str, dict]]:
+    for name, (_, deps) in stages.items():
+        unknown = [d for d in deps if d not in stages]
+        if unknown:
+            raise ValueError(f"Stage '{name}' depends on unknown stage(s) {unknown}")
+
+    started = time.perf_counter()
+    results: Dict[str, object] = {}
+    timings: Dict[str, dict] = {}
+    pending = dict(stages)
+    running = {}
+
+    def _timed(name: str, fn: Callable, kwargs: dict):
+        begin = time.perf_counter()
+        try:
+            return fn(**kwargs)
+        finally:
+            end = time.perf_counter()
+            timings[name] = {
+                "start_s": round(begin - started, 3),
+                "end_s": round(end - started, 3),
+                "duration_s": round(end - begin, 3),
+            }
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending or running:
+            ready = [n for n, (_, deps) in pending.items() if all(d in results for d in deps)]
+            for name in ready:
+                fn, deps = pending.pop(name)
+                future = executor.submit(_timed, name, fn, {d: results[d] for d in deps})
+                running[future] = name
+            if not running:
+                raise ValueError(f"Stage graph has a dependency cycle: {sorted(pending)}")
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                error = future.exception()
+                if error is not None:
+                    pending.clear()             # start nothing new
+                    wait(running)
+                    raise error
+                results[name] = future.result()
+
+    timings["total"] = {"duration_s": round(time.perf_counter() - started, 3)}
+    return results, timings
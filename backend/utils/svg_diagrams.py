@@ -0,0 +1,315 @@
+# svg_diagrams.py - Template SVG renderers for parametric diagram types.
+#
+# Number lines, fraction bars, bar charts, area models and pie charts are fully
+# described by a few numbers, yet every one of them used to cost a Gemini
+# request in the Visual Agent. render_diagram() draws them directly from the
+# structured "diagram_params" the Content Agent emits (same parameter shapes
+# as the matplotlib drawers of the earlier MultiAgent worksheet prototype) in
+# well under a millisecond, and the Visual Agent only calls the model for
+# diagrams this module cannot draw.
+#
+# Output follows prompts/visual_svg_rules.txt: viewBox + width='100%', a
+# landscape aspect ratio (height <= 0.55 x width), single-quoted attributes,
+# Arial text of at least 14px, legends beside or below the drawing — and the
+# diagram never shows the answer (the total of a fraction sum or the product
+# of an area model is drawn as '?').
+#
+# render_diagram() returns None for unsupported types or unusable params, so
+# the caller can fall back to the model.
+
+import math
+from fractions import Fraction
+from typing import Callable, Dict, List, Optional
+from xml.sax.saxutils import escape
+
+PALETTE = ["#5DCAA5", "#85B7EB", "#EF9F27", "#ED93B1", "#AFA9EC"]
+EMPTY_FILL = "#F1EFE8"
+STROKE = "#444441"
+FONT = "font-family='Arial, sans-serif'"
+MAX_ASPECT = 0.55
+MAX_CELLS = 24          # more cells than this are unreadable when printed
+
+
+# ── HELPERS ───────────────────────────────────────────────────────────────────
+
+def _text(x: float, y: float, content, size: int = 16, anchor: str = "middle",
+          bold: bool = False, fill: str = "#222222") -> str:
+    weight = " font-weight='bold'" if bold else ""
+    return (f"<text x='{x:.1f}' y='{y:.1f}' {FONT} font-size='{size}'{weight} "
+            f"fill='{fill}' text-anchor='{anchor}'>{escape(str(content))}</text>")
+
+
+def _color(value, index: int) -> str:
+    value = str(value or "")
+    if value.startswith("#") and len(value) in (4, 7) and all(c in "0123456789abcdefABCDEF" for c in value[1:]):
+        return value
+    return PALETTE[index % len(PALETTE)]
+
+
+def _number(value) -> Fraction:
+    """Accepts 3, 2.5, "3/4" or "1 1/2"."""
+    if isinstance(value, bool):
+        raise ValueError("boolean is not a number")
+    if isinstance(value, (int, float)):
+        return Fraction(value).limit_denominator(1000)
+    parts = str(value if value is not None else "").strip().split()
+    if not parts or len(parts) > 2:
+        raise ValueError(f"not a number: {value!r}")
+    if len(parts) == 2:                         # mixed number "1 1/2"
+        whole, frac = Fraction(parts[0]), Fraction(parts[1])
+        return whole + frac if whole >= 0 else whole - frac
+    return Fraction(parts[0]).limit_denominator(1000)
+
+
+def _format_number(value: Fraction) -> str:
+    if value.denominator == 1:
+        return str(value.numerator)
+    return f"{value.numerator}/{value.denominator}"
+
+
+def _svg(width: float, height: float, body: List[str]) -> str:
+    """Wraps the drawing, widening the viewBox (content centred) whenever the
+    height would exceed MAX_ASPECT x width."""
+    view_width = max(width, height / MAX_ASPECT)
+    shift = (view_width - width) / 2
+    content = "".join(body)
+    if shift:
+        content = f"<g transform='translate({shift:.1f},0)'>{content}</g>"
+    return (f"<svg xmlns='http://www.w3.org/2000/svg' viewBox='0 0 {view_width:.0f} {height:.0f}' "
+            f"width='100%'>{content}</svg>")
+
+
+def _title(body: List[str], params: dict, width: float) -> float:
+    """Draws the optional title; returns the y where the drawing may start."""
+    title = params.get("title")
+    if not title:
+        return 20
+    body.append(_text(width / 2, 34, title, size=18, bold=True))
+    return 60
+
+
+def _fraction_parts(value: dict) -> tuple:
+    n, d = int(value["numerator"]), int(value["denominator"])
+    if d <= 0 or d > MAX_CELLS or n < 0 or n > d:
+        raise ValueError(f"unsupported fraction {n}/{d}")
+    return n, d
+
+
+# ── RENDERERS ─────────────────────────────────────────────────────────────────
+
+def render_fraction_bar(params: dict) -> str:
+    """params: fractions [{numerator, denominator, label, color}], title,
+    show_total (default False — the total row is drawn as '?')."""
+    fractions = params.get("fractions") or []
+    if not fractions or len(fractions) > 5:
+        raise ValueError("fraction_bar needs 1-5 fractions")
+    rows = [(*_fraction_parts(f), f.get("label", ""), _color(f.get("color"), i))
+            for i, f in enumerate(fractions)]
+    same_denominator = len({d for _, d, _, _ in rows}) == 1
+    if len(rows) > 1 and same_denominator:
+        total = sum(n for n, _, _, _ in rows)
+        denominator = rows[0][1]
+        if total <= denominator:
+            shown = total if params.get("show_total") else 0
+            label = f"Total = {total}/{denominator}" if params.get("show_total") else "Total = ?"
+            rows.append((shown, denominator, label, PALETTE[2]))
+
+    width, label_width, bar_width, row_height, gap = 800, 220, 540, 46, 22
+    body = []
+    y = _title(body, params, width)
+    for n, d, label, color in rows:
+        cell = bar_width / d
+        caption = f"{label} ({n}/{d})" if label and not str(label).startswith("Total") else label or f"{n}/{d}"
+        body.append(_text(label_width - 14, y + row_height / 2 + 6, caption, anchor="end"))
+        for i in range(d):
+            fill = color if i < n else EMPTY_FILL
+            body.append(f"<rect x='{label_width + i * cell:.1f}' y='{y:.1f}' width='{cell:.1f}' "
+                        f"height='{row_height}' fill='{fill}' stroke='{STROKE}' stroke-width='1.5'/>")
+        y += row_height + gap
+    return _svg(width, y + 10, body)
+
+
+def render_number_line(params: dict) -> str:
+    """params: start, end, step (default 1), marks [{value, label, color}], title.
+    Values may be integers, decimals or fractions such as "3/4"."""
+    start, end = _number(params.get("start", 0)), _number(params.get("end", 10))
+    step = _number(params.get("step", 1))
+    if end <= start or step <= 0 or (end - start) / step > 40:
+        raise ValueError("number_line needs start < end and at most 40 steps")
+
+    width, left, right = 800, 50, 750
+    body = []
+    top = _title(body, params, width)
+    marks = params.get("marks") or []
+    axis_y = top + 40 + (40 if marks else 0)
+
+    def x_of(value: Fraction) -> float:
+        return left + float((value - start) / (end - start)) * (right - left)
+
+    body.append(f"<line x1='{left - 20}' y1='{axis_y}' x2='{right + 20}' y2='{axis_y}' "
+                f"stroke='{STROKE}' stroke-width='2'/>")
+    body.append(f"<polygon points='{right + 28},{axis_y} {right + 16},{axis_y - 6} {right + 16},{axis_y + 6}' fill='{STROKE}'/>")
+    body.append(f"<polygon points='{left - 28},{axis_y} {left - 16},{axis_y - 6} {left - 16},{axis_y + 6}' fill='{STROKE}'/>")
+
+    ticks = int((end - start) / step)
+    label_every = max(1, math.ceil(ticks / 16))     # keep tick labels >= ~40px apart
+    for i in range(ticks + 1):
+        value = start + i * step
+        x = x_of(value)
+        body.append(f"<line x1='{x:.1f}' y1='{axis_y - 8}' x2='{x:.1f}' y2='{axis_y + 8}' "
+                    f"stroke='{STROKE}' stroke-width='1.5'/>")
+        if i % label_every == 0 or i == ticks:
+            body.append(_text(x, axis_y + 30, _format_number(value), size=14))
+
+    for index, mark in enumerate(marks):
+        value = _number(mark["value"])
+        if not start <= value <= end:
+            raise ValueError(f"mark {mark['value']} outside the number line")
+        x = x_of(value)
+        color = _color(mark.get("color"), index)
+        label_y = axis_y - 24 - (index % 2) * 22    # alternate heights so neighbours don't collide
+        body.append(f"<circle cx='{x:.1f}' cy='{axis_y}' r='7' fill='{color}' stroke='{STROKE}'/>")
+        if mark.get("label"):
+            body.append(_text(x, label_y, mark["label"], size=14, bold=True, fill=color))
+    return _svg(width, axis_y + 50, body)
+
+
+def render_bar_chart(params: dict) -> str:
+    """params: categories [..], values [..], title, ylabel."""
+    categories = params.get("categories") or []
+    values = [_number(v) for v in params.get("values") or []]
+    if not categories or len(categories) != len(values) or len(categories) > 12:
+        raise ValueError("bar_chart needs 1-12 categories with one value each")
+    if any(v < 0 for v in values):
+        raise ValueError("bar_chart values must be non-negative")
+
+    slot = 110
+    left, plot_height = 80, 220
+    width = max(800, left + slot * len(categories) + 40)
+    body = []
+    top = _title(body, params, width)
+    base_y = top + 20 + plot_height
+    highest = max(values) or 1
+
+    body.append(f"<line x1='{left}' y1='{top + 10}' x2='{left}' y2='{base_y}' stroke='{STROKE}' stroke-width='2'/>")
+    body.append(f"<line x1='{left}' y1='{base_y}' x2='{left + slot * len(categories) + 20}' y2='{base_y}' "
+                f"stroke='{STROKE}' stroke-width='2'/>")
+    if params.get("ylabel"):
+        body.append(f"<text x='24' y='{top + 20 + plot_height / 2:.1f}' {FONT} font-size='14' "
+                    f"text-anchor='middle' transform='rotate(-90 24 {top + 20 + plot_height / 2:.1f})'>"
+                    f"{escape(str(params['ylabel']))}</text>")
+
+    for i, (category, value) in enumerate(zip(categories, values)):
+        bar_height = float(value / highest) * plot_height
+        x = left + 20 + i * slot
+        body.append(f"<rect x='{x}' y='{base_y - bar_height:.1f}' width='{slot - 30}' height='{bar_height:.1f}' "
+                    f"fill='{PALETTE[i % len(PALETTE)]}' stroke='{STROKE}' stroke-width='1.5'/>")
+        body.append(_text(x + (slot - 30) / 2, base_y - bar_height - 8, _format_number(value), size=14, bold=True))
+        body.append(_text(x + (slot - 30) / 2, base_y + 22, category, size=14))
+    return _svg(width, base_y + 40, body)
+
+
+def render_area_model(params: dict) -> str:
+    """params: fraction_a {numerator, denominator} (rows), fraction_b (columns),
+    title. The overlap is shaded but its value is shown as '?'."""
+    na, da = _fraction_parts(params["fraction_a"])
+    nb, db = _fraction_parts(params["fraction_b"])
+
+    width = 800
+    body = []
+    top = _title(body, params, width)
+    grid = 260
+    cell_w, cell_h = grid / db, grid / da
+    left = 120
+    for row in range(da):
+        for col in range(db):
+            if row < na and col < nb:
+                fill = PALETTE[2]
+            elif row < na:
+                fill = PALETTE[0]
+            elif col < nb:
+                fill = PALETTE[1]
+            else:
+                fill = EMPTY_FILL
+            body.append(f"<rect x='{left + col * cell_w:.1f}' y='{top + row * cell_h:.1f}' width='{cell_w:.1f}' "
+                        f"height='{cell_h:.1f}' fill='{fill}' stroke='{STROKE}' stroke-width='1.5'/>")
+    body.append(_text(left - 14, top + grid / 2, f"{na}/{da}", anchor="end", bold=True))
+    body.append(_text(left + grid / 2, top + grid + 26, f"{nb}/{db}", bold=True))
+
+    legend_x = left + grid + 80
+    legend = [(PALETTE[0], f"{na}/{da} of the rows"), (PALETTE[1], f"{nb}/{db} of the columns"),
+              (PALETTE[2], f"Overlap = {na}/{da} x {nb}/{db} = ?")]
+    for i, (fill, label) in enumerate(legend):
+        y = top + 40 + i * 44
+        body.append(f"<rect x='{legend_x}' y='{y - 16}' width='22' height='22' fill='{fill}' stroke='{STROKE}'/>")
+        body.append(_text(legend_x + 34, y, label, anchor="start"))
+    return _svg(width, top + grid + 44, body)
+
+
+def render_pie_chart(params: dict) -> str:
+    """params: slices [{value, label, color}], title. Legend to the right."""
+    slices = params.get("slices") or []
+    values = [float(_number(s["value"])) for s in slices]
+    if not slices or len(slices) > 10 or any(v < 0 for v in values) or sum(values) <= 0:
+        raise ValueError("pie_chart needs 1-10 slices with non-negative values")
+
+    width = 800
+    body = []
+    top = _title(body, params, width)
+    radius = 130
+    cx, cy = 200, top + radius + 10
+    total = sum(values)
+    angle = -math.pi / 2                          # start at 12 o'clock, like startangle=90
+    for i, (piece, value) in enumerate(zip(slices, values)):
+        color = _color(piece.get("color"), i)
+        if value == total:
+            body.append(f"<circle cx='{cx}' cy='{cy:.1f}' r='{radius}' fill='{color}' stroke='{STROKE}' stroke-width='2'/>")
+            break
+        sweep = 2 * math.pi * value / total
+        x1, y1 = cx + radius * math.cos(angle), cy + radius * math.sin(angle)
+        x2, y2 = cx + radius * math.cos(angle + sweep), cy + radius * math.sin(angle + sweep)
+        large = 1 if sweep > math.pi else 0
+        if value > 0:
+            body.append(f"<path d='M {cx} {cy:.1f} L {x1:.1f} {y1:.1f} A {radius} {radius} 0 {large} 1 "
+                        f"{x2:.1f} {y2:.1f} Z' fill='{color}' stroke='{STROKE}' stroke-width='2'/>")
+        angle += sweep
+
+    legend_x = cx + radius + 90
+    for i, piece in enumerate(slices):
+        y = top + 30 + i * 30
+        body.append(f"<rect x='{legend_x}' y='{y - 16}' width='22' height='22' "
+                    f"fill='{_color(piece.get('color'), i)}' stroke='{STROKE}'/>")
+        body.append(_text(legend_x + 34, y, piece.get("label") or _format_number(_number(piece["value"])),
+                          anchor="start"))
+    height = max(cy + radius + 20, top + 30 + len(slices) * 30)
+    return _svg(width, height, body)
+
+
+# ── DISPATCH ──────────────────────────────────────────────────────────────────
+
+RENDERERS: Dict[str, Callable[[dict], str]] = {
+    "fraction_bar": render_fraction_bar,
+    "number_line": render_number_line,
+    "bar_chart": render_bar_chart,
+    "area_model": render_area_model,
+    "pie_chart": render_pie_chart,
+}
+
+
+def render_diagram(diagram_type: str, params) -> Optional[str]:
+    """SVG for a supported diagram type, or None when the type is not
+    templated or the params cannot be drawn (the caller falls back to the model)."""
+    if not isinstance(params, dict) or not params:
+        return None
+    diagram_type = (diagram_type or "").strip().lower()
+    if diagram_type == "bar_model":             # the older generic type: pick by params shape
+        diagram_type = "fraction_bar" if "fractions" in params else "bar_chart"
+    renderer = RENDERERS.get(diagram_type)
+    if renderer is None:
+        return None
+    try:
+        return renderer(params)
+    except (AttributeError, KeyError, IndexError, TypeError, ValueError, ZeroDivisionError,
+            OverflowError) as e:
+        print(f"[SVG Templates] Cannot render {diagram_type} from params ({e}) — falling back to the model")
+        return None
@@ -0,0 +1,155 @@
+# worker.py - Entry point for the ingestion worker process.
+#
+# Runs separately from the web app:
+#     python worker.py
+# Polls the ingestion_job table (services/job_queue.py) and runs up to
+# INGEST_WORKER_CONCURRENCY pipelines at once. Web pods and worker pods can
+# now be scaled independently, and a web deploy never interrupts ingestion.
+#
+# On SIGTERM/SIGINT the worker stops claiming new jobs and lets in-flight ones
+# finish. If it is killed anyway, the jobs' locks expire after
+# INGEST_VISIBILITY_TIMEOUT and another worker picks them up.
+
+import os
+import signal
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from core.config import Base, engine, SessionLocal
+from core.schema import ensure_added_columns
+from services import rag_service
+from services import job_queue
+from services.ingestion_service import run_ingestion_pipeline
+
+
+INGEST_WORKER_CONCURRENCY = int(os.getenv("INGEST_WORKER_CONCURRENCY", "2"))
+INGEST_POLL_SECONDS = float(os.getenv("INGEST_POLL_SECONDS", "5"))
+# How often a running job refreshes its lock — well inside the visibility timeout.
+HEARTBEAT_SECONDS = max(5, job_queue.INGEST_VISIBILITY_TIMEOUT // 3)
+
+WORKER_ID = os.getenv("INGEST_WORKER_ID") or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+_shutdown = threading.Event()
+
+
+# ── ONE JOB ───────────────────────────────────────────────────────────────────
+
+def _heartbeat_loop(job_id: int, done: threading.Event) -> None:
+    while not done.wait(HEARTBEAT_SECONDS):
+        db = SessionLocal()
+        try:
+            if not job_queue.heartbeat(db, job_id, WORKER_ID):
+                # The pipeline's session is fenced (job_queue.fence_session):
+                # its next commit raises JobLockLost and the job stops there.
+                print(f"[Worker] Lost the lock on job {job_id} — another worker reclaimed it; "
+                      f"aborting at the pipeline's next commit.")
+                return
+        except Exception as e:
+            print(f"[Worker] Heartbeat for job {job_id} failed — {e}")
+        finally:
+            db.close()
+
+
+def _run_job(job: dict) -> None:
+    job_id = job["job_id"]
+    done = threading.Event()
+    beat = threading.Thread(target=_heartbeat_loop, args=(job_id, done), daemon=True)
+    beat.start()
+
+    started = time.time()
+    try:
+        run_ingestion_pipeline(
+            job_id=job_id,
+            chapter_id=job["chapter_id"],
+            file_bytes=job["file_bytes"],
+            filename=job["file_name"],
+            file_size=job["file_size"],
+            source_type=job["source_type"],
+            raise_errors=True,
+            worker_id=WORKER_ID,
+        )
+        db = SessionLocal()
+        try:
+            job_queue.complete_job(db, job_id, WORKER_ID)
+        finally:
+            db.close()
+        print(f"[Worker] Job {job_id} done in {time.time() - started:.1f}s.")
+    except job_queue.JobLockLost as e:
+        print(f"[Worker] Job {job_id} abandoned — {e}")
+    except Exception as e:
+        db = SessionLocal()
+        try:
+            job_queue.fail_job(db, job_id, str(e), WORKER_ID)
+        except Exception as inner_e:
+            print(f"[Worker] Could not record failure for job {job_id} — {inner_e}")
+        finally:
+            db.close()
+    finally:
+        done.set()
+
+
+def _claim() -> Optional[dict]:
+    """Claims one job and copies out what the pipeline needs, so the
+    session can be closed before the long-running work starts."""
+    # expire_on_commit=False: the claim commits, and we still read the row after
+    db = SessionLocal(expire_on_commit=False)
+    try:
+        job = job_queue.claim_next_job(db, WORKER_ID)
+        if job is None:
+            return None
+        print(f"[Worker] Claimed job {job.job_id} ('{job.file_name}', attempt {job.attempts}).")
+        return {
+            "job_id": job.job_id,
+            "chapter_id": job.chapter_id,
+            "file_bytes": job.file_data,
+            "file_name": job.file_name,
+            "file_size": job.file_size,
+            "source_type": job.source_type or "nctb",
+        }
+    finally:
+        db.close()
+
+
+# ── MAIN LOOP ─────────────────────────────────────────────────────────────────
+
+def main() -> None:
+    print(f"[Worker] Starting '{WORKER_ID}' with concurrency {INGEST_WORKER_CONCURRENCY}...")
+    Base.metadata.create_all(bind=engine)
+    ensure_added_columns(engine, Base.metadata)
+    rag_service.init_vector_db()
+
+    def _stop(signum, frame):
+        print("[Worker] Shutdown requested — finishing in-flight jobs, not claiming new ones.")
+        _shutdown.set()
+
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+
+    slots = threading.Semaphore(INGEST_WORKER_CONCURRENCY)
+    with ThreadPoolExecutor(max_workers=INGEST_WORKER_CONCURRENCY) as executor:
+        while not _shutdown.is_set():
+            # Only claim when a slot is free, so claimed jobs never sit waiting
+            if not slots.acquire(timeout=INGEST_POLL_SECONDS):
+                continue
+            try:
+                job = _claim()
+            except Exception as e:
+                print(f"[Worker] Claim failed — {e}")
+                job = None
+            if job is None:
+                slots.release()
+                _shutdown.wait(INGEST_POLL_SECONDS)
+                continue
+
+            future = executor.submit(_run_job, job)
+            future.add_done_callback(lambda _: slots.release())
+
+    print("[Worker] Stopped.")
+
+
+if __name__ == "__main__":
+    main()